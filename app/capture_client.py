@@ -0,0 +1,202 @@
+"""
+capture_client.py — The API's handle on the capture daemon.
+
+With CAPTURE_DAEMON_SOCKET set, `serial_logger.serial_logger` is a
+CaptureClient instead of an in-process SerialLogger. It has the calls the
+API and the serial port pool use (start/stop/status/ring/triggers/...)
+and sends each over the daemon's unix control socket, one JSON line each
+way. Session line rings are mapped from shared memory (shm_ring.py), so
+SSE streams and txrx replies read the daemon's data directly.
+
+Every API worker talks to the same daemon, so they all see the same
+sessions, and restarting or scaling the API leaves captures running.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import socket
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import metrics
+from .core.config import settings
+from .raw_capture import PortInRawCapture
+from .shm_ring import ShmLineRing
+from .triggers import TRIGGER_WAIT_MAX_S
+
+CAPTURE_CONTROL_TIMEOUT_S = settings.CAPTURE_CONTROL_TIMEOUT_S
+SERIAL_PORT = settings.SERIAL_PORT
+
+# exception types a daemon error is raised as on this side
+_ERRORS = {"ValueError": ValueError, "KeyError": KeyError, "RuntimeError": RuntimeError,
+           "PortInRawCapture": PortInRawCapture}
+
+
+class CaptureUnavailable(ConnectionError):
+    """The capture daemon can't be reached."""
+
+
+def encode(msg: Any) -> bytes:
+    return json.dumps(msg).encode() + b"\n"
+
+
+class _RemoteSerial:
+    """Write side of a capture's port, for SerialPool: writes go through the daemon."""
+
+    def __init__(self, client: "CaptureClient", port: str, baudrate: int) -> None:
+        self._client = client
+        self.port = port
+        self.baudrate = baudrate
+
+    def write(self, payload: bytes) -> int:
+        self._client.call("write", port=self.port, data=base64.b64encode(payload).decode())
+        return len(payload)
+
+
+class _RemoteTrigger:
+    def __init__(self, status: dict) -> None:
+        self.id = status["trigger_id"]
+        self._status = status
+
+    def status(self) -> dict:
+        return self._status
+
+
+class _RemoteTriggers:
+    """TriggerEngine's read/wait side for one session in the daemon."""
+
+    def __init__(self, client: "CaptureClient", session_id: str, snapshot: dict) -> None:
+        self._client = client
+        self.session_id = session_id
+        self.seq = snapshot["seq"]
+        self.closed = snapshot["closed"]
+        self._triggers = snapshot["triggers"]
+
+    def list(self) -> List[dict]:
+        return self._triggers
+
+    def remove(self, trigger_id: str) -> bool:
+        return self._client.call("remove_trigger", session_id=self.session_id,
+                                 trigger_id=trigger_id)
+
+    async def wait_async(self, ids: Optional[List[str]] = None, after: int = 0,
+                         timeout: float = 30.0) -> Optional[dict]:
+        timeout = min(timeout, TRIGGER_WAIT_MAX_S)
+        result = await self._client.acall(
+            "wait_trigger", timeout=timeout + self._client.timeout,
+            session_id=self.session_id, ids=list(ids) if ids else None,
+            after=after, wait_s=timeout)
+        self.closed = result["closed"]
+        return result["hit"]
+
+
+class CaptureClient:
+    def __init__(self, socket_path: str, timeout: float = CAPTURE_CONTROL_TIMEOUT_S) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._claim_hooks: List[Callable[[str], None]] = []
+        self._rings: Dict[str, ShmLineRing] = {}
+        self._lock = threading.Lock()
+
+    # -------------------------------------------------
+    # control socket
+    # -------------------------------------------------
+    def _result(self, op: str, line: bytes) -> Any:
+        if not line:
+            raise CaptureUnavailable(f"capture daemon closed the connection during {op!r}")
+        reply = json.loads(line)
+        if not reply["ok"]:
+            raise _ERRORS.get(reply.get("type"), RuntimeError)(reply["error"])
+        return reply.get("result")
+
+    def call(self, op: str, timeout: Optional[float] = None, **args: Any) -> Any:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout or self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(encode({"op": op, **args}))
+                with sock.makefile("rb") as f:
+                    line = f.readline()
+        except OSError as e:
+            raise CaptureUnavailable(f"capture daemon at {self.socket_path}: {e}") from None
+        return self._result(op, line)
+
+    async def acall(self, op: str, timeout: Optional[float] = None, **args: Any) -> Any:
+        """call() for the event loop, for long waits that shouldn't hold a thread."""
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.socket_path, limit=1 << 24), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise CaptureUnavailable(f"capture daemon at {self.socket_path}: {e}") from None
+        try:
+            writer.write(encode({"op": op, **args}))
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), timeout or self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise CaptureUnavailable(f"capture daemon at {self.socket_path}: {e}") from None
+        finally:
+            writer.close()
+        return self._result(op, line)
+
+    def _ring(self, name: str) -> Optional[ShmLineRing]:
+        """The mapped ring `name`; None if the daemon has unlinked it meanwhile."""
+        with self._lock:
+            ring = self._rings.get(name)
+            if ring is None:
+                # unmap rings of finished sessions nobody streams any more
+                for old in [r for r in self._rings.values() if r.closed and not r._subs]:
+                    del self._rings[old.name]
+                    old.detach()
+                try:
+                    ring = ShmLineRing(name)
+                except FileNotFoundError:
+                    return None  # the session stopped between the call and the attach
+                self._rings[name] = ring
+            return ring
+
+    # -------------------------------------------------
+    # SerialLogger's interface
+    # -------------------------------------------------
+    def start(self, job_id: str, port: Optional[str] = None, baudrate: Optional[int] = None,
+              mode: str = "lines") -> str:
+        # the daemon can't reach our port pool: let go of the port here first
+        port = port or SERIAL_PORT
+        for hook in self._claim_hooks:
+            hook(port)
+        return self.call("start", job_id=job_id, port=port, baudrate=baudrate, mode=mode)
+
+    def stop(self, session_id: Optional[str] = None, job_id: Optional[str] = None,
+             port: Optional[str] = None) -> str:
+        return self.call("stop", session_id=session_id, job_id=job_id, port=port)
+
+    def status(self, session_id: Optional[str] = None) -> dict:
+        return self.call("status", session_id=session_id)
+
+    def ring(self, session_id: str) -> Optional[ShmLineRing]:
+        info = self.call("ring", session_id=session_id)
+        return self._ring(info["shm"]) if info else None
+
+    def add_claim_hook(self, fn: Callable[[str], None]) -> None:
+        self._claim_hooks.append(fn)
+
+    def capture_for_port(self, port: str) -> Optional[Tuple[_RemoteSerial, ShmLineRing]]:
+        info = self.call("capture_for_port", port=port)
+        ring = self._ring(info["shm"]) if info else None
+        if ring is None:
+            return None
+        return _RemoteSerial(self, port, info["baudrate"]), ring
+
+    def triggers(self, session_id: str) -> Optional[_RemoteTriggers]:
+        snapshot = self.call("triggers", session_id=session_id)
+        return _RemoteTriggers(self, session_id, snapshot) if snapshot else None
+
+    def add_trigger(self, session_id: str, pattern: str, literal: bool = False,
+                    action: Optional[str] = None, name: Optional[str] = None,
+                    since: Optional[int] = None) -> _RemoteTrigger:
+        return _RemoteTrigger(self.call("add_trigger", session_id=session_id, pattern=pattern,
+                                        literal=literal, action=action, name=name, since=since))
+
+    def collect(self) -> List[metrics.Family]:
+        return [tuple(f) for f in self.call("collect")]
@@ -0,0 +1,176 @@
+"""
+capture_daemon.py — Serial capture in a process of its own.
+
+    python -m app.capture_daemon --socket /run/lnt/capture.sock
+
+Runs a SerialLogger whose session line rings live in shared memory
+(shm_ring.py) and serves it on a unix control socket: one JSON request
+per line ({"op": ..., <args>}), one JSON reply per line ({"ok": true,
+"result": ...} or {"ok": false, "error": ..., "type": ...}). API workers
+started with CAPTURE_DAEMON_SOCKET pointing at the same socket use it
+through capture_client.CaptureClient, so any number of them see the same
+sessions and can be restarted without interrupting a capture.
+
+SIGTERM/SIGINT stop every session (flushing its logs) before exiting.
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from .core.config import settings
+from .serial_logger import LOG_DIR, SerialLogger
+from .shm_ring import ShmLineRing
+
+CAPTURE_DAEMON_SOCKET = settings.CAPTURE_DAEMON_SOCKET
+
+
+class CaptureDaemon:
+    def __init__(self, socket_path: str, log_dir: Optional[str] = None,
+                 logger: Optional[SerialLogger] = None) -> None:
+        self.socket_path = socket_path
+        self.logger = logger or SerialLogger(
+            log_dir=log_dir or LOG_DIR,
+            ring_factory=lambda session_id: ShmLineRing(create=True),
+        )
+        self.requests = 0
+        self._ops: Dict[str, Callable[..., Any]] = {
+            "ping": lambda: {"pid": os.getpid()},
+            "start": self.logger.start,
+            "stop": self.logger.stop,
+            "status": self.logger.status,
+            "ring": self._ring,
+            "capture_for_port": self._capture_for_port,
+            "write": self._write,
+            "add_trigger": lambda **kw: self.logger.add_trigger(**kw).status(),
+            "triggers": self._triggers,
+            "remove_trigger": self._remove_trigger,
+            "wait_trigger": self._wait_trigger,
+            "collect": self._collect,
+        }
+        self._server: Optional[socketserver.ThreadingUnixStreamServer] = None
+
+    # -------------------------------------------------
+    # ops
+    # -------------------------------------------------
+    def _ring(self, session_id: str) -> Optional[dict]:
+        ring = self.logger.ring(session_id)
+        return {"shm": ring.name} if ring is not None else None
+
+    def _capture_for_port(self, port: str) -> Optional[dict]:
+        capture = self.logger.capture_for_port(port)
+        if capture is None:
+            return None
+        ser, ring = capture
+        return {"baudrate": ser.baudrate, "shm": ring.name}
+
+    def _write(self, port: str, data: str) -> int:
+        capture = self.logger.capture_for_port(port)
+        if capture is None:
+            raise RuntimeError(f"no running capture on {port}")
+        return capture[0].write(base64.b64decode(data))
+
+    def _engine(self, session_id: str):
+        engine = self.logger.triggers(session_id)
+        if engine is None:
+            raise KeyError(session_id)
+        return engine
+
+    def _triggers(self, session_id: str) -> Optional[dict]:
+        engine = self.logger.triggers(session_id)
+        if engine is None:
+            return None
+        return {"seq": engine.seq, "closed": engine.closed, "triggers": engine.list()}
+
+    def _remove_trigger(self, session_id: str, trigger_id: str) -> bool:
+        return self._engine(session_id).remove(trigger_id)
+
+    def _wait_trigger(self, session_id: str, ids: Optional[List[str]], after: int,
+                      wait_s: float) -> dict:
+        engine = self._engine(session_id)
+        hit = engine.wait(ids, after, wait_s)
+        return {"hit": hit, "closed": engine.closed}
+
+    def _collect(self) -> list:
+        return [(name, kind, help, list(samples))
+                for name, kind, help, samples in self.logger.collect()]
+
+    def handle(self, request: dict) -> dict:
+        self.requests += 1
+        try:
+            op = self._ops.get(request.pop("op", None))
+            if op is None:
+                raise ValueError(f"unknown op (expected one of {', '.join(self._ops)})")
+            return {"ok": True, "result": op(**request)}
+        except Exception as e:
+            return {"ok": False, "error": str(e), "type": type(e).__name__}
+
+    # -------------------------------------------------
+    # control socket
+    # -------------------------------------------------
+    def serve(self) -> socketserver.ThreadingUnixStreamServer:
+        """Bind the control socket and serve it on a background thread."""
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                    except ValueError as e:
+                        reply = {"ok": False, "error": f"bad request: {e}", "type": "ValueError"}
+                    else:
+                        reply = daemon.handle(request)
+                    self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # left behind by a daemon that died
+        server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        server.daemon_threads = True
+        self._server = server
+        threading.Thread(target=server.serve_forever, name="CaptureControl", daemon=True).start()
+        return server
+
+    def close(self) -> None:
+        """Stop serving, then every capture session."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+        self.logger.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--socket", default=CAPTURE_DAEMON_SOCKET or None,
+                    help="control socket path (default: CAPTURE_DAEMON_SOCKET)")
+    ap.add_argument("--log-dir", default=LOG_DIR)
+    args = ap.parse_args(argv)
+    if not args.socket:
+        ap.error("--socket or CAPTURE_DAEMON_SOCKET is required")
+
+    daemon = CaptureDaemon(args.socket, log_dir=args.log_dir)
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    daemon.serve()
+    print(f"capture daemon pid={os.getpid()} listening on {args.socket}", flush=True)
+    while not stop.wait(1.0):
+        pass
+    daemon.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,115 @@
-from pydantic_settings import BaseSettings
+"""
+config.py — The app's configuration, in one place.
+
+Every setting is read from the environment (after `.env` is loaded into
+it) the first time `settings` is touched, not when this module is
+imported, and only once per process. Modules copy what they need into
+their own constants at import:
+
+    from .core.config import settings
+    LOG_FLUSH_BYTES = settings.LOG_FLUSH_BYTES
+
+A few switches are still read from os.environ on each use because they
+are meant to be flipped on a running host (ALLOW_FLASH, FLASH_TOOL and
+the flash tool paths); loading `.env` here makes them visible there too.
+"""
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
+    # DUT inventory (services/usb.py)
     MOCK_DUTS: bool = False
     DEVICE_FILTERS: str | None = None  # "vid:pid,vid:pid" (hex, no 0x)
-    LOG_DIR: str = "./data/logs"
+    # full rescan interval while /dev is watched, and poll interval without a watch
+    DUT_INVENTORY_RESYNC_S: float = 300.0
+    DUT_INVENTORY_POLL_S: float = 2.0
+    SYSFS_ROOT: str = "/sys"
+
+    # serial capture and the port pool
+    SERIAL_PORT: str = "/dev/cu.usbmodemL1100WEU4"
+    SERIAL_BAUDRATE: int = 115200
     SERIAL_BAUD: int = 115200
+    LOG_DIR: str = "logs"
+    SERIAL_POOL_IDLE_S: float = 60.0
+    SERIAL_TXRX_TIMEOUT_S: float = 1.0
+    SERIAL_SCRIPT_MAX_STEPS: int = 1000
+    TRIGGER_HIT_HISTORY: int = 1024
+    TRIGGER_WAIT_MAX_S: float = 300.0
+    TRIGGER_RETAIN_S: float = 600.0  # triggers/hits of stopped sessions stay waitable this long
+
+    # log writer, files and reads
+    LOG_FLUSH_BYTES: int = 64 * 1024
+    LOG_FLUSH_INTERVAL_MS: int = 200
+    LOG_QUEUE_SIZE: int = 4096
+    LOG_QUEUE_PUT_TIMEOUT_MS: int = 10
+    LOG_FSYNC: bool = False
+    VARS_STORE: bool = True
+    LOG_COMPRESS: str = "none"
+    LOG_COMPRESS_LEVEL: int = 6
+    LOG_FRAME_BYTES: int = 256 * 1024
+    LOG_ROTATE_BYTES: int = 0
+    LOG_ROTATE_S: float = 0.0
+    LOG_JOB_BUDGET_BYTES: int = 0
+    LOG_DIR_BUDGET_BYTES: int = 0
+    LOG_INDEX_STRIDE: int = 64 * 1024
+    LOG_RANGE_MAX_LINES: int = 10000
+    LOG_MERGE_LAG_S: float = 0.5  # how long a merge waits on idle live sessions
+    RAW_RANGE_MAX_BYTES: int = 16 * 1024 * 1024
+    VARS_AGG_CHUNK_ROWS: int = 1 << 20
+    VARS_AGG_MAX_POINTS: int = 10000
+    VARS_AGG_CACHE_ENTRIES: int = 64
+    VARS_AGG_CACHE_BUCKETS: int = 1 << 16
+
+    # live streams
+    STREAM_RING_SIZE: int = 16384
+    STREAM_MAX_LAG: int = 8192
+    STREAM_BATCH: int = 512
+    STREAM_KEEPALIVE_S: float = 15.0
+    STREAM_POLL_S: float = 0.02  # longest sleep between polls of a shared-memory ring
+
+    # capture daemon; empty socket: capture runs inside the API process
+    CAPTURE_DAEMON_SOCKET: str = ""
+    CAPTURE_CONTROL_TIMEOUT_S: float = 5.0
+    CAPTURE_SHM_BYTES: int = 8 * 1024 * 1024
+
+    # flashing
+    FLASH_MAX_PARALLEL: int = 4
+    FLASH_TIMEOUT_S: float = 180.0
+    FLASH_JOB_HISTORY: int = 100
+    FLASH_OUTPUT_LINES: int = 4096
+    FIRMWARE_STORE_DIR: str = "firmware_store"
+    FIRMWARE_STORE_MAX_BYTES: int = 2 * 1024 ** 3  # 0 = keep every image
+
+    # USB/IP export/attach
+    USBIP_BIN: str = "usbip"
+    USBIP_TIMEOUT_S: float = 15.0
+    USBIP_MAX_PARALLEL: int = 8
+    USBIP_RECONCILE_S: float = 30.0  # 0 disables the background reconcile
+
+    # Pis
+    PI_HOST: str = "http://192.168.1.78:8001"
+    PI_HOSTS: str = ""  # comma-separated base URLs; falls back to PI_HOST
+    PI_CONNECT_TIMEOUT_S: float = 1.0
+    PI_TIMEOUT_S: float = 5.0
+    PI_POOL_SIZE: int = 8
+    PI_HEARTBEAT_S: float = 5.0
+    PI_HEARTBEAT_TIMEOUT_S: float = 2.0
+    PI_DOWN_AFTER: int = 1
+    DUTS_CACHE_TTL_S: float = 2.0
+    DUTS_CACHE_STALE_S: float = 30.0
+
+    # .env also carries keys read elsewhere (ALLOW_FLASH, FLASH_TOOL, ...)
+    model_config = SettingsConfigDict(extra="ignore")
 
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    load_dotenv()
+    return Settings()
 
-settings = Settings()
+def __getattr__(name: str):
+    # `settings` is built on first access, not at import
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,7 +3,11 @@ import os
 import shlex
 import subprocess
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+# lock key of flashes whose command can't name a probe: they all drive the
+# one configured in CCXML_PATH/OPENOCD_CFG, so they must not overlap
+DEFAULT_PROBE = "default"
 
 class FlashError(Exception):
     pass
@@ -14,9 +18,24 @@ def _assert_file(path: str) -> Path:
         raise FlashError(f"Firmware not found: {p}")
     return p
 
-def build_flash_cmd(tool: str | None, port: str | None, firmware: str) -> List[str]:
+def flash_tool(tool: str | None) -> str:
+    return (tool or os.getenv("FLASH_TOOL") or "dslite").lower()
+
+def probe_serial(dut_id: str) -> Optional[str]:
+    """USB serial number of the local DUT `dut_id` (id or device path), or None."""
+    from .services.usb import list_duts
+
+    for dut in list_duts():
+        if dut_id in (dut.id, dut.device):
+            return dut.serial or None
+    return None
+
+def build_flash_cmd(tool: str | None, port: str | None, firmware: str,
+                    probe: str | None = None) -> List[str]:
     """
     Build a flashing command. Supports DSLite (TI) or OpenOCD via env.
+    With `probe` (a debug probe's serial number) OpenOCD programs through
+    that probe only; DSLite takes its probe from the CCXML and ignores it.
     Env:
       FLASH_TOOL = 'dslite' | 'openocd'
       DSLITE_PATH (optional)  e.g. /Applications/ti/ccs2031/ccs/ccs_base/DebugServer/bin/DSLite
@@ -25,7 +44,7 @@ def build_flash_cmd(tool: str | None, port: str | None, firmware: str) -> List[s
       OPENOCD_CFG (required for openocd) e.g. interface/xds110.cfg,target/cc13x2.cfg
     """
     fw = _assert_file(firmware)
-    which = (tool or os.getenv("FLASH_TOOL") or "dslite").lower()
+    which = flash_tool(tool)
 
     if which == "dslite":
         dslite = os.getenv("DSLITE_PATH", "DSLite")
@@ -42,10 +61,13 @@ def build_flash_cmd(tool: str | None, port: str | None, firmware: str) -> List[s
         args: list[str] = []
         for c in cfgs.split(","):
             args += ["-f", c]
+        if probe:
+            args += ["-c", f"adapter serial {shlex.quote(probe)}"]
         return [openocd, *args, "-c", f"program {shlex.quote(str(fw))} verify reset exit"]
 
     raise FlashError(f"Unknown FLASH_TOOL '{which}'")
 
 def run_command(cmd: List[str], timeout: int = 180) -> Dict[str, Any]:
     proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
-    return {"returncode": proc.returncode, "stdout": proc.stdout, "stderr": proc.stderr}
+    return {"ok": proc.returncode == 0, "returncode": proc.returncode,
+            "stdout": proc.stdout, "stderr": proc.stderr}
@@ -0,0 +1,176 @@
+"""
+duts_cache.py — Cache in front of the Pis' /duts, for dashboards that poll.
+
+Each Pi's last answer is kept with its ETag and age:
+
+- younger than DUTS_CACHE_TTL_S: served as is, the Pi isn't contacted;
+- older, but within DUTS_CACHE_STALE_S more: served as is, and one
+  background refresh is started (stale-while-revalidate);
+- older still, or never fetched: the caller waits for a fetch.
+
+A refresh sends If-None-Match, so an unchanged Pi answers 304 with no
+body. There is at most one request in flight per Pi: concurrent misses
+all wait on the same fetch. A failed fetch is not retried for a TTL,
+so a dead Pi isn't hammered by every poll either. With many dashboards
+polling every second a Pi sees about one conditional GET per TTL.
+
+The merged answer carries its own ETag (from each Pi's version and
+health), so the dashboards can make conditional requests too.
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import metrics
+from .core.config import settings
+from .pi_client import PI_REQUEST_SECONDS, PiClient, pi_client
+from .pi_registry import pi_registry
+
+# answers younger than this are served without contacting the Pi
+DUTS_CACHE_TTL_S = settings.DUTS_CACHE_TTL_S
+# after the TTL, how much longer a stale answer is served while refreshing
+DUTS_CACHE_STALE_S = settings.DUTS_CACHE_STALE_S
+
+DUTS_CACHE = metrics.counter(
+    "duts_cache_lookups_total", "Per-Pi /duts cache lookups", ("result",))
+_FRESH, _STALE, _MISS = (DUTS_CACHE.labels(r) for r in ("fresh", "stale", "miss"))
+
+
+class _Entry:
+    def __init__(self) -> None:
+        self.duts: Optional[List[Any]] = None
+        self.etag: Optional[str] = None
+        self.fetched: Optional[float] = None  # monotonic time of the last good answer
+        self.attempted: Optional[float] = None
+        self.ok = False
+        self.error: Optional[str] = None
+        self.elapsed_ms: Optional[float] = None
+        self.version = 0
+        self.inflight: Optional[Future] = None
+
+
+class DutsCache:
+    def __init__(self, client: Optional[PiClient] = None,
+                 ttl: float = DUTS_CACHE_TTL_S, stale: float = DUTS_CACHE_STALE_S,
+                 on_update: Optional[Callable[[str, List[Any], Optional[str]], None]] = None,
+                 ) -> None:
+        self._client = client or pi_client
+        self.ttl = ttl
+        self.stale = stale
+        self._on_update = on_update
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}
+        self.fetches = 0
+        self.not_modified = 0
+
+    def _fetch(self, host: str, entry: _Entry, timeout: Optional[float]) -> None:
+        t0 = time.monotonic()
+        outcome = "error"
+        try:
+            headers = {"If-None-Match": entry.etag} if entry.etag and entry.duts is not None else {}
+            resp = self._client.request(host, "GET", "/duts", timeout, headers=headers)
+            if resp.status_code == 304:
+                outcome = "not_modified"
+                duts, etag = entry.duts, entry.etag
+            else:
+                resp.raise_for_status()
+                data = resp.json()
+                duts = (data.get("duts", []) if isinstance(data, dict) else data) or []
+                etag = resp.headers.get("ETag")
+                outcome = "ok"
+        except Exception as e:
+            with self._lock:
+                entry.ok = False
+                entry.error = str(e)
+        else:
+            with self._lock:
+                if outcome == "not_modified":
+                    self.not_modified += 1
+                elif duts != entry.duts:
+                    entry.version += 1
+                entry.duts, entry.etag = duts, etag
+                entry.fetched = time.monotonic()
+                entry.ok, entry.error = True, None
+            if outcome == "ok" and self._on_update is not None:
+                self._on_update(host, duts, etag)
+        finally:
+            elapsed = time.monotonic() - t0
+            PI_REQUEST_SECONDS.labels(host, outcome).observe(elapsed)
+            with self._lock:
+                entry.elapsed_ms = round(elapsed * 1000, 1)
+                entry.inflight = None
+                self.fetches += 1
+
+    def _refresh(self, host: str, entry: _Entry, timeout: Optional[float]) -> Future:
+        # caller holds the lock
+        if entry.inflight is None:
+            entry.attempted = time.monotonic()
+            entry.inflight = self._client.submit(self._fetch, host, entry, timeout)
+        return entry.inflight
+
+    def get(self, hosts: Optional[List[str]] = None,
+            timeout: Optional[float] = None) -> Tuple[str, Dict[str, Any]]:
+        """(etag, {"duts", "pis"}): every Pi's DUTs tagged with the Pi, from cache where possible."""
+        hosts = hosts or self._client.hosts
+        now = time.monotonic()
+        waits: List[Future] = []
+        with self._lock:
+            entries = [(h, self._entries.setdefault(h, _Entry())) for h in hosts]
+            for host, entry in entries:
+                age = now - entry.fetched if entry.fetched is not None else None
+                retry = entry.attempted is None or now - entry.attempted >= self.ttl
+                if age is not None and age < self.ttl:
+                    _FRESH.inc()
+                elif age is not None and age < self.ttl + self.stale:
+                    _STALE.inc()
+                    if retry:
+                        self._refresh(host, entry, timeout)
+                else:
+                    _MISS.inc()
+                    if entry.inflight is not None:
+                        waits.append(entry.inflight)
+                    elif retry:
+                        waits.append(self._refresh(host, entry, timeout))
+        if waits:
+            wait(waits, timeout=self._client.connect_timeout + (timeout or self._client.timeout) + 0.5)
+
+        now = time.monotonic()
+        duts: List[Dict[str, Any]] = []
+        pis: List[Dict[str, Any]] = []
+        tag: List[str] = []
+        with self._lock:
+            for host, entry in entries:
+                age = now - entry.fetched if entry.fetched is not None else None
+                usable = age is not None and age < self.ttl + self.stale
+                pi = {"pi": host, "ok": usable,
+                      "age_s": round(age, 3) if age is not None else None,
+                      "elapsed_ms": entry.elapsed_ms}
+                if usable:
+                    for dut in entry.duts:
+                        duts.append({**dut, "pi": host})
+                    pi["count"] = len(entry.duts)
+                if entry.error is not None:
+                    pi["error"] = entry.error
+                elif not usable:
+                    pi["error"] = "timed out"
+                pis.append(pi)
+                tag.append(f"{host}={entry.version if usable else '-'}")
+        etag = '"' + hashlib.blake2b("|".join(tag).encode(), digest_size=8).hexdigest() + '"'
+        return etag, {"duts": duts, "pis": pis}
+
+    def status(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            pis = [{"pi": h, "ok": e.ok, "etag": e.etag, "version": e.version,
+                    "age_s": round(now - e.fetched, 3) if e.fetched is not None else None,
+                    "refreshing": e.inflight is not None, "error": e.error}
+                   for h, e in self._entries.items()]
+        return {"ttl_s": self.ttl, "stale_s": self.stale, "fetches": self.fetches,
+                "not_modified": self.not_modified, "pis": pis}
+
+
+duts_cache = DutsCache(on_update=pi_registry.observe)
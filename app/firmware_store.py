@@ -0,0 +1,198 @@
+"""
+firmware_store.py — Content-addressed firmware cache.
+
+Images are identified by SHA-256. Hashing is incremental (fixed-size
+chunks, never the whole file in memory) and memoized by (path, mtime,
+size), so re-flashing an unchanged build costs a stat(), not a re-read.
+
+    FIRMWARE_STORE_DIR/
+        objects/<sha256><ext>   immutable copy of each image seen
+        last_flashed.json       {dut_id: {"sha256", "firmware", "flashed_at"}}
+
+The store also remembers which image each DUT was last flashed with
+successfully, so a request for the same image can be skipped unless the
+caller forces it.
+
+Objects beyond FIRMWARE_STORE_MAX_BYTES are pruned least recently used
+first (put() refreshes an object's mtime), except images some DUT was
+last flashed with and images pinned by queued flashes.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .core.config import settings
+
+FIRMWARE_STORE_DIR = settings.FIRMWARE_STORE_DIR
+FIRMWARE_STORE_MAX_BYTES = settings.FIRMWARE_STORE_MAX_BYTES
+_CHUNK = 1024 * 1024
+_MEMO_MAX = 256
+
+
+class FirmwareStore:
+    def __init__(self, root: str = FIRMWARE_STORE_DIR,
+                 max_bytes: int = FIRMWARE_STORE_MAX_BYTES) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._objects = self.root / "objects"
+        self._state_path = self.root / "last_flashed.json"
+        self._lock = threading.Lock()
+        self._memo: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self._last: Optional[Dict[str, dict]] = None
+        self._pins: Counter = Counter()
+        self.hash_hits = 0
+        self.hash_misses = 0
+        self.pruned = 0
+
+    # -------------------------------------------------
+    # hashing
+    # -------------------------------------------------
+    def sha256(self, path: str) -> str:
+        p = Path(path).expanduser().resolve()
+        st = p.stat()
+        key = (str(p), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            digest = self._memo.get(key)
+            if digest is not None:
+                self._memo.move_to_end(key)
+                self.hash_hits += 1
+                return digest
+
+        h = hashlib.sha256()
+        with open(p, "rb") as f:
+            while True:
+                chunk = f.read(_CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+        digest = h.hexdigest()
+
+        with self._lock:
+            self.hash_misses += 1
+            self._memo[key] = digest
+            while len(self._memo) > _MEMO_MAX:
+                self._memo.popitem(last=False)
+        return digest
+
+    # -------------------------------------------------
+    # objects
+    # -------------------------------------------------
+    def put(self, path: str, pin: bool = False) -> Tuple[str, str]:
+        """
+        Add an image to the store; returns (sha256, stored path). With `pin`
+        the object isn't pruned until unpin(sha256).
+        """
+        digest = self.sha256(path)
+        src = Path(path).expanduser().resolve()
+        dst = self._objects / f"{digest}{src.suffix.lower()}"
+        if pin:
+            with self._lock:
+                self._pins[digest] += 1
+        if dst.exists():
+            os.utime(dst)  # most recently used
+        else:
+            self._objects.mkdir(parents=True, exist_ok=True)
+            tmp = dst.with_name(dst.name + f".tmp{os.getpid()}")
+            shutil.copyfile(src, tmp)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, dst)
+        self.prune(keep=digest)
+        return digest, str(dst)
+
+    def unpin(self, digest: str) -> None:
+        with self._lock:
+            self._pins[digest] -= 1
+            if self._pins[digest] <= 0:
+                del self._pins[digest]
+
+    def prune(self, keep: Optional[str] = None) -> int:
+        """
+        Remove least recently used objects no DUT or queued flash needs
+        (nor `keep`, an image just added); returns bytes freed.
+        """
+        if self.max_bytes <= 0:
+            return 0
+        try:
+            entries = [(e.stat().st_mtime, e.stat().st_size, e) for e in os.scandir(self._objects)
+                       if e.is_file() and ".tmp" not in e.name]
+        except FileNotFoundError:
+            return 0
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        with self._lock:
+            needed = {d["sha256"] for d in self._load().values()} | set(self._pins) | {keep}
+            for _, size, entry in sorted(entries, key=lambda e: e[0]):
+                if total <= self.max_bytes:
+                    break
+                if entry.name.split(".", 1)[0] in needed:
+                    continue
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                freed += size
+                self.pruned += 1
+        return freed
+
+    # -------------------------------------------------
+    # last flashed image per DUT
+    # -------------------------------------------------
+    def _load(self) -> Dict[str, dict]:
+        if self._last is None:
+            try:
+                with open(self._state_path, encoding="utf-8") as f:
+                    self._last = json.load(f)
+            except (FileNotFoundError, ValueError):
+                self._last = {}
+        return self._last
+
+    def _save(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self._state_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._last, f, indent=2)
+        os.replace(tmp, self._state_path)
+
+    def last_flashed(self, dut_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._load().get(dut_id)
+
+    def is_current(self, dut_id: str, digest: str) -> bool:
+        last = self.last_flashed(dut_id)
+        return bool(last and last.get("sha256") == digest)
+
+    def record_flash(self, dut_id: str, digest: str, firmware: str) -> None:
+        with self._lock:
+            self._load()[dut_id] = {"sha256": digest, "firmware": firmware,
+                                    "flashed_at": time.time()}
+            self._save()
+
+    def forget(self, dut_id: str) -> None:
+        """The DUT's image is unknown (failed/cancelled flash, manual reflash)."""
+        with self._lock:
+            if self._load().pop(dut_id, None) is not None:
+                self._save()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "root": str(self.root),
+                "hash_hits": self.hash_hits,
+                "hash_misses": self.hash_misses,
+                "pinned": len(self._pins),
+                "pruned": self.pruned,
+                "max_bytes": self.max_bytes,
+                "last_flashed": dict(self._load()),
+            }
+
+
+firmware_store = FirmwareStore()
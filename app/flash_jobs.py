@@ -0,0 +1,230 @@
+"""
+flash_jobs.py — Queue of flash jobs run as asyncio subprocesses.
+
+Each job runs a command from build_flash_cmd() without blocking a worker
+thread. Concurrency is limited twice: one job per debug probe (a probe can
+only program one target at a time) and FLASH_MAX_PARALLEL per Pi (USB
+bandwidth / CPU). Jobs on different probes run side by side, so flashing
+eight boards takes about as long as flashing one.
+
+stdout/stderr are published line by line into a LineRing, so clients can
+follow progress over SSE with the same resume semantics as serial streams.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from . import metrics
+from .core.config import settings
+from .line_stream import LineRing
+
+FLASH_MAX_PARALLEL = settings.FLASH_MAX_PARALLEL
+FLASH_TIMEOUT_S = settings.FLASH_TIMEOUT_S
+# finished jobs kept for status queries
+FLASH_JOB_HISTORY = settings.FLASH_JOB_HISTORY
+# lines of output kept per job
+FLASH_OUTPUT_LINES = settings.FLASH_OUTPUT_LINES
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED, SKIPPED = (
+    "queued", "running", "succeeded", "failed", "cancelled", "skipped",
+)
+_DONE = (SUCCEEDED, FAILED, CANCELLED, SKIPPED)
+
+_job_ids = itertools.count(1)
+
+FLASH_SECONDS = metrics.histogram(
+    "flash_duration_seconds", "Run time of flash jobs that started", ("state",))
+FLASH_JOBS = metrics.counter(
+    "flash_jobs_total", "Flash jobs by final state", ("state",))
+
+
+class FlashJob:
+    def __init__(self, cmd: List[str], probe: str, dut_id: Optional[str] = None,
+                 on_done: Optional[Callable[["FlashJob"], None]] = None,
+                 skip_if: Optional[Callable[["FlashJob"], bool]] = None) -> None:
+        self.id = f"flash-{next(_job_ids)}"
+        self.cmd = cmd
+        self.probe = probe
+        self.dut_id = dut_id
+        self.on_done = on_done
+        self.skip_if = skip_if
+        self.state = QUEUED
+        self.returncode: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.output = LineRing(capacity=FLASH_OUTPUT_LINES)
+        self._task: Optional[asyncio.Task] = None
+        self._proc: Optional[asyncio.subprocess.Process] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in _DONE
+
+    def status(self) -> dict:
+        return {
+            "job_id": self.id,
+            "dut_id": self.dut_id,
+            "probe": self.probe,
+            "command": self.cmd,
+            "state": self.state,
+            "ok": self.state == SUCCEEDED,
+            "returncode": self.returncode,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "duration_s": round(self.finished - self.started, 3)
+            if self.started and self.finished else None,
+            "output_lines": self.output.head,
+        }
+
+    def tail(self, n: int = 50) -> List[str]:
+        return [line for _, _, line in self.output.read(max(0, self.output.head - n), n)]
+
+
+class FlashScheduler:
+    def __init__(self, max_parallel: int = FLASH_MAX_PARALLEL,
+                 timeout_s: float = FLASH_TIMEOUT_S) -> None:
+        self.max_parallel = max_parallel
+        self.timeout_s = timeout_s
+        self._jobs: "OrderedDict[str, FlashJob]" = OrderedDict()
+        self._probe_locks: Dict[str, asyncio.Lock] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def submit(self, cmd: List[str], probe: str, dut_id: Optional[str] = None,
+               on_done: Optional[Callable[[FlashJob], None]] = None,
+               skip_if: Optional[Callable[[FlashJob], bool]] = None) -> FlashJob:
+        """
+        Queue a job; must be called from the event loop. `on_done(job)` runs
+        once it ends. `skip_if(job)` is asked once the job holds its probe,
+        right before running: True ends it as skipped (e.g. the DUT already
+        has the image, which a job queued ahead may just have written).
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_parallel)
+        job = FlashJob(cmd, probe, dut_id, on_done, skip_if)
+        self._jobs[job.id] = job
+        self._prune()
+        job._task = asyncio.create_task(self._run(job), name=job.id)
+        return job
+
+    def get(self, job_id: str) -> Optional[FlashJob]:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> List[FlashJob]:
+        return list(self._jobs.values())
+
+    def _prune(self) -> None:
+        finished = [j for j in self._jobs.values() if j.done]
+        for job in finished[: max(0, len(finished) - FLASH_JOB_HISTORY)]:
+            del self._jobs[job.id]
+
+    async def cancel(self, job_id: str) -> Optional[FlashJob]:
+        job = self._jobs.get(job_id)
+        if job is None or job.done:
+            return job
+        if job._task is not None:
+            job._task.cancel()
+            try:
+                await job._task
+            except asyncio.CancelledError:
+                pass
+        return job
+
+    async def wait(self, job_id: str) -> Optional[FlashJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and job._task is not None:
+            await asyncio.shield(job._task)
+        return job
+
+    async def _run(self, job: FlashJob) -> None:
+        lock = self._probe_locks.setdefault(job.probe, asyncio.Lock())
+        try:
+            async with lock, self._slots:
+                if job.skip_if is not None and job.skip_if(job):
+                    job.state = SKIPPED
+                    return
+                job.state = RUNNING
+                job.started = time.time()
+                await self._exec(job)
+        except asyncio.CancelledError:
+            job.state = CANCELLED
+        except Exception as e:
+            job.state = FAILED
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            job.output.close()
+            FLASH_JOBS.labels(job.state).inc()
+            if job.started is not None:
+                FLASH_SECONDS.labels(job.state).observe(job.finished - job.started)
+            if job.on_done is not None:
+                try:
+                    job.on_done(job)
+                except Exception as e:
+                    job.error = job.error or f"on_done failed: {e}"
+
+    async def _exec(self, job: FlashJob) -> None:
+        job._proc = proc = await asyncio.create_subprocess_exec(
+            *job.cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        io = asyncio.gather(
+            _pump(proc.stdout, job.output, ""),
+            _pump(proc.stderr, job.output, "[stderr] "),
+            proc.wait(),
+        )
+        try:
+            # shielded so a timeout/cancel doesn't tear the pumps down
+            # before the process has been stopped and its pipes drained
+            await asyncio.wait_for(asyncio.shield(io), self.timeout_s)
+        except asyncio.TimeoutError:
+            await _terminate(proc, io)
+            job.returncode = proc.returncode
+            job.state = FAILED
+            job.error = f"timed out after {self.timeout_s:g}s"
+            return
+        except asyncio.CancelledError:
+            await _terminate(proc, io)
+            job.returncode = proc.returncode
+            raise
+        job.returncode = proc.returncode
+        job.state = SUCCEEDED if proc.returncode == 0 else FAILED
+
+
+async def _pump(stream: Optional[asyncio.StreamReader], ring: LineRing, prefix: str) -> None:
+    if stream is None:
+        return
+    while True:
+        raw = await stream.readline()
+        if not raw:
+            return
+        line = raw.decode(errors="replace").rstrip()
+        if line:
+            ring.publish(datetime.utcnow().isoformat(), [prefix + line])
+
+
+async def _terminate(proc: asyncio.subprocess.Process, io: asyncio.Future,
+                     grace: float = 3.0) -> None:
+    if proc.returncode is None:
+        proc.terminate()
+        try:
+            await asyncio.wait_for(proc.wait(), grace)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+    try:
+        await asyncio.wait_for(io, grace)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        pass
+
+
+flash_scheduler = FlashScheduler()
@@ -0,0 +1,178 @@
+"""
+line_stream.py — In-memory ring buffer of decoded serial lines with
+fan-out to any number of live subscribers (served as SSE by app.main).
+
+The capture reactor is the only producer. publish() copies references into
+a preallocated ring under a short lock and pokes idle subscribers; it never
+waits on a consumer. Each subscriber keeps its own cursor (a sequence
+number), so a slow one only falls behind: once its lag exceeds `max_lag`
+lines, or the lines it still needs have been overwritten, it is told so
+and disconnected.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import threading
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from .core.config import settings
+
+STREAM_RING_SIZE = settings.STREAM_RING_SIZE
+# a subscriber further behind than this many lines is disconnected
+STREAM_MAX_LAG = settings.STREAM_MAX_LAG
+STREAM_BATCH = settings.STREAM_BATCH
+STREAM_KEEPALIVE_S = settings.STREAM_KEEPALIVE_S
+
+Entry = Tuple[int, str, str]  # (seq, ts, line)
+
+_sub_ids = itertools.count(1)
+
+
+class Subscriber:
+    def __init__(self, ring: "LineRing", cursor: int, loop: asyncio.AbstractEventLoop) -> None:
+        self.id = next(_sub_ids)
+        self.cursor = cursor
+        self.max_lag_seen = 0
+        self._ring = ring
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._armed = False
+
+    @property
+    def lag(self) -> int:
+        return self._ring.head - self.cursor
+
+    def _wake(self) -> None:
+        # reactor thread; at most one wakeup is in flight per subscriber
+        if self._armed:
+            self._armed = False
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self, timeout: float) -> bool:
+        """Sleep until new lines arrive (True) or `timeout` passes (False)."""
+        self._event.clear()
+        self._armed = True
+        if self._ring.head > self.cursor or self._ring.closed:
+            self._armed = False
+            return True
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._armed = False
+
+    def status(self) -> dict:
+        return {"id": self.id, "cursor": self.cursor, "lag": self.lag,
+                "max_lag": self.max_lag_seen}
+
+
+class LineRing:
+    """Fixed-capacity ring; sequence numbers start at 1 and never repeat."""
+
+    def __init__(self, capacity: int = STREAM_RING_SIZE) -> None:
+        self.capacity = capacity
+        self._slots: List[Optional[Entry]] = [None] * capacity
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self.head = 0  # seq of the newest entry
+        self.closed = False
+        self._subs: Dict[int, Subscriber] = {}
+        self.slow_disconnects = 0
+
+    @property
+    def oldest(self) -> int:
+        return max(1, self.head - self.capacity + 1)
+
+    def publish(self, ts: str, lines: List[str]) -> None:
+        with self._lock:
+            seq = self.head
+            for line in lines:
+                seq += 1
+                self._slots[seq % self.capacity] = (seq, ts, line)
+            self.head = seq
+            self._cond.notify_all()
+        for sub in list(self._subs.values()):
+            sub._wake()
+
+    def close(self) -> None:
+        with self._lock:
+            self.closed = True
+            self._cond.notify_all()
+        for sub in list(self._subs.values()):
+            sub._wake()
+
+    def read(self, since: int, limit: int) -> List[Entry]:
+        """Entries with seq > since (at most `limit`); callers check `oldest` for gaps."""
+        with self._lock:
+            first = max(since + 1, self.oldest)
+            last = min(self.head, first + limit - 1)
+            return [self._slots[s % self.capacity] for s in range(first, last + 1)]
+
+    def wait_after(self, since: int, timeout: float, limit: int = STREAM_BATCH) -> List[Entry]:
+        """Blocking read for plain threads: waits up to `timeout` for seq > since."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.head > since or self.closed, timeout)
+        return self.read(since, limit)
+
+    def subscribe(self, since: Optional[int]) -> Subscriber:
+        cursor = self.head if since is None else max(0, since)
+        sub = Subscriber(self, cursor, asyncio.get_running_loop())
+        self._subs[sub.id] = sub
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self._subs.pop(sub.id, None)
+
+    def status(self) -> dict:
+        return {
+            "head": self.head,
+            "oldest": self.oldest if self.head else 0,
+            "capacity": self.capacity,
+            "subscribers": [s.status() for s in list(self._subs.values())],
+            "slow_disconnects": self.slow_disconnects,
+        }
+
+
+def _event(name: str, data: dict, seq: Optional[int] = None) -> str:
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+async def sse_events(ring: LineRing, since: Optional[int] = None,
+                     max_lag: int = STREAM_MAX_LAG) -> AsyncIterator[str]:
+    """
+    Server-sent events for one subscriber. `since` resumes after that
+    sequence number (0 = everything still in the ring, None = live only).
+    """
+    sub = ring.subscribe(since)
+    try:
+        while True:
+            batch = ring.read(sub.cursor, STREAM_BATCH)
+            if batch and batch[0][0] > sub.cursor + 1:
+                # the lines we still needed were overwritten
+                yield _event("gap", {"from": sub.cursor + 1, "to": batch[0][0] - 1})
+            if batch:
+                yield "".join(_event("line", {"seq": s, "ts": ts, "line": line}, s)
+                              for s, ts, line in batch)
+                sub.cursor = batch[-1][0]
+                lag = sub.lag
+                if lag > sub.max_lag_seen:
+                    sub.max_lag_seen = lag
+                if lag > max_lag:
+                    ring.slow_disconnects += 1
+                    yield _event("lagged", {"cursor": sub.cursor, "head": ring.head,
+                                            "lag": lag})
+                    return
+                continue
+
+            if ring.closed:
+                yield _event("end", {"head": ring.head})
+                return
+            if not await sub.wait(STREAM_KEEPALIVE_S):
+                yield ": keepalive\n\n"
+    finally:
+        ring.unsubscribe(sub)
@@ -0,0 +1,366 @@
+"""
+log_index.py — Sparse timestamp -> byte-offset index for `_text.log` files.
+
+Every `_text.log` gets a sibling `_text.idx` made of fixed 16-byte records
+(little-endian float64 epoch seconds, uint64 byte offset). A record is
+added for the first line written after each LOG_INDEX_STRIDE bytes, so the
+index stays tiny (~16 bytes per 64 KiB of log) while any time window can
+be located with a bisect and read through mmap without scanning the file.
+
+The capture path writes the index as it goes (see LogSink). Logs captured
+before the index existed get one built lazily on first query.
+
+Compressed logs (`_text.log.gz`, LOG_COMPRESS=gzip) are a series of
+independent gzip members. Their index holds one record per member: the
+epoch of its first line and the member's offset in the compressed file,
+so a query only inflates the members that overlap the window.
+
+Rotated logs are split into segments `_text.log`, `_text.001.log`, ...;
+find_text_logs() returns them in order and read_segments() queries them
+as one log. iter_lines() streams a window line by line instead of
+collecting it (see log_merge.py).
+"""
+from __future__ import annotations
+
+import mmap
+import os
+import re
+import struct
+import zlib
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from .core.config import settings
+
+LOG_INDEX_STRIDE = settings.LOG_INDEX_STRIDE
+# upper bound on lines returned by one range query
+LOG_RANGE_MAX_LINES = settings.LOG_RANGE_MAX_LINES
+
+_RECORD = struct.Struct("<dQ")
+_GZ = ".gz"
+# compressed bytes read per step when inflating a range
+_GZ_CHUNK = 64 * 1024
+
+
+def is_compressed(path: str) -> bool:
+    return path.endswith(_GZ)
+
+
+def index_path_for(text_path: str) -> str:
+    if is_compressed(text_path):
+        text_path = text_path[: -len(_GZ)]
+    base, _ = os.path.splitext(text_path)
+    return base + ".idx"
+
+
+def segment_path(path: str, seg: int) -> str:
+    """`<base>_text.log` -> `<base>_text.003.log` (also for `_vars.csv`, `.gz`)."""
+    if seg == 0:
+        return path
+    gz = _GZ if is_compressed(path) else ""
+    base, ext = os.path.splitext(path[: len(path) - len(gz)])
+    return f"{base}.{seg:03d}{ext}{gz}"
+
+
+def find_text_logs(log_dir: str, job_id: str) -> List[str]:
+    """Segments of the latest `<job_id>_<YYYYmmdd_HHMMSS>_text.log` run, in order."""
+    pat = re.compile(re.escape(job_id)
+                     + r"_(\d{8}_\d{6})_text(?:\.(\d{3}))?\.log(?:\.gz)?$")
+    try:
+        found = [(m.group(1), int(m.group(2) or 0), n)
+                 for n in os.listdir(log_dir) if (m := pat.match(n))]
+    except FileNotFoundError:
+        return []
+    if not found:
+        return []
+    run = max(f[0] for f in found)
+    return [os.path.join(log_dir, n) for r, _, n in sorted(found) if r == run]
+
+
+def line_epoch(line: bytes) -> Optional[float]:
+    """Epoch seconds of a `[<iso ts>] ...` log line, or None if it has none."""
+    if not line.startswith(b"["):
+        return None
+    end = line.find(b"]", 1, 40)
+    if end < 0:
+        return None
+    try:
+        ts = datetime.fromisoformat(line[1:end].decode("ascii"))
+    except ValueError:
+        return None
+    return ts.replace(tzinfo=timezone.utc).timestamp()
+
+
+class IndexWriter:
+    """
+    Append side, driven by LogSink on the log writer thread. Records are
+    only written after the text they point at has been flushed.
+    """
+
+    def __init__(self, text_path: str, text_offset: int, stride: int = LOG_INDEX_STRIDE) -> None:
+        self.path = index_path_for(text_path)
+        self._stride = stride
+        self._file = open(self.path, "ab")
+        self._pending = bytearray()
+        self._next_offset = text_offset  # first line at/after this gets a record
+        if text_offset:
+            # appending to an existing log: continue after its last record
+            entries = _read_entries(self.path)
+            if entries:
+                self._next_offset = entries[-1][1] + stride
+
+    def note(self, epoch: float, offset: int) -> None:
+        """Called with the start offset of every line written."""
+        if offset >= self._next_offset:
+            self.add(epoch, offset)
+
+    def add(self, epoch: float, offset: int) -> None:
+        """Unconditional record, e.g. the start of a gzip member."""
+        self._pending += _RECORD.pack(epoch, offset)
+        self._next_offset = offset + self._stride
+
+    def flush(self) -> None:
+        if self._pending:
+            self._file.write(self._pending)
+            self._pending.clear()
+        self._file.flush()
+
+    def fsync(self) -> None:
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+
+def _read_entries(idx_path: str) -> List[Tuple[float, int]]:
+    with open(idx_path, "rb") as f:
+        data = f.read()
+    usable = len(data) - len(data) % _RECORD.size
+    return list(_RECORD.iter_unpack(data[:usable]))
+
+
+def build_index(text_path: str, stride: int = LOG_INDEX_STRIDE) -> str:
+    """Write `_text.idx` for an existing log with one sequential pass."""
+    idx_path = index_path_for(text_path)
+    tmp = idx_path + ".tmp"
+    out = bytearray()
+    next_offset = 0
+    offset = 0
+    with open(text_path, "rb") as f:
+        for line in f:
+            if offset >= next_offset:
+                epoch = line_epoch(line)
+                if epoch is not None:
+                    out += _RECORD.pack(epoch, offset)
+                    next_offset = offset + stride
+            offset += len(line)
+    with open(tmp, "wb") as f:
+        f.write(out)
+    os.replace(tmp, idx_path)
+    return idx_path
+
+
+def load_index(text_path: str) -> Tuple[List[float], List[int]]:
+    idx_path = index_path_for(text_path)
+    if not os.path.exists(idx_path):
+        if is_compressed(text_path):
+            return [], []  # member offsets can't be recovered cheaply: full scan
+        build_index(text_path)
+    entries = _read_entries(idx_path)
+    return [e[0] for e in entries], [e[1] for e in entries]
+
+
+def _keep(line: bytes, start: Optional[float], end: Optional[float]) -> Optional[bool]:
+    """True to return `line`, False to skip it, None once past `end`."""
+    epoch = line_epoch(line)
+    if epoch is not None:
+        if start is not None and epoch < start:
+            return False
+        if end is not None and epoch >= end:
+            return None
+    return True
+
+
+def _scan_plain(text_path: str, lo: int, hi: int, start: Optional[float],
+                end: Optional[float], regex: Optional["re.Pattern[bytes]"],
+                limit: int, result: dict) -> None:
+    lines: List[str] = result["lines"]
+    with open(text_path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = lo
+        while pos < hi:
+            if regex is not None:
+                m = regex.search(mm, pos, hi)
+                if m is None:
+                    break
+                pos = mm.rfind(b"\n", pos, m.start()) + 1 or pos
+            eol = mm.find(b"\n", pos, hi)
+            if eol < 0:
+                eol = hi
+            line = mm[pos:eol]
+            pos = eol + 1
+
+            keep = _keep(line, start, end)
+            if keep is None:
+                break
+            if not keep:
+                continue
+            if len(lines) >= limit:
+                result["truncated"] = True
+                break
+            lines.append(line.decode(errors="replace"))
+
+
+def _read_lines(f, lo: int, hi: int, keep_tail: bool = True) -> Iterator[bytes]:
+    """Lines in [lo, hi) of a plain log, read through the file's buffer."""
+    f.seek(lo)
+    pos = lo
+    while pos < hi:
+        line = f.readline(hi - pos)
+        if not line:
+            break
+        pos += len(line)
+        if line.endswith(b"\n"):
+            yield line[:-1]
+        elif keep_tail:
+            yield line
+
+
+def _inflate(f, lo: int, hi: int, keep_tail: bool = True):
+    """Decompressed lines of the gzip members in [lo, hi) of `f`."""
+    f.seek(lo)
+    remaining = hi - lo
+    d = zlib.decompressobj(31)
+    tail = b""
+    while remaining > 0:
+        chunk = f.read(min(_GZ_CHUNK, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        data = b""
+        while chunk:
+            data += d.decompress(chunk)
+            if not d.eof:
+                break
+            # next member starts right after this one
+            chunk = d.unused_data
+            d = zlib.decompressobj(31)
+        parts = (tail + data).split(b"\n")
+        tail = parts.pop()
+        yield from parts
+    if tail and keep_tail:
+        yield tail
+
+
+def _scan_gzip(text_path: str, lo: int, hi: int, start: Optional[float],
+               end: Optional[float], regex: Optional["re.Pattern[bytes]"],
+               limit: int, result: dict) -> None:
+    lines: List[str] = result["lines"]
+    with open(text_path, "rb") as f:
+        for line in _inflate(f, lo, hi):
+            if regex is not None and not regex.search(line):
+                continue
+            keep = _keep(line, start, end)
+            if keep is None:
+                break
+            if not keep:
+                continue
+            if len(lines) >= limit:
+                result["truncated"] = True
+                break
+            lines.append(line.decode(errors="replace"))
+
+
+def _span(text_path: str, size: int, start: Optional[float],
+          end: Optional[float]) -> Tuple[int, int]:
+    """Byte span [lo, hi) of the first `size` bytes that can hold lines in [start, end)."""
+    if size == 0:
+        return 0, 0
+    ts_idx, off_idx = load_index(text_path)
+    lo, hi = 0, size
+    if start is not None:
+        # last record strictly before `start`: lines sharing a timestamp
+        # may precede the first record that carries it
+        i = bisect_left(ts_idx, start) - 1
+        if i >= 0:
+            lo = off_idx[i]
+    if end is not None:
+        j = bisect_left(ts_idx, end)
+        if j < len(off_idx):
+            hi = min(off_idx[j], size)
+    return lo, hi
+
+
+def read_range(text_path: str, start: Optional[float] = None, end: Optional[float] = None,
+               pattern: Optional[str] = None, limit: int = LOG_RANGE_MAX_LINES) -> dict:
+    """
+    Lines of `text_path` with start <= ts < end, optionally only those
+    matching `pattern` (a regex, searched per line).
+
+    The index narrows the file to the byte span covering the window; only
+    that span of the mmap is touched (or, compressed, only those members
+    are inflated).
+    """
+    size = os.path.getsize(text_path)
+    result = {"file": text_path, "lines": [], "truncated": False,
+              "scanned_bytes": 0}
+    lo, hi = _span(text_path, size, start, end)
+    if lo >= hi:
+        return result
+    result["scanned_bytes"] = hi - lo
+
+    regex = re.compile(pattern.encode(), re.MULTILINE) if pattern else None
+    scan = _scan_gzip if is_compressed(text_path) else _scan_plain
+    scan(text_path, lo, hi, start, end, regex, limit, result)
+    return result
+
+
+def iter_lines(text_path: str, start: Optional[float] = None, end: Optional[float] = None,
+               size: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Lines of `text_path` with start <= ts < end, one at a time and without
+    their newline. The index narrows the span as in read_range(), but
+    nothing is collected, so any window streams in constant memory.
+
+    With `size` only the first `size` bytes are read (a log still being
+    written, snapshotted), and a last line missing its newline is left out.
+    """
+    keep_tail = size is None
+    if size is None:
+        size = os.path.getsize(text_path)
+    lo, hi = _span(text_path, size, start, end)
+    if lo >= hi:
+        return
+    with open(text_path, "rb") as f:
+        if is_compressed(text_path):
+            lines = _inflate(f, lo, hi, keep_tail)
+        else:
+            lines = _read_lines(f, lo, hi, keep_tail)
+        for line in lines:
+            keep = _keep(line, start, end)
+            if keep is None:
+                return
+            if keep:
+                yield line
+
+
+def read_segments(paths: Sequence[str], start: Optional[float] = None,
+                  end: Optional[float] = None, pattern: Optional[str] = None,
+                  limit: int = LOG_RANGE_MAX_LINES) -> dict:
+    """read_range() over the segments of a rotated log, oldest first."""
+    result = {"files": [], "lines": [], "truncated": False, "scanned_bytes": 0}
+    for path in paths:
+        try:
+            part = read_range(path, start, end, pattern, limit - len(result["lines"]))
+        except FileNotFoundError:
+            continue  # segment removed by the disk budget meanwhile
+        if part["scanned_bytes"]:
+            result["files"].append(path)
+        result["lines"] += part["lines"]
+        result["scanned_bytes"] += part["scanned_bytes"]
+        if part["truncated"]:
+            result["truncated"] = True
+            break
+    return result
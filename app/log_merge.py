@@ -0,0 +1,368 @@
+"""
+log_merge.py — Several serial logs merged into one stream, in timestamp order.
+
+    python -m app.log_merge node-a node-b --start 2025-01-01T10:00:00 --grep RSSI
+
+Each source is either a job's latest text log in LOG_DIR (all segments,
+plain or compressed) or a live capture session. Files are read through
+log_index.iter_lines() and sessions from their line ring, one line at a
+time; a heap holds one pending line per source, so a merge needs memory
+for N lines, whatever the size of the logs.
+
+A live session is read from its log up to where the writer had got to
+when the merge started, then from its ring (lines already read from the
+file are skipped by timestamp). While a live session has nothing
+pending, a line from another source is only emitted once it is
+LOG_MERGE_LAG_S older than the wall clock: capture stamps lines as they
+are read, so an idle session can't produce anything older later. A merge
+behind a session by more than its ring's capacity loses the overwritten
+lines, as /serial/log/stream does.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Iterator, List, Optional, Sequence, Tuple, Union
+
+from .core.config import settings
+from .line_stream import STREAM_BATCH
+from .log_index import find_text_logs, iter_lines, line_epoch
+from .vars_store import iso_to_epoch, parse_time
+
+LOG_DIR = settings.LOG_DIR
+LOG_MERGE_LAG_S = settings.LOG_MERGE_LAG_S
+STREAM_POLL_S = settings.STREAM_POLL_S
+
+Record = Tuple[float, str, str]  # (epoch, ts, line)
+
+# poll(): the source has nothing more
+DONE = object()
+
+
+def _split(raw: bytes) -> Tuple[Optional[float], str, str]:
+    """`[<ts>] <line>` -> (epoch, ts, line); (None, "", line) without a timestamp."""
+    epoch = line_epoch(raw)
+    if epoch is None:
+        return None, "", raw.decode(errors="replace")
+    end = raw.index(b"]")
+    return epoch, raw[1:end].decode(), raw[end + 2:].decode(errors="replace")
+
+
+class LogSource:
+    """The segments of one text log, read forward from `start`."""
+
+    live = False
+
+    def __init__(self, name: str, paths: Sequence[str], start: Optional[float] = None,
+                 end: Optional[float] = None, snapshot: bool = False) -> None:
+        self.name = name
+        self.paths = list(paths)
+        self.start = start
+        self.end = end
+        # a log still being written is read up to its size right now
+        self._sizes: List[Optional[int]] = [None] * len(self.paths)
+        if snapshot:
+            self._sizes = [_size(p) for p in self.paths]
+        self._lines = self._iter()
+
+    def _iter(self) -> Iterator[Record]:
+        last = self.start or 0.0
+        for path, size in zip(self.paths, self._sizes):
+            try:
+                for raw in iter_lines(path, self.start, self.end, size):
+                    epoch, ts, line = _split(raw)
+                    if epoch is None:
+                        epoch = last  # untimestamped line: keep its place
+                    last = epoch
+                    yield epoch, ts, line
+            except FileNotFoundError:
+                continue  # segment removed by the disk budget meanwhile
+
+    def poll(self) -> Union[Record, object]:
+        return next(self._lines, DONE)
+
+    def close(self) -> None:
+        self._lines.close()
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+class SessionSource:
+    """A live capture session: its log so far, then its ring until the session stops."""
+
+    live = True
+
+    def __init__(self, name: str, ring, paths: Sequence[str] = (),
+                 start: Optional[float] = None, end: Optional[float] = None,
+                 lag: float = LOG_MERGE_LAG_S) -> None:
+        self.name = name
+        self.start = start
+        self.end = end
+        self._ring = ring
+        self._lag = lag
+        self._history: Optional[LogSource] = LogSource(name, paths, start, end, snapshot=True)
+        # the last timestamp read from the file, and how many lines carried it
+        self._last_ts: Optional[str] = None
+        self._last_epoch = 0.0
+        self._dups = 0
+        self._cursor = 0
+        self._batch: Deque[Tuple[int, str, str]] = deque()
+
+    def _from_history(self) -> Union[Record, object]:
+        rec = self._history.poll()
+        if rec is DONE:
+            self._history.close()
+            self._history = None
+            return None
+        epoch, ts, _ = rec
+        if ts == self._last_ts:
+            self._dups += 1
+        elif ts:
+            self._last_ts, self._last_epoch, self._dups = ts, epoch, 1
+        return rec
+
+    def _seen(self, ts: str, epoch: float) -> bool:
+        """True for ring lines that were already read from the file."""
+        if self._last_ts is None:
+            return False
+        if epoch < self._last_epoch:
+            return True
+        if ts == self._last_ts and self._dups:
+            self._dups -= 1
+            return True
+        self._last_ts = None  # past the file's end: nothing more to skip
+        return False
+
+    def poll(self) -> Union[Record, object, None]:
+        """The next line, None if there is none yet, DONE once the session ended."""
+        if self._history is not None:
+            rec = self._from_history()
+            if rec is not None:
+                return rec
+        while True:
+            if not self._batch:
+                closed = self._ring.closed  # before reading: lines published before it count
+                entries = self._ring.read(self._cursor, STREAM_BATCH)
+                if not entries:
+                    if closed or (self.end is not None
+                                  and time.time() - self._lag >= self.end):
+                        return DONE
+                    return None
+                self._cursor = entries[-1][0]
+                self._batch.extend(entries)
+            _, ts, line = self._batch.popleft()
+            epoch = iso_to_epoch(ts)
+            if self._seen(ts, epoch):
+                continue
+            if self.start is not None and epoch < self.start:
+                continue
+            if self.end is not None and epoch >= self.end:
+                return DONE
+            return epoch, ts, line
+
+    def close(self) -> None:
+        if self._history is not None:
+            self._history.close()
+
+
+Source = Union[LogSource, SessionSource]
+
+
+def job_source(job_id: str, start: Optional[float] = None, end: Optional[float] = None,
+               log_dir: str = LOG_DIR) -> LogSource:
+    paths = find_text_logs(log_dir, job_id)
+    if not paths:
+        raise FileNotFoundError(f"No text log for job_id={job_id}")
+    return LogSource(job_id, paths, start, end)
+
+
+def session_source(logger, session_id: str, start: Optional[float] = None,
+                   end: Optional[float] = None, lag: float = LOG_MERGE_LAG_S) -> SessionSource:
+    """`logger` is the SerialLogger (or CaptureClient) running the session."""
+    ring = logger.ring(session_id)
+    if ring is None:
+        raise KeyError(f"No capture session {session_id}")
+    status = logger.status(session_id)
+    paths: List[str] = []
+    text_path = status.get("text_path")
+    if text_path:
+        segments = find_text_logs(os.path.dirname(text_path), status["job_id"])
+        if text_path in segments:
+            paths = segments[: segments.index(text_path) + 1]
+    return SessionSource(session_id, ring, paths, start, end, lag)
+
+
+# _merge(): nothing to emit until the live sources have been polled again
+_POLL = object()
+
+
+def _merge(sources: Sequence[Source], pattern: Optional[str], exclude: Optional[str],
+           predicate: Optional[Callable[[str, str], bool]], lag: float,
+           idle: Optional[float]) -> Iterator[object]:
+    """merge()'s steps, with a _POLL where the caller should wait STREAM_POLL_S."""
+    want = re.compile(pattern) if pattern else None
+    drop = re.compile(exclude) if exclude else None
+    heap: List[Tuple[float, int, Record]] = []
+    waiting: List[int] = []
+
+    def pull(i: int) -> None:
+        rec = sources[i].poll()
+        if rec is None:
+            waiting.append(i)
+        elif rec is not DONE:
+            heapq.heappush(heap, (rec[0], i, rec))
+
+    try:
+        for i in range(len(sources)):
+            pull(i)
+        polled_at = time.time()
+        idle_since = time.monotonic()
+        while heap or waiting:
+            # a waiting session can only produce lines stamped after its last poll
+            if waiting and (not heap or heap[0][0] > polled_at - lag):
+                polled_at = time.time()
+                retry, waiting[:] = waiting[:], []
+                for i in retry:
+                    pull(i)
+            if heap and (not waiting or heap[0][0] <= polled_at - lag):
+                _, i, (_, ts, line) = heapq.heappop(heap)
+                pull(i)
+                name = sources[i].name
+                if ((want is None or want.search(line))
+                        and (drop is None or not drop.search(line))
+                        and (predicate is None or predicate(name, line))):
+                    idle_since = time.monotonic()
+                    yield {"ts": ts, "source": name, "line": line}
+                continue
+            if idle is not None and time.monotonic() - idle_since >= idle:
+                idle_since = time.monotonic()
+                yield None
+            yield _POLL
+    finally:
+        for src in sources:
+            src.close()
+
+
+def merge(sources: Sequence[Source], pattern: Optional[str] = None,
+          exclude: Optional[str] = None,
+          predicate: Optional[Callable[[str, str], bool]] = None,
+          lag: float = LOG_MERGE_LAG_S, idle: Optional[float] = None) -> Iterator[Optional[dict]]:
+    """
+    Lines of all `sources` as {"ts", "source", "line"} in timestamp order
+    (ties keep the order of `sources`). Only lines matching `pattern`, not
+    matching `exclude` (regexes, searched in the line's text) and passing
+    `predicate(source, line)` are yielded. While waiting on live sessions
+    a None is yielded every `idle` seconds, so a consumer can check on its
+    client. Every source is closed when the generator is.
+    """
+    steps = _merge(sources, pattern, exclude, predicate, lag, idle)
+    try:
+        for item in steps:
+            if item is _POLL:
+                time.sleep(STREAM_POLL_S)
+            else:
+                yield item
+    finally:
+        steps.close()
+
+
+def _take(steps: Iterator[object], limit: int) -> Tuple[List[dict], object]:
+    """
+    Up to `limit` records from `steps`, stopping early at a heartbeat or a
+    poll; the second item is what ended the batch (None, _POLL, DONE, or
+    "" for a full batch).
+    """
+    out: List[dict] = []
+    for item in steps:
+        if item is None or item is _POLL:
+            return out, item
+        out.append(item)
+        if len(out) >= limit:
+            return out, ""
+    return out, DONE
+
+
+async def amerge(sources: Sequence[Source], pattern: Optional[str] = None,
+                 exclude: Optional[str] = None,
+                 predicate: Optional[Callable[[str, str], bool]] = None,
+                 lag: float = LOG_MERGE_LAG_S,
+                 idle: Optional[float] = None) -> AsyncIterator[Optional[dict]]:
+    """
+    merge() for the event loop: file reads run in a worker thread a batch
+    at a time and waiting on live sessions is an asyncio.sleep, so a
+    follower holds no thread while nothing happens.
+    """
+    steps = _merge(sources, pattern, exclude, predicate, lag, idle)
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            pending = asyncio.ensure_future(asyncio.to_thread(_take, steps, STREAM_BATCH))
+            records, end = await asyncio.shield(pending)
+            pending = None
+            for rec in records:
+                yield rec
+            if end is DONE:
+                return
+            if end is None:
+                yield None
+            elif end is _POLL:
+                await asyncio.sleep(STREAM_POLL_S)
+    finally:
+        if pending is not None:
+            # a cancelled request: let the batch in flight finish before closing
+            await asyncio.gather(pending, return_exceptions=True)
+        steps.close()
+
+
+def format_text(rec: dict) -> str:
+    return f"[{rec['ts']}] [{rec['source']}] {rec['line']}"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("jobs", nargs="*", help="job ids whose latest text log to merge")
+    ap.add_argument("--session", action="append", default=[], metavar="SESSION_ID",
+                    help="live capture session to merge in (repeatable)")
+    ap.add_argument("--start", help="epoch seconds or UTC ISO timestamp")
+    ap.add_argument("--end", help="epoch seconds or UTC ISO timestamp")
+    ap.add_argument("--grep", help="only lines matching this regex")
+    ap.add_argument("--exclude", help="drop lines matching this regex")
+    ap.add_argument("--json", action="store_true", help="one JSON object per line")
+    ap.add_argument("--log-dir", default=LOG_DIR)
+    args = ap.parse_args(argv)
+    if not args.jobs and not args.session:
+        ap.error("give at least one job id or --session")
+
+    try:
+        start = parse_time(args.start) if args.start else None
+        end = parse_time(args.end) if args.end else None
+        sources: List[Source] = [job_source(j, start, end, args.log_dir) for j in args.jobs]
+        if args.session:
+            # sessions of this host's capture daemon (CAPTURE_DAEMON_SOCKET)
+            from .serial_logger import serial_logger
+
+            sources += [session_source(serial_logger, s, start, end) for s in args.session]
+        for rec in merge(sources, args.grep, args.exclude):
+            print(json.dumps(rec) if args.json else format_text(rec), flush=bool(args.session))
+    except (FileNotFoundError, KeyError, ValueError, re.error) as e:
+        print(f"log_merge: {e.args[0] if isinstance(e, KeyError) else e}", file=sys.stderr)
+        return 1
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,613 @@
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from . import metrics
+from .core.config import settings
+from .log_index import IndexWriter, segment_path
+from .raw_capture import RawSink
+from .vars_store import VarsStore, iso_to_epoch, store_path_for
+
+# group-commit thresholds: a sink is flushed once it holds this many bytes
+# or its oldest unflushed line is this old, whichever comes first
+LOG_FLUSH_BYTES = settings.LOG_FLUSH_BYTES
+LOG_FLUSH_INTERVAL_MS = settings.LOG_FLUSH_INTERVAL_MS
+# batches (one per tty read) waiting for the writer thread
+LOG_QUEUE_SIZE = settings.LOG_QUEUE_SIZE
+# how long the capture loop may block on a full queue before dropping;
+# keep this well under the time it takes to fill the kernel tty buffer
+LOG_QUEUE_PUT_TIMEOUT_MS = settings.LOG_QUEUE_PUT_TIMEOUT_MS
+# fsync after every flush so a power cut loses at most one interval
+LOG_FSYNC = settings.LOG_FSYNC
+# parse numeric key=value pairs into the columnar `<base>_vars/` store
+VARS_STORE = settings.VARS_STORE
+# "gzip": write `_text.log.gz` / `_vars.csv.gz` as a chain of independent
+# gzip members (seekable frames); "none": plain text
+LOG_COMPRESS = settings.LOG_COMPRESS.lower()
+LOG_COMPRESS_LEVEL = settings.LOG_COMPRESS_LEVEL
+# uncompressed bytes per gzip member: larger compresses better, smaller
+# makes range queries inflate less
+LOG_FRAME_BYTES = settings.LOG_FRAME_BYTES
+# start a new segment once the text file reaches this size on disk, or is
+# this old (0 = never)
+LOG_ROTATE_BYTES = settings.LOG_ROTATE_BYTES
+LOG_ROTATE_S = settings.LOG_ROTATE_S
+# disk budgets for log segments, vars stores and raw captures, per capture
+# run and for all of LOG_DIR (0 = unlimited); the oldest closed ones go first
+LOG_JOB_BUDGET_BYTES = settings.LOG_JOB_BUDGET_BYTES
+LOG_DIR_BUDGET_BYTES = settings.LOG_DIR_BUDGET_BYTES
+
+# upper bound on batches taken per pass, so a busy queue can't postpone
+# the threshold checks indefinitely
+_DRAIN_MAX = 256
+
+FLUSH_SECONDS = metrics.histogram(
+    "serial_log_flush_seconds", "Time to write one group commit to the log files")
+FSYNC_SECONDS = metrics.histogram(
+    "serial_log_fsync_seconds", "Time to fsync log files after a group commit")
+
+# every file of a segment: `<run>_text[.NNN].log[.gz]`, `_text[.NNN].idx`,
+# `_vars[.NNN].csv[.gz]`, where <run> is `<job_id>_<YYYYmmdd_HHMMSS>`
+_SEGMENT_FILE = re.compile(
+    r"^(?P<run>.+_\d{8}_\d{6})_(?:text|vars)(?:\.(?P<seg>\d{3}))?\.(?:log|csv|idx)(?:\.gz)?$"
+)
+# the rest of a run, each budgeted as one unit: the columnar `<run>_vars/`
+# store and the `<run>_raw.bin` capture
+_RUN_PART = re.compile(r"^(?P<run>.+_\d{8}_\d{6})_(?:(?P<vars>vars)|raw\.bin)$")
+
+# budget unit: (run, segment number), (run, "vars") or (run, "raw")
+Part = Tuple[str, Union[int, str]]
+
+
+class _OutFile:
+    """
+    Append-only output file, plain or as a chain of gzip members.
+
+    Compressed, every flush() ends with a sync flush so everything written
+    so far can be inflated by a reader; a member is finished (and the next
+    one started) once it holds LOG_FRAME_BYTES of input. Each member is a
+    complete gzip stream, so the file as a whole stays valid for zcat.
+    """
+
+    def __init__(self, path: str, compress: bool, level: int = LOG_COMPRESS_LEVEL,
+                 frame_bytes: int = LOG_FRAME_BYTES) -> None:
+        self.path = path
+        self._file = open(path, "ab")
+        self._compress = compress
+        self._level = level
+        self._frame_bytes = frame_bytes
+        self._z = None
+        self._frame_in = 0
+        self.raw_bytes = 0
+
+    @property
+    def at_frame_start(self) -> bool:
+        """The next write starts a new member (always true uncompressed)."""
+        return self._z is None
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def write(self, data: bytes) -> None:
+        self.raw_bytes += len(data)
+        if not self._compress:
+            self._file.write(data)
+            return
+        if self._z is None:
+            self._z = zlib.compressobj(self._level, zlib.DEFLATED, 31)
+        self._file.write(self._z.compress(data))
+        self._frame_in += len(data)
+
+    def flush(self) -> None:
+        if self._z is not None:
+            if self._frame_in >= self._frame_bytes:
+                self._file.write(self._z.flush(zlib.Z_FINISH))
+                self._z = None
+                self._frame_in = 0
+            else:
+                self._file.write(self._z.flush(zlib.Z_SYNC_FLUSH))
+        self._file.flush()
+
+    def fsync(self) -> None:
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._z is not None:
+            self._file.write(self._z.flush(zlib.Z_FINISH))
+            self._z = None
+        self._file.close()
+
+
+class LogSink:
+    """
+    The `_text.log` / `_vars.csv` pair for one capture session, plus the
+    sparse `_text.idx` index and the columnar vars store when enabled.
+
+    Lines are formatted into in-memory buffers by the writer thread and
+    reach the files only on flush(). Nothing here is thread-safe: a sink
+    is owned by exactly one LogWriter thread once opened.
+
+    With `compress` the files get a `.gz` suffix and are written as gzip
+    members. With `rotate_bytes`/`rotate_s` the text/vars pair moves on to
+    a new segment (`_text.001.log`, ...) once the current one is big or
+    old enough; the vars store is one store for the whole run.
+    """
+
+    def __init__(self, text_path: str, vars_path: str, fsync: bool = LOG_FSYNC,
+                 vars_store: bool = VARS_STORE, compress: bool = LOG_COMPRESS == "gzip",
+                 rotate_bytes: int = LOG_ROTATE_BYTES, rotate_s: float = LOG_ROTATE_S) -> None:
+        self._fsync = fsync
+        self._compress = compress
+        self._rotate_bytes = rotate_bytes
+        self._rotate_s = rotate_s
+        self.store = VarsStore(store_path_for(vars_path)) if vars_store else None
+        # `<job_id>_<YYYYmmdd_HHMMSS>`, shared by every segment of this run
+        self.run = os.path.basename(store_path_for(text_path))[: -len("_vars")]
+        self.log_dir = os.path.dirname(text_path)
+        if compress:
+            text_path += ".gz"
+            vars_path += ".gz"
+        self._first_text = text_path
+        self._first_vars = vars_path
+        self.segment = 0
+        self.rotations = 0
+        self._text_buf = bytearray()
+        self._vars_buf = bytearray()
+        self._buf_epoch: Optional[float] = None  # first buffered line
+        self.oldest_pending: Optional[float] = None
+        self.lines_written = 0
+        self.lines_dropped = 0
+        self._pending_lines = 0
+        self._open_segment()
+
+    def _open_segment(self) -> None:
+        self.text_path = segment_path(self._first_text, self.segment)
+        self.vars_path = segment_path(self._first_vars, self.segment)
+        self._text_file = _OutFile(self.text_path, self._compress)
+        self._vars_file = _OutFile(self.vars_path, self._compress)
+        self._text_offset = self._text_file.tell()  # bytes already on disk
+        self.index = IndexWriter(self.text_path, self._text_offset)
+        self._opened_at = time.monotonic()
+
+        # CSV header for variables file
+        self._vars_file.write(b"ts_utc,line\n")
+        self._vars_file.flush()
+
+    @property
+    def segment_key(self) -> Tuple[str, int]:
+        return self.run, self.segment
+
+    @property
+    def disk_bytes(self) -> int:
+        """Size of the current segment's text/vars files."""
+        return self._text_file.tell() + self._vars_file.tell()
+
+    @property
+    def raw_bytes(self) -> int:
+        """Uncompressed bytes written to the current segment."""
+        return self._text_file.raw_bytes + self._vars_file.raw_bytes
+
+    @property
+    def pending_bytes(self) -> int:
+        return len(self._text_buf) + len(self._vars_buf)
+
+    def dropped(self, lines: List[str]) -> int:
+        """Account a batch the writer couldn't take; returns lines lost."""
+        self.lines_dropped += len(lines)
+        return len(lines)
+
+    def status(self) -> dict:
+        return {
+            "lines_written": self.lines_written,
+            "lines_dropped": self.lines_dropped,
+            "text_path": self.text_path,
+            "vars_path": self.vars_path,
+            "segment": self.segment,
+            "vars_store": self.store.path if self.store else None,
+        }
+
+    def append(self, ts: str, lines: List[str]) -> None:
+        if self.oldest_pending is None:
+            self.oldest_pending = time.monotonic()
+        epoch = iso_to_epoch(ts)
+        if self._buf_epoch is None:
+            self._buf_epoch = epoch
+        for line in lines:
+            if not self._compress:
+                self.index.note(epoch, self._text_offset + len(self._text_buf))
+            # Text log (everything)
+            self._text_buf += f"[{ts}] {line}\n".encode()
+            # Variables log (raw line; parsed values go to the store)
+            self._vars_buf += f"{ts},{line}\n".encode()
+        self._pending_lines += len(lines)
+        if self.store is not None:
+            self.store.append(epoch, lines)
+
+    def flush(self) -> int:
+        """Write buffered bytes to disk; returns the byte count written."""
+        t0 = time.perf_counter()
+        n = self.pending_bytes
+        if n:
+            if self._compress and self._text_file.at_frame_start and self._text_buf:
+                # one record per gzip member, at its compressed offset
+                self.index.add(self._buf_epoch, self._text_file.tell())
+            self._text_offset += len(self._text_buf)
+            self._text_file.write(self._text_buf)
+            self._vars_file.write(self._vars_buf)
+            self._text_buf.clear()
+            self._vars_buf.clear()
+        self._text_file.flush()
+        self._vars_file.flush()
+        # index records only ever point at text that is already flushed
+        self.index.flush()
+        if self.store is not None:
+            self.store.flush()
+        t1 = time.perf_counter()
+        FLUSH_SECONDS.observe(t1 - t0)
+        if self._fsync and n:
+            self._text_file.fsync()
+            self._vars_file.fsync()
+            self.index.fsync()
+            if self.store is not None:
+                self.store.fsync()
+            FSYNC_SECONDS.observe(time.perf_counter() - t1)
+        self.lines_written += self._pending_lines
+        self._pending_lines = 0
+        self._buf_epoch = None
+        self.oldest_pending = None
+        return n
+
+    def maybe_rotate(self) -> bool:
+        """Start the next segment if the current one is due; call after flush()."""
+        if self.pending_bytes:
+            return False
+        size = self._text_file.tell()
+        due = (self._rotate_bytes and size >= self._rotate_bytes) or \
+            (self._rotate_s and size and time.monotonic() - self._opened_at >= self._rotate_s)
+        if not due:
+            return False
+        self._close_segment()
+        self.segment += 1
+        self.rotations += 1
+        self._open_segment()
+        return True
+
+    def _close_segment(self) -> None:
+        self._text_file.close()
+        self._vars_file.close()
+        self.index.close()
+
+    def close(self) -> None:
+        self.flush()
+        self._close_segment()
+        if self.store is not None:
+            self.store.close()
+
+
+def _tree_usage(path: str) -> Tuple[int, float]:
+    """(bytes, newest mtime) of the files under directory `path`."""
+    size, newest = 0, 0.0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            size += st.st_size
+            newest = max(newest, st.st_mtime)
+    return size, newest
+
+
+def _segments(log_dir: str) -> Dict[Part, Tuple[int, float]]:
+    """{part: (bytes on disk, newest mtime)} for every segment, vars store and raw capture."""
+    found: Dict[Part, Tuple[int, float]] = {}
+    try:
+        entries = list(os.scandir(log_dir))
+    except FileNotFoundError:
+        return found
+    for entry in entries:
+        m = _SEGMENT_FILE.match(entry.name)
+        part = _RUN_PART.match(entry.name) if m is None else None
+        if m is None and part is None:
+            continue
+        try:
+            if part is not None and entry.is_dir(follow_symlinks=False):
+                usage = _tree_usage(entry.path)
+            else:
+                st = entry.stat()
+                usage = (st.st_size, st.st_mtime)
+        except FileNotFoundError:
+            continue
+        if m is not None:
+            key: Part = (m.group("run"), int(m.group("seg") or 0))
+        else:
+            key = (part.group("run"), "vars" if part.group("vars") else "raw")
+        size, mtime = found.get(key, (0, 0.0))
+        found[key] = (size + usage[0], max(mtime, usage[1]))
+    return found
+
+
+def _delete_segment(log_dir: str, run: str, seg: Union[int, str]) -> None:
+    if seg in ("vars", "raw"):
+        path = os.path.join(log_dir, f"{run}_vars" if seg == "vars" else f"{run}_raw.bin")
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return
+    for name in os.listdir(log_dir):
+        m = _SEGMENT_FILE.match(name)
+        if m and m.group("run") == run and int(m.group("seg") or 0) == seg:
+            try:
+                os.remove(os.path.join(log_dir, name))
+            except FileNotFoundError:
+                pass
+
+
+def enforce_budget(log_dir: str, active: Set[Part], run: Optional[str] = None,
+                   job_budget: int = LOG_JOB_BUDGET_BYTES,
+                   dir_budget: int = LOG_DIR_BUDGET_BYTES) -> List[Part]:
+    """
+    Delete the oldest closed segments, vars stores and raw captures until
+    `run` fits `job_budget` and the whole directory fits `dir_budget`.
+    Parts still being written (`active`, and the vars store of any run
+    with an active segment) count towards usage but are never deleted, so
+    a budget smaller than one segment is exceeded rather than losing live
+    data. Returns the deleted (run, segment | "vars" | "raw") keys.
+    """
+    if not (job_budget or dir_budget):
+        return []
+    segs = _segments(log_dir)
+    live_runs = {k[0] for k in active}
+    deleted: List[Part] = []
+
+    def trim(keys: List[Part], budget: int) -> None:
+        used = sum(segs[k][0] for k in keys)
+        for key in sorted(keys, key=lambda k: (segs[k][1], k[0], str(k[1]))):
+            if used <= budget:
+                break
+            if key in active or (key[1] == "vars" and key[0] in live_runs):
+                continue
+            _delete_segment(log_dir, *key)
+            used -= segs.pop(key)[0]
+            deleted.append(key)
+
+    if job_budget and run is not None:
+        trim([k for k in segs if k[0] == run], job_budget)
+    if dir_budget:
+        trim(list(segs), dir_budget)
+    return deleted
+
+
+_FLUSH = object()
+_CLOSE = object()
+
+
+class LogWriter:
+    """
+    Group-commit writer stage between the capture reactor and the disk.
+
+    The reactor calls submit() with every batch of decoded lines; a single
+    writer thread drains the bounded queue, formats into per-sink buffers
+    and flushes each sink on the size/time thresholds. When the queue is
+    full submit() blocks for at most `put_timeout` (a backpressure event)
+    and then drops the batch, so a stalled SD card can never stall capture.
+    """
+
+    def __init__(self, flush_bytes: int = LOG_FLUSH_BYTES,
+                 flush_interval_ms: int = LOG_FLUSH_INTERVAL_MS,
+                 queue_size: int = LOG_QUEUE_SIZE,
+                 put_timeout_ms: int = LOG_QUEUE_PUT_TIMEOUT_MS) -> None:
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.put_timeout = put_timeout_ms / 1000.0
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._sinks: Set[Union[LogSink, RawSink]] = set()
+        self._sinks_lock = threading.Lock()
+
+        self.enqueued_lines = 0
+        self.enqueued_raw_chunks = 0
+        self.enqueued_raw_bytes = 0
+        self.backpressure_events = 0
+        self.dropped_batches = 0
+        self.dropped_lines = 0
+        self.flushes = 0
+        self.bytes_flushed = 0
+        self.max_queue_depth = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.rotations = 0
+        self.segments_deleted = 0
+
+    def _ensure_thread(self) -> None:
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run,
+                name="SerialLogWriter",
+                daemon=True,
+            )
+            self._thread.start()
+
+    # -------------------------------------------------
+    # producer side (capture reactor)
+    # -------------------------------------------------
+    def submit(self, sink: LogSink, ts: str, lines: List[str]) -> bool:
+        """
+        Queue a batch; returns False if it had to be dropped. A RawSink
+        takes (monotonic_ns, chunk) instead of (ts, lines).
+        """
+        item = (sink, ts, lines)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.backpressure_events += 1
+            try:
+                self._queue.put(item, timeout=self.put_timeout)
+            except queue.Full:
+                self.dropped_batches += 1
+                self.dropped_lines += sink.dropped(lines)
+                return False
+        if isinstance(sink, RawSink):
+            self.enqueued_raw_chunks += 1
+            self.enqueued_raw_bytes += len(lines)
+        else:
+            self.enqueued_lines += len(lines)
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return True
+
+    def open(self, text_path: str, vars_path: str) -> LogSink:
+        self._ensure_thread()
+        sink = LogSink(text_path, vars_path)
+        with self._sinks_lock:
+            self._sinks.add(sink)
+        self._enforce_budget(sink)
+        return sink
+
+    def open_raw(self, path: str, port: str, port_id: int, baudrate: int) -> RawSink:
+        self._ensure_thread()
+        sink = RawSink(path, port, port_id, baudrate, fsync=LOG_FSYNC)
+        with self._sinks_lock:
+            self._sinks.add(sink)
+        self._enforce_budget(sink)
+        return sink
+
+    def _enforce_budget(self, sink: Union[LogSink, RawSink]) -> None:
+        with self._sinks_lock:
+            active = {s.segment_key for s in self._sinks}
+            try:
+                self.segments_deleted += len(enforce_budget(sink.log_dir, active, sink.run))
+            except OSError as e:
+                self.errors += 1
+                self.last_error = str(e)
+
+    def flush(self, sink: LogSink, timeout: float = 5.0) -> bool:
+        """Barrier: returns once everything queued for `sink` is on disk."""
+        return self._control(_FLUSH, sink, timeout)
+
+    def close(self, sink: LogSink, timeout: float = 5.0) -> bool:
+        """Flush and close `sink`; no batches for it may follow."""
+        return self._control(_CLOSE, sink, timeout)
+
+    def _control(self, op: object, sink: LogSink, timeout: float) -> bool:
+        if not (self._thread and self._thread.is_alive()):
+            if op is _CLOSE:
+                with self._sinks_lock:
+                    self._sinks.discard(sink)
+                sink.close()
+            else:
+                sink.flush()
+            return True
+        done = threading.Event()
+        # control items are never dropped; stop() may wait for queue space
+        self._queue.put((op, sink, done))
+        return done.wait(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "max_queue_depth": self.max_queue_depth,
+            "enqueued_lines": self.enqueued_lines,
+            "enqueued_raw_chunks": self.enqueued_raw_chunks,
+            "enqueued_raw_bytes": self.enqueued_raw_bytes,
+            "backpressure_events": self.backpressure_events,
+            "dropped_batches": self.dropped_batches,
+            "dropped_lines": self.dropped_lines,
+            "flushes": self.flushes,
+            "bytes_flushed": self.bytes_flushed,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "flush_bytes": self.flush_bytes,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+            "compress": LOG_COMPRESS,
+            "rotations": self.rotations,
+            "segments_deleted": self.segments_deleted,
+        }
+
+    # -------------------------------------------------
+    # writer thread
+    # -------------------------------------------------
+    def _flush_sink(self, sink: LogSink) -> None:
+        try:
+            self.bytes_flushed += sink.flush()
+            self.flushes += 1
+            if sink.maybe_rotate():
+                self.rotations += 1
+                self._enforce_budget(sink)
+        except Exception as e:
+            self.errors += 1
+            self.last_error = str(e)
+
+    def _handle(self, item: tuple, dirty: Set[LogSink]) -> None:
+        head = item[0]
+        if head is _FLUSH or head is _CLOSE:
+            _, sink, done = item
+            try:
+                if head is _CLOSE:
+                    with self._sinks_lock:
+                        self._sinks.discard(sink)
+                    sink.close()
+                else:
+                    self._flush_sink(sink)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+            finally:
+                dirty.discard(sink)
+                done.set()
+            return
+
+        sink, ts, lines = item
+        try:
+            sink.append(ts, lines)
+        except Exception as e:
+            self.errors += 1
+            self.last_error = str(e)
+        dirty.add(sink)
+
+    def _run(self) -> None:
+        dirty: Set[LogSink] = set()
+        while True:
+            timeout = None
+            if dirty:
+                now = time.monotonic()
+                oldest = min(s.oldest_pending or now for s in dirty)
+                timeout = max(0.0, oldest + self.flush_interval - now)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            # group commit: take what's already waiting
+            taken = 0
+            while item is not None:
+                self._handle(item, dirty)
+                taken += 1
+                if taken >= _DRAIN_MAX:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            now = time.monotonic()
+            for sink in list(dirty):
+                due = sink.oldest_pending is not None and \
+                    now - sink.oldest_pending >= self.flush_interval
+                if due or sink.pending_bytes >= self.flush_bytes:
+                    self._flush_sink(sink)
+                    dirty.discard(sink)
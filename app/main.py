@@ -1,20 +1,52 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import (JSONResponse, PlainTextResponse, RedirectResponse, Response,
+                               StreamingResponse)
 from pydantic import BaseModel
+import asyncio
+from contextlib import asynccontextmanager
+import json
 import os
+import re
 import time
-import requests
 
-from .serial_logger import serial_logger
+from .serial_logger import LOG_DIR, SERIAL_PORT, serial_logger, session_id_for
+from .capture_client import CaptureUnavailable
+from . import log_index, log_merge, metrics, raw_capture, serial_io, vars_agg, vars_store
+from .line_stream import STREAM_KEEPALIVE_S, sse_events
+from .pi_client import PI_HOST, pi_client
+from .pi_registry import AmbiguousDut, pi_registry
+from .duts_cache import duts_cache
+from .dut import DEFAULT_PROBE, FlashError, build_flash_cmd, flash_tool, probe_serial
+from .flash_jobs import SKIPPED, SUCCEEDED, flash_scheduler
+from .firmware_store import firmware_store
+from .usbip_manager import usbip_manager
+from .core.config import settings
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from anyio import to_thread
+
+    metrics.watch_thread_limiter(to_thread.current_default_thread_limiter())
+    pi_registry.start()  # Pi heartbeats / DUT routing index
+    usbip_manager.start()  # background `usbip list`/`usbip port` reconcile
+    yield
+    await usbip_manager.stop()
+    pi_registry.stop()
+
 
 app = FastAPI(
+    lifespan=lifespan,
     title="LNT Host App",
     description="Host-side API for discovering and talking to DUTs (proxied to Pi)",
     version="1.0.0",
 )
 
-# change this if your Pi IP changes
-PI_HOST = os.getenv("PI_HOST", "http://192.168.1.78:8001")
+
+@app.exception_handler(CaptureUnavailable)
+async def capture_unavailable(request, exc: CaptureUnavailable):
+    # CAPTURE_DAEMON_SOCKET is set but the daemon isn't answering
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
 
 # -------------------------------------------------
 # MODELS
@@ -23,17 +55,77 @@ class SerialTxRxRequest(BaseModel):
     dut_id: str
     data: str
     terminator: str | None = "\n"
+    timeout: float | None = None
+
+
+class ScriptStep(BaseModel):
+    send: str | None = None
+    terminator: str | None = "\n"
+    expect: str | None = None  # regex; None takes the first line
+    read: bool = True
+    timeout: float | None = None
+    capture: str = "match"  # "match" | "all" | "none"
+    on_fail: str = "abort"  # "abort" | "continue"
+
+
+class SerialScriptRequest(BaseModel):
+    dut_id: str
+    steps: list[ScriptStep]
+    baud: int | None = None
 
 
 class FlashRequest(BaseModel):
     dut_id: str
     firmware_path: str
+    tool: str | None = None
+    dry_run: bool = False
+    force: bool = False
 
 
 class SerialLogStartRequest(BaseModel):
     job_id: str
     port: str | None = None
     baudrate: int | None = None
+    mode: str = "lines"  # or "raw": binary chunks, no line decoding
+
+
+class TriggerRequest(BaseModel):
+    session_id: str
+    pattern: str
+    literal: bool = False
+    action: str | None = None  # "stop_capture" | "fail_job"
+    name: str | None = None
+    since: int | None = None  # also match lines captured after this stream seq
+
+
+class TriggerWaitRequest(BaseModel):
+    session_id: str
+    trigger_ids: list[str] | None = None  # None: any trigger of the session
+    after: int = 0  # hit seq already seen
+    timeout: float = 30.0
+
+
+class PiRegisterRequest(BaseModel):
+    host: str
+
+
+class UsbipBindRequest(BaseModel):
+    busids: list[str]
+
+
+class UsbipAttachRequest(BaseModel):
+    host: str  # the exporting Pi: host name, IP or its base URL
+    busids: list[str]
+
+
+class UsbipDetachRequest(BaseModel):
+    devices: list[str]  # "<host>/<busid>", as listed by GET /usbip/devices
+
+
+class SerialLogStopRequest(BaseModel):
+    session_id: str | None = None
+    job_id: str | None = None
+    port: str | None = None
 
 
 # -------------------------------------------------
@@ -51,7 +143,13 @@ def ping():
 
 @app.get("/health")
 def health():
-    return {"status": "healthy", "pi_host": PI_HOST}
+    return {"status": "healthy", "pi_host": PI_HOST, "pi_hosts": pi_client.hosts}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus scrape endpoint; async, so it answers while the threadpool is saturated."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/version")
@@ -63,34 +161,298 @@ def version():
 # /duts (PROXIED TO PI)
 # -------------------------------------------------
 @app.get("/duts")
-def get_duts():
+def get_duts(response: Response, if_none_match: str | None = Header(default=None)):
     """
     Instead of listing USB locally (macOS Docker can't see USB),
-    ask the Pi, which actually sees the devices.
+    ask the Pis, which actually see the devices. All Pis are queried
+    concurrently; DUTs are tagged with their Pi and Pis that fail or time
+    out are reported in "pis" instead of failing the whole call.
+    Answers come from a short-lived cache that revalidates in the
+    background, and carry an ETag for conditional polling.
+    """
+    etag, result = duts_cache.get(hosts=pi_registry.hosts())
+    if not any(p["ok"] for p in result["pis"]):
+        errors = "; ".join(f"{p['pi']}: {p.get('error')}" for p in result["pis"])
+        raise HTTPException(status_code=502, detail=f"Could not reach any Pi: {errors}")
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return result
+
+
+@app.get("/duts/cache")
+def duts_cache_status():
+    return duts_cache.status()
+
+
+# -------------------------------------------------
+# PI REGISTRY / ROUTING
+# -------------------------------------------------
+@app.get("/pis")
+def list_pis():
+    return pi_registry.status()
+
+
+@app.post("/pis")
+def register_pi(req: PiRegisterRequest):
+    if not re.match(r"^https?://", req.host):
+        raise HTTPException(status_code=400, detail="host must be an http(s):// base URL")
+    return {"registered": pi_registry.register(req.host), "pis": pi_registry.hosts()}
+
+
+@app.delete("/pis")
+def unregister_pi(host: str):
+    if not pi_registry.unregister(host):
+        raise HTTPException(status_code=404, detail=f"No Pi {host}")
+    return {"pis": pi_registry.hosts()}
+
+
+def _forward_to_owner(dut_id: str, path: str, body: dict, routed: str | None,
+                      timeout: float | None = None):
+    """
+    The owning Pi's answer for a request about `dut_id`, or None when it
+    is served here: the DUT isn't on a known healthy Pi, or the request
+    was already forwarded once (a Pi never forwards again). An id several
+    Pis report is a 409 unless qualified as `<dut_id>@<pi>`.
     """
+    if routed:
+        return None
     try:
-        resp = requests.get(f"{PI_HOST}/duts", timeout=5)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=f"Could not reach Pi at {PI_HOST}: {e}")
+        host = pi_registry.route(dut_id)
+    except AmbiguousDut as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    bare, pinned = pi_registry.split(dut_id)
+    if host is None:
+        if pinned:
+            raise HTTPException(status_code=503,
+                                detail=f"Pi {pinned} doesn't report DUT {bare} (down or unplugged)")
+        return None
+    body = {**body, "dut_id": bare}
+    import requests
+
+    try:
+        resp = pi_registry.forward(host, "POST", path, timeout, json=body)
+    except requests.RequestException as e:
+        raise HTTPException(status_code=502, detail=f"Pi {host} failed for {dut_id}: {e}")
+    try:
+        data = resp.json()
+    except ValueError:
+        data = {"detail": resp.text}
+    if resp.status_code >= 400:
+        detail = data.get("detail", data) if isinstance(data, dict) else data
+        raise HTTPException(status_code=resp.status_code, detail=detail)
+    return {**data, "pi": host} if isinstance(data, dict) else data
 
 
 # -------------------------------------------------
-# SERIAL (optional stub — still local, can also be proxied)
+# SERIAL (routed to the owning Pi, else the local port pool)
 # -------------------------------------------------
 @app.post("/dut/serial/txrx")
-def serial_txrx(req: SerialTxRxRequest):
-    # if you want serial to go through the Pi too, call Pi here instead
-    raise HTTPException(status_code=501, detail="serial/txrx not implemented on Mac container")
+def serial_txrx(req: SerialTxRxRequest,
+                x_lnt_routed: str | None = Header(default=None)):
+    timeout = req.timeout or serial_io.SERIAL_TXRX_TIMEOUT_S
+    remote = _forward_to_owner(req.dut_id, "/dut/serial/txrx", req.model_dump(),
+                               x_lnt_routed, timeout + pi_client.timeout)
+    if remote is not None:
+        return remote
+    try:
+        result = serial_io.serial_txrx(
+            req.dut_id,
+            req.data,
+            terminator=req.terminator or "",
+            timeout=timeout,
+        )
+    except serial_io.UnknownDut as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except serial_io.PortInRawCapture as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if "error" in result:
+        raise HTTPException(status_code=502, detail=result["error"])
+    return result
+
+
+@app.post("/dut/serial/script")
+def serial_script(req: SerialScriptRequest,
+                  x_lnt_routed: str | None = Header(default=None)):
+    """
+    Run a whole send/expect script on one held-open port and return a
+    result per step, so a long test costs one round trip instead of one
+    per command. Stops at the first failing step unless it says
+    on_fail="continue".
+    """
+    budget = sum(s.timeout or serial_io.SERIAL_TXRX_TIMEOUT_S for s in req.steps)
+    remote = _forward_to_owner(req.dut_id, "/dut/serial/script", req.model_dump(),
+                               x_lnt_routed, budget + pi_client.timeout)
+    if remote is not None:
+        return remote
+    try:
+        result = serial_io.serial_script(
+            req.dut_id,
+            [step.model_dump() for step in req.steps],
+            baud=req.baud or serial_io.BAUD,
+        )
+    except serial_io.UnknownDut as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except serial_io.PortInRawCapture as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "error" in result:
+        raise HTTPException(status_code=502, detail=result["error"])
+    return result
+
+
+@app.get("/dut/serial/pool")
+def serial_pool_status():
+    return serial_io.serial_pool.status()
+
+
+# -------------------------------------------------
+# USB/IP (batches run concurrently, one command per device at a time)
+# -------------------------------------------------
+def _usbip_batch(results: list[dict]):
+    return {"ok": all(r["ok"] for r in results), "results": results}
+
+
+def _require(items: list[str], what: str):
+    if not items:
+        raise HTTPException(status_code=400, detail=f"No {what} given")
+
+
+@app.get("/usbip/devices")
+def usbip_devices():
+    return usbip_manager.status()
+
+
+@app.post("/usbip/reconcile")
+async def usbip_reconcile():
+    return await usbip_manager.reconcile()
+
+
+@app.post("/usbip/bind")
+async def usbip_bind(req: UsbipBindRequest):
+    _require(req.busids, "busids")
+    return _usbip_batch(await usbip_manager.bind(req.busids))
+
+
+@app.post("/usbip/unbind")
+async def usbip_unbind(req: UsbipBindRequest):
+    _require(req.busids, "busids")
+    return _usbip_batch(await usbip_manager.unbind(req.busids))
+
+
+@app.post("/usbip/attach")
+async def usbip_attach(req: UsbipAttachRequest):
+    _require(req.busids, "busids")
+    return _usbip_batch(await usbip_manager.attach(req.host, req.busids))
+
+
+@app.post("/usbip/detach")
+async def usbip_detach(req: UsbipDetachRequest):
+    _require(req.devices, "devices")
+    return _usbip_batch(await usbip_manager.detach(req.devices))
+
+
+@app.post("/usbip/reattach")
+async def usbip_reattach(host: str | None = None):
+    """Attach again everything that was attached and has dropped, e.g. after a Pi reboot."""
+    return _usbip_batch(await usbip_manager.reattach(host))
 
 
 # -------------------------------------------------
-# FLASH (optional stub)
+# FLASH (queued jobs, one per debug probe at a time)
 # -------------------------------------------------
+def _flash_job_or_404(job_id: str):
+    job = flash_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No flash job {job_id}")
+    return job
+
+
 @app.post("/dut/flash")
-def flash_dut(req: FlashRequest):
-    raise HTTPException(status_code=501, detail="flash not implemented on Mac container")
+async def flash_dut(req: FlashRequest, x_lnt_routed: str | None = Header(default=None)):
+    """
+    Queue a flash of `firmware_path` onto `dut_id` and return its job id
+    immediately. Without ALLOW_FLASH (or with dry_run) only the command
+    is returned. If, when the job's turn comes, the DUT already runs this
+    exact image (by SHA-256), the job ends as "skipped" unless `force` is
+    set. A DUT on another Pi is flashed there; the job id is then that
+    Pi's. Flashes run in parallel
+    only when the command names the DUT's probe (OpenOCD and a known USB
+    serial); all others share the configured probe and queue.
+    """
+    remote = await asyncio.to_thread(_forward_to_owner, req.dut_id, "/dut/flash",
+                                     req.model_dump(), x_lnt_routed)
+    if remote is not None:
+        return remote
+    # only a command that names its probe may run beside other flashes
+    probe = None
+    if flash_tool(req.tool) == "openocd":
+        probe = await asyncio.to_thread(probe_serial, req.dut_id)
+    try:
+        cmd = build_flash_cmd(tool=req.tool, port=None, firmware=req.firmware_path, probe=probe)
+    except FlashError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    allow = os.getenv("ALLOW_FLASH", "0").lower() in ("1", "true", "yes")
+    if req.dry_run or not allow:
+        return {"dry_run": True, "command": cmd, "executed": False}
+
+    # pinned: the stored copy must outlive pruning until the job has run
+    digest, stored = await asyncio.to_thread(firmware_store.put, req.firmware_path, True)
+
+    # flash the immutable stored copy, so the recorded hash is what was written
+    cmd = build_flash_cmd(tool=req.tool, port=None, firmware=stored, probe=probe)
+
+    def current(job) -> bool:
+        # asked when the job gets the probe: a flash queued ahead may change the image
+        return not req.force and firmware_store.is_current(req.dut_id, digest)
+
+    def record(job) -> None:
+        firmware_store.unpin(digest)
+        if job.state == SUCCEEDED:
+            firmware_store.record_flash(req.dut_id, digest, req.firmware_path)
+        elif job.state != SKIPPED:
+            firmware_store.forget(req.dut_id)
+
+    job = flash_scheduler.submit(cmd, probe=probe or DEFAULT_PROBE, dut_id=req.dut_id,
+                                 on_done=record, skip_if=current)
+    return {"dry_run": False, "command": cmd, "executed": True, "sha256": digest,
+            **job.status()}
+
+
+@app.get("/dut/flash/firmware")
+def firmware_cache_status():
+    return firmware_store.status()
+
+
+@app.get("/dut/flash/jobs")
+def flash_jobs():
+    return [job.status() for job in flash_scheduler.jobs()]
+
+
+@app.get("/dut/flash/jobs/{job_id}")
+def flash_job(job_id: str, tail: int = 50):
+    job = _flash_job_or_404(job_id)
+    return {**job.status(), "tail": job.tail(tail)}
+
+
+@app.post("/dut/flash/jobs/{job_id}/cancel")
+async def cancel_flash_job(job_id: str):
+    _flash_job_or_404(job_id)
+    job = await flash_scheduler.cancel(job_id)
+    return job.status()
+
+
+@app.get("/dut/flash/jobs/{job_id}/stream")
+def flash_job_stream(job_id: str, since: int = 0):
+    """stdout/stderr of a flash job as server-sent events (stderr lines are prefixed)."""
+    job = _flash_job_or_404(job_id)
+    return StreamingResponse(
+        sse_events(job.output, since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # -------------------------------------------------
@@ -103,19 +465,35 @@ def start_serial_log(req: SerialLogStartRequest):
             job_id=req.job_id,
             port=req.port,
             baudrate=req.baudrate,
+            mode=req.mode,
         )
+        session_id = session_id_for(req.job_id, req.port or SERIAL_PORT)
         return {
             "ok": True,
             "message": msg,
-            "status": serial_logger.status(),
+            "session_id": session_id,
+            "status": serial_logger.status(session_id),
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except CaptureUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/serial/log/stop")
-def stop_serial_log():
-    msg = serial_logger.stop()
+def stop_serial_log(req: SerialLogStopRequest | None = None):
+    """
+    Stop one session (session_id, or job_id/port), or every session
+    when called without a body.
+    """
+    req = req or SerialLogStopRequest()
+    msg = serial_logger.stop(
+        session_id=req.session_id,
+        job_id=req.job_id,
+        port=req.port,
+    )
     return {
         "ok": True,
         "message": msg,
@@ -124,5 +502,242 @@ def stop_serial_log():
 
 
 @app.get("/serial/log/status")
-def serial_log_status():
-    return serial_logger.status()
+def serial_log_status(session_id: str | None = None):
+    return serial_logger.status(session_id)
+
+
+@app.get("/serial/log/stream")
+def serial_log_stream(session_id: str, since: int | None = None,
+                      last_event_id: int | None = Header(default=None)):
+    """
+    Live lines of a capture session as server-sent events. Resume with
+    `since=<seq>` (or the Last-Event-ID header); `since=0` replays all
+    lines still held in the ring buffer.
+    """
+    ring = serial_logger.ring(session_id)
+    if ring is None:
+        raise HTTPException(status_code=404, detail=f"No capture session {session_id}")
+    if since is None:
+        since = last_event_id
+    return StreamingResponse(
+        sse_events(ring, since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/serial/log/{job_id}/range")
+def serial_log_range(job_id: str, start: str | None = None, end: str | None = None,
+                     pattern: str | None = None,
+                     limit: int = log_index.LOG_RANGE_MAX_LINES):
+    """
+    Lines from the latest text log of `job_id` (all its segments, plain or
+    compressed) in [start, end), optionally filtered by a regex.
+    `start`/`end` are epoch seconds or UTC ISO timestamps.
+    """
+    paths = log_index.find_text_logs(LOG_DIR, job_id)
+    if not paths:
+        raise HTTPException(status_code=404, detail=f"No text log for job_id={job_id}")
+    try:
+        t0 = vars_store.parse_time(start) if start else None
+        t1 = vars_store.parse_time(end) if end else None
+        return log_index.read_segments(paths, t0, t1, pattern=pattern,
+                                       limit=min(limit, log_index.LOG_RANGE_MAX_LINES))
+    except (ValueError, re.error) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/serial/log/merge")
+async def serial_log_merge(jobs: str | None = None, sessions: str | None = None,
+                     start: str | None = None, end: str | None = None,
+                     pattern: str | None = None, exclude: str | None = None,
+                     format: str = "ndjson"):
+    """
+    Several logs merged in timestamp order and streamed, one line per
+    source line: NDJSON {"ts", "source", "line"}, or `[ts] [source] line`
+    with format=text. `jobs` are job ids (their latest text log) and
+    `sessions` live capture sessions, both comma-separated; sessions are
+    followed until they stop or `end` has passed. `pattern`/`exclude` are
+    regexes searched in each line's text.
+    """
+    job_ids = [j.strip() for j in jobs.split(",") if j.strip()] if jobs else []
+    session_ids = [s.strip() for s in sessions.split(",") if s.strip()] if sessions else []
+    if not job_ids and not session_ids:
+        raise HTTPException(status_code=400, detail="Give jobs and/or sessions to merge")
+    if format not in ("ndjson", "text"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or text")
+    try:
+        t0 = vars_store.parse_time(start) if start else None
+        t1 = vars_store.parse_time(end) if end else None
+        for p in (pattern, exclude):
+            if p:
+                re.compile(p)
+    except (ValueError, re.error) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    def open_sources():
+        sources = [log_merge.job_source(j, t0, t1, LOG_DIR) for j in job_ids]
+        return sources + [log_merge.session_source(serial_logger, s, t0, t1)
+                          for s in session_ids]
+
+    try:
+        sources = await asyncio.to_thread(open_sources)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+    fmt = log_merge.format_text if format == "text" else json.dumps
+
+    async def body():
+        async for rec in log_merge.amerge(sources, pattern, exclude, idle=STREAM_KEEPALIVE_S):
+            # None: still waiting on a session; an empty chunk lets a gone client be noticed
+            yield "" if rec is None else fmt(rec) + "\n"
+
+    return StreamingResponse(
+        body(),
+        media_type="application/x-ndjson" if format == "ndjson" else "text/plain",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# -------------------------------------------------
+# TRIGGERS / WAIT-FOR
+# -------------------------------------------------
+def _triggers_or_404(session_id: str):
+    engine = serial_logger.triggers(session_id)
+    if engine is None:
+        raise HTTPException(status_code=404, detail=f"No capture session {session_id}")
+    return engine
+
+
+@app.post("/serial/triggers")
+def add_trigger(req: TriggerRequest):
+    try:
+        trigger = serial_logger.add_trigger(req.session_id, req.pattern, literal=req.literal,
+                                            action=req.action, name=req.name, since=req.since)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No running capture session {req.session_id}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return trigger.status()
+
+
+@app.get("/serial/triggers")
+def list_triggers(session_id: str):
+    engine = _triggers_or_404(session_id)
+    return {"session_id": session_id, "seq": engine.seq, "triggers": engine.list()}
+
+
+@app.delete("/serial/triggers/{trigger_id}")
+def delete_trigger(trigger_id: str, session_id: str):
+    if not _triggers_or_404(session_id).remove(trigger_id):
+        raise HTTPException(status_code=404, detail=f"No trigger {trigger_id}")
+    return {"ok": True, "trigger_id": trigger_id}
+
+
+@app.post("/serial/triggers/wait")
+async def wait_for_trigger(req: TriggerWaitRequest):
+    """
+    Long-poll until one of the triggers matches a line (a hit newer than
+    `after`), or `timeout` passes. Pass the returned `seq` as `after` to
+    wait for the next hit. A stopped session's hits can still be waited
+    for during TRIGGER_RETAIN_S; the reply then says `closed`.
+    """
+    engine = _triggers_or_404(req.session_id)
+    hit = await engine.wait_async(req.trigger_ids, req.after, req.timeout)
+    return {"matched": hit is not None, "hit": hit, "seq": hit["seq"] if hit else req.after,
+            "closed": engine.closed}
+
+
+# max payload returned by one raw capture query
+RAW_RANGE_MAX_BYTES = settings.RAW_RANGE_MAX_BYTES
+
+
+@app.get("/serial/raw/{job_id}")
+def serial_raw_range(job_id: str, start: str | None = None, end: str | None = None):
+    """
+    Bytes captured in raw mode for `job_id` in [start, end), concatenated
+    as received. `start`/`end` are epoch seconds or UTC ISO timestamps.
+    """
+    path = raw_capture.find_raw_capture(LOG_DIR, job_id)
+    if not path:
+        raise HTTPException(status_code=404, detail=f"No raw capture for job_id={job_id}")
+    try:
+        with raw_capture.RawCapture(path) as cap:
+            t0 = cap.mono_ns(int(vars_store.parse_time(start) * 1e9)) if start else None
+            t1 = cap.mono_ns(int(vars_store.parse_time(end) * 1e9)) if end else None
+            data, chunks, truncated = cap.read(t0, t1, limit=RAW_RANGE_MAX_BYTES)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content=data, media_type="application/octet-stream", headers={
+        "X-Raw-File": os.path.basename(path),
+        "X-Raw-Chunks": str(chunks),
+        "X-Raw-Truncated": "1" if truncated else "0",
+    })
+
+
+# -------------------------------------------------
+# PARSED VARIABLES (COLUMNAR STORE)
+# -------------------------------------------------
+def _vars_store_or_404(job_id: str) -> str:
+    path = vars_store.find_store(LOG_DIR, job_id)
+    if not path:
+        raise HTTPException(status_code=404, detail=f"No vars store for job_id={job_id}")
+    return path
+
+
+@app.get("/serial/vars/{job_id}")
+def serial_vars_columns(job_id: str):
+    path = _vars_store_or_404(job_id)
+    return {
+        "job_id": job_id,
+        "store": path,
+        "rows": vars_store.row_count(path),
+        "columns": sorted(vars_store.list_columns(path)),
+    }
+
+
+@app.get("/serial/vars/{job_id}/data")
+def serial_vars_data(job_id: str, names: str | None = None,
+                     start: str | None = None, end: str | None = None):
+    """
+    Columns for the latest run of `job_id`. `names` is comma-separated
+    (default: all); `start`/`end` are epoch seconds or UTC ISO timestamps.
+    """
+    path = _vars_store_or_404(job_id)
+    try:
+        t0 = vars_store.parse_time(start) if start else None
+        t1 = vars_store.parse_time(end) if end else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    wanted = [n.strip() for n in names.split(",") if n.strip()] if names else None
+    return vars_store.read_columns(path, wanted, t0, t1)
+
+
+@app.get("/serial/vars/{job_id}/downsample")
+def serial_vars_downsample(job_id: str, name: str, start: str | None = None,
+                           end: str | None = None, points: int = 1000, mode: str = "agg"):
+    """
+    At most about `points` points of one variable for plotting, computed
+    on the host instead of shipping every row. mode="agg" returns
+    count/min/max/mean/last per time bucket (cached per resolution, so
+    zoom and pan are cheap); mode="lttb" returns real samples picked by
+    Largest-Triangle-Three-Buckets.
+    """
+    if mode not in vars_agg.MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(vars_agg.MODES)}")
+    if not 2 <= points <= vars_agg.VARS_AGG_MAX_POINTS:
+        raise HTTPException(status_code=400,
+                            detail=f"points must be between 2 and {vars_agg.VARS_AGG_MAX_POINTS}")
+    path = _vars_store_or_404(job_id)
+    try:
+        t0 = vars_store.parse_time(start) if start else None
+        t1 = vars_store.parse_time(end) if end else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    reduce = vars_agg.aggregate if mode == vars_agg.AGG else vars_agg.lttb
+    try:
+        result = reduce(path, name, t0, t1, points)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No variable {name} in job_id={job_id}")
+    return {"job_id": job_id, "name": name, "mode": mode, "points": len(result["t"]), **result}
@@ -0,0 +1,226 @@
+"""
+metrics.py — Minimal Prometheus instrumentation (text exposition format 0.0.4).
+
+Counters and histograms are plain Python objects: inc()/observe() is an
+attribute add (plus a bisect for histograms), cheap enough for hot loops
+and with no extra dependency. Values that components already keep as
+plain counters (bytes read per session, writer queue depth, ...) are not
+duplicated; a collector callback reads them at scrape time instead.
+
+    FLUSH_SECONDS = histogram("serial_log_flush_seconds", "...")
+    FLUSH_SECONDS.observe(0.004)
+    register_collector(lambda: [...])
+    render()  # -> text for GET /metrics
+"""
+from __future__ import annotations
+
+import math
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds; covers sub-ms file writes up to multi-minute flashes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# (metric name, type, help, [(labels, value)])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+_lock = threading.Lock()
+_metrics: List["_Metric"] = []
+_collectors: List[Callable[[], Iterable[Family]]] = []
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, n: float = 1) -> None:
+        self.value += n
+
+
+class _HistogramValue:
+    __slots__ = ("_bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot: +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        self.counts[bisect_left(self._bounds, v)] += 1
+        self.sum += v
+        self.count += 1
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._default = None if labelnames else self._new()
+
+    def _new(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The child for one label combination; keep it around in hot paths."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with _lock:
+                child = self._children.setdefault(key, self._new())
+        return child
+
+    def _series(self) -> List[Tuple[Dict[str, str], object]]:
+        if self._default is not None:
+            return [({}, self._default)]
+        return [(dict(zip(self.labelnames, k)), c) for k, c in list(self._children.items())]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, n: float = 1) -> None:
+        self._default.inc(n)
+
+    def family(self) -> Family:
+        return (self.name, self.kind, self.help,
+                [(labels, c.value) for labels, c in self._series()])
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, v: float) -> None:
+        self._default.observe(v)
+
+    def family(self) -> Family:
+        samples: List[Tuple[Dict[str, str], float]] = []
+        for labels, h in self._series():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), h.counts):
+                cumulative += n
+                samples.append(({**labels, "le": _fmt(bound), "__suffix": "_bucket"},
+                                cumulative))
+            samples.append(({**labels, "__suffix": "_sum"}, h.sum))
+            samples.append(({**labels, "__suffix": "_count"}, h.count))
+        return self.name, self.kind, self.help, samples
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    """`name` should end in `_total`, as Prometheus expects for counters."""
+    return _register(Counter(name, help, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, labelnames, buckets))
+
+
+def _register(metric):
+    with _lock:
+        _metrics.append(metric)
+    return metric
+
+
+def register_collector(fn: Callable[[], Iterable[Family]]) -> None:
+    """`fn()` is called on every scrape and returns metric families."""
+    with _lock:
+        _collectors.append(fn)
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if v == -math.inf:
+        return "-Inf"
+    if float(v).is_integer() and abs(v) < 1e15:
+        return str(int(v))
+    return repr(float(v))
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render() -> str:
+    with _lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+    families: List[Family] = [m.family() for m in metrics]
+    for fn in collectors:
+        try:
+            families.extend(fn())
+        except Exception:
+            # a broken collector must not take /metrics down with it
+            continue
+
+    out: List[str] = []
+    for name, kind, help, samples in families:
+        out.append(f"# HELP {name} {_escape(help)}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            labels = dict(labels)
+            suffix = labels.pop("__suffix", "")
+            text = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+            out.append(f"{name}{suffix}{{{text}}} {_fmt(value)}" if text
+                       else f"{name}{suffix} {_fmt(value)}")
+    return "\n".join(out) + "\n"
+
+
+def gauge_family(name: str, help: str,
+                 samples: Iterable[Tuple[Dict[str, str], float]]) -> Family:
+    return name, "gauge", help, list(samples)
+
+
+def counter_family(name: str, help: str,
+                   samples: Iterable[Tuple[Dict[str, str], float]]) -> Family:
+    return name, "counter", help, list(samples)
+
+
+# the anyio CapacityLimiter sync handlers run under; set at app startup
+_thread_limiter = None
+
+
+def watch_thread_limiter(limiter) -> None:
+    """Report `limiter`'s use as threadpool_* gauges, to see sync handlers queueing."""
+    global _thread_limiter
+    _thread_limiter = limiter
+
+
+def _threadpool() -> List[Family]:
+    limiter = _thread_limiter
+    if limiter is None:
+        return []
+    stats = limiter.statistics()
+    return [
+        gauge_family("threadpool_threads", "Threads sync handlers may use",
+                     [({}, stats.total_tokens)]),
+        gauge_family("threadpool_busy", "Sync handlers running in a thread",
+                     [({}, stats.borrowed_tokens)]),
+        gauge_family("threadpool_waiting", "Sync handlers waiting for a thread",
+                     [({}, stats.tasks_waiting)]),
+    ]
+
+
+register_collector(_threadpool)
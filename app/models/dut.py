@@ -8,3 +8,4 @@ class DutModel(BaseModel):
     pid: str
     description: str
     status: str = "idle"
+    serial: str | None = None  # USB serial number (an XDS110's is its probe's)
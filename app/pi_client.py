@@ -0,0 +1,85 @@
+"""
+pi_client.py — Pooled, concurrent HTTP client for the lab's Pis.
+
+The host proxies DUT discovery (and, later, serial/flash) to the Pis that
+actually see the hardware. All calls share one requests.Session whose
+adapter keeps a keep-alive pool per Pi, and per-Pi requests run in
+parallel on a small executor (see duts_cache.py), so a sweep over N Pis
+costs roughly the latency of the slowest healthy one. Every Pi has its own (connect, read)
+timeout; a Pi that is down or slow only removes its own DUTs from the
+answer.
+
+`requests` is only imported when the first call is made, so importing
+this module (and the app) stays cheap.
+"""
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from . import metrics
+from .core.config import settings
+
+if TYPE_CHECKING:
+    import requests
+
+# change this if your Pi IP changes
+PI_HOST = settings.PI_HOST
+# comma-separated list of Pi base URLs; falls back to PI_HOST
+PI_HOSTS = [h.strip().rstrip("/") for h in settings.PI_HOSTS.split(",") if h.strip()] \
+    or [PI_HOST.rstrip("/")]
+PI_CONNECT_TIMEOUT_S = settings.PI_CONNECT_TIMEOUT_S
+PI_TIMEOUT_S = settings.PI_TIMEOUT_S
+# keep-alive connections kept per Pi
+PI_POOL_SIZE = settings.PI_POOL_SIZE
+
+PI_REQUEST_SECONDS = metrics.histogram(
+    "pi_request_seconds", "Latency of proxied calls to a Pi", ("pi", "outcome"))
+
+
+class PiClient:
+    def __init__(self, hosts: Optional[List[str]] = None,
+                 connect_timeout: float = PI_CONNECT_TIMEOUT_S,
+                 timeout: float = PI_TIMEOUT_S,
+                 pool_size: int = PI_POOL_SIZE) -> None:
+        self.hosts = list(hosts or PI_HOSTS)
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session: Optional[requests.Session] = None
+        self._session_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(8, len(self.hosts) * 4),
+            thread_name_prefix="pi-client",
+        )
+
+    def _get_session(self) -> requests.Session:
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=max(len(self.hosts), 1),
+                                          pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def request(self, host: str, method: str, path: str,
+                timeout: Optional[float] = None, **kwargs: Any) -> requests.Response:
+        return self._get_session().request(
+            method, f"{host}{path}",
+            timeout=(self.connect_timeout, timeout or self.timeout),
+            **kwargs,
+        )
+
+    def submit(self, fn, *args: Any) -> Future:
+        """Run `fn(*args)` on the client's executor (e.g. one call per Pi)."""
+        return self._executor.submit(fn, *args)
+
+
+pi_client = PiClient()
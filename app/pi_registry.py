@@ -0,0 +1,305 @@
+"""
+pi_registry.py — Which Pis are alive, and which Pi owns which DUT.
+
+A background thread heartbeats every registered Pi with `GET /duts`,
+sending the ETag of the last answer as If-None-Match: a Pi whose DUTs
+haven't changed answers 304 with no body, so a steady lab costs one
+tiny request per Pi per interval. When a Pi's list does change, only
+the difference (DUTs gone, DUTs new) is applied to the routing index.
+
+The index is a plain dict dut_id -> Pis reporting it, so routing a
+request is one lookup however many Pis there are. DUT ids are only
+unique per Pi (`_dev_ttyACM0` exists on most of them): an id reported by
+more than one Pi is ambiguous and not routed (AmbiguousDut); callers
+qualify it as `<dut_id>@<pi>` instead. A Pi that misses PI_DOWN_AFTER
+heartbeats in a row, or whose connection fails while a request is being
+forwarded to it, is marked down and its DUTs leave the index at once;
+they come back with its next successful heartbeat.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+from . import metrics
+from .core.config import settings
+from .pi_client import PiClient, pi_client
+
+if TYPE_CHECKING:
+    import requests
+
+# seconds between heartbeats; 0 disables the background thread
+PI_HEARTBEAT_S = settings.PI_HEARTBEAT_S
+# read timeout of a heartbeat; kept short so a hung Pi is noticed quickly
+PI_HEARTBEAT_TIMEOUT_S = settings.PI_HEARTBEAT_TIMEOUT_S
+# consecutive failed heartbeats before a Pi is taken out of routing
+PI_DOWN_AFTER = settings.PI_DOWN_AFTER
+
+# set on requests the host forwards to a Pi, so the Pi serves them locally
+ROUTED_HEADER = "X-LNT-Routed"
+
+
+class AmbiguousDut(LookupError):
+    """A DUT id reported by several Pis; it has to be qualified with one of them."""
+
+    def __init__(self, dut_id: str, hosts: Iterable[str]) -> None:
+        self.dut_id = dut_id
+        self.hosts = sorted(hosts)
+        super().__init__(f"DUT {dut_id} is on several Pis; use one of: "
+                         + ", ".join(f"{dut_id}@{h}" for h in self.hosts))
+
+
+class _Pi:
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.healthy = False
+        self.failures = 0
+        self.etag: Optional[str] = None
+        self.duts: frozenset = frozenset()
+        self.last_ok: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.latency_ms: Optional[float] = None
+        self.not_modified = 0
+
+    def status(self) -> dict:
+        return {
+            "pi": self.host,
+            "healthy": self.healthy,
+            "failures": self.failures,
+            "duts": len(self.duts),
+            "last_ok": self.last_ok,
+            "last_error": self.last_error,
+            "latency_ms": self.latency_ms,
+            "not_modified": self.not_modified,
+        }
+
+
+class PiRegistry:
+    def __init__(self, client: Optional[PiClient] = None, hosts: Optional[Iterable[str]] = None,
+                 interval: float = PI_HEARTBEAT_S, timeout: float = PI_HEARTBEAT_TIMEOUT_S,
+                 down_after: int = PI_DOWN_AFTER) -> None:
+        self._client = client or pi_client
+        self.interval = interval
+        self.timeout = timeout
+        self.down_after = max(1, down_after)
+        self._lock = threading.Lock()
+        self._pis: Dict[str, _Pi] = {}
+        self._route: Dict[str, frozenset] = {}  # dut_id -> hosts reporting it
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.heartbeats = 0
+        for host in hosts if hosts is not None else self._client.hosts:
+            self.register(host)
+
+    # -------------------------------------------------
+    # membership
+    # -------------------------------------------------
+    def register(self, host: str) -> bool:
+        """Add a Pi; it is routed to after its first good heartbeat."""
+        host = host.strip().rstrip("/")
+        with self._lock:
+            if host in self._pis:
+                return False
+            self._pis[host] = _Pi(host)
+        self._wake.set()
+        return True
+
+    def unregister(self, host: str) -> bool:
+        host = host.strip().rstrip("/")
+        with self._lock:
+            pi = self._pis.pop(host, None)
+            if pi is not None:
+                self._drop(pi)
+        return pi is not None
+
+    def hosts(self) -> List[str]:
+        with self._lock:
+            return list(self._pis)
+
+    # -------------------------------------------------
+    # routing
+    # -------------------------------------------------
+    def split(self, dut_id: str) -> Tuple[str, Optional[str]]:
+        """`<dut_id>@<pi>` -> (dut_id, pi) for a registered Pi; else (dut_id, None)."""
+        bare, sep, host = dut_id.rpartition("@")
+        if sep and host.rstrip("/") in self._pis:
+            return bare, host.rstrip("/")
+        return dut_id, None
+
+    def route(self, dut_id: str) -> Optional[str]:
+        """
+        The healthy Pi that reports `dut_id` (plain or `<dut_id>@<pi>`), or
+        None; raises AmbiguousDut if several healthy Pis report a plain id.
+        """
+        bare, host = self.split(dut_id)
+        owners = self._route.get(bare, frozenset())
+        if host is not None:
+            return host if host in owners else None
+        if len(owners) > 1:
+            raise AmbiguousDut(bare, owners)
+        return next(iter(owners), None)
+
+    def _unroute(self, dut_id: str, host: str) -> None:
+        # caller holds the lock; sets are replaced, never mutated, so route() needs no lock
+        owners = self._route.get(dut_id, frozenset()) - {host}
+        if owners:
+            self._route[dut_id] = owners
+        else:
+            self._route.pop(dut_id, None)
+
+    def _drop(self, pi: _Pi) -> None:
+        # caller holds the lock
+        for dut_id in pi.duts:
+            self._unroute(dut_id, pi.host)
+
+    def _apply(self, pi: _Pi, duts: frozenset) -> None:
+        # caller holds the lock; only touch the ids that changed
+        if pi.healthy:
+            for dut_id in pi.duts - duts:
+                self._unroute(dut_id, pi.host)
+            added = duts - pi.duts
+        else:
+            added = duts
+        for dut_id in added:
+            self._route[dut_id] = self._route.get(dut_id, frozenset()) | {pi.host}
+        pi.duts = duts
+
+    def observe(self, host: str, duts: Iterable[Any], etag: Optional[str] = None) -> None:
+        """Record a good /duts answer from `host` (heartbeat or a fan-out)."""
+        ids = frozenset(d.get("id") if isinstance(d, dict) else d for d in duts) - {None}
+        with self._lock:
+            pi = self._pis.get(host)
+            if pi is None:
+                return
+            self._apply(pi, ids)
+            pi.healthy = True
+            pi.failures = 0
+            if etag is not None:
+                pi.etag = etag
+            pi.last_ok = time.time()
+            pi.last_error = None
+
+    def mark_down(self, host: str, error: str = "unreachable") -> None:
+        """Take `host` out of routing now (a forwarded request couldn't connect)."""
+        with self._lock:
+            pi = self._pis.get(host)
+            if pi is None:
+                return
+            pi.failures = max(pi.failures, self.down_after)
+            pi.last_error = error
+            pi.etag = None
+            if pi.healthy:
+                pi.healthy = False
+                self._drop(pi)
+        self._wake.set()
+
+    def _failed(self, host: str, error: str) -> None:
+        with self._lock:
+            pi = self._pis.get(host)
+            if pi is None:
+                return
+            pi.failures += 1
+            pi.last_error = error
+            if pi.healthy and pi.failures >= self.down_after:
+                pi.healthy = False
+                pi.etag = None
+                self._drop(pi)
+
+    def forward(self, host: str, method: str, path: str,
+                timeout: Optional[float] = None, **kwargs: Any) -> requests.Response:
+        """
+        Send a request on to `host`. Failing to connect marks it down; a
+        slow answer (read timeout) doesn't, long flashes are expected.
+        """
+        import requests
+
+        headers = {**kwargs.pop("headers", {}), ROUTED_HEADER: "1"}
+        try:
+            return self._client.request(host, method, path, timeout, headers=headers, **kwargs)
+        except requests.ConnectionError as e:
+            self.mark_down(host, str(e))
+            raise
+
+    # -------------------------------------------------
+    # heartbeats
+    # -------------------------------------------------
+    def _beat(self, host: str, etag: Optional[str]) -> None:
+        t0 = time.monotonic()
+        try:
+            headers = {"If-None-Match": etag} if etag else {}
+            resp = self._client.request(host, "GET", "/duts", self.timeout, headers=headers)
+            if resp.status_code == 304:
+                with self._lock:
+                    pi = self._pis.get(host)
+                    if pi is not None and pi.healthy:
+                        pi.failures = 0
+                        pi.last_ok = time.time()
+                        pi.not_modified += 1
+                        pi.latency_ms = round((time.monotonic() - t0) * 1000, 1)
+                        return
+                # 304 for a Pi we had dropped: fetch the full list again
+                resp = self._client.request(host, "GET", "/duts", self.timeout)
+            resp.raise_for_status()
+            data = resp.json()
+            items = data.get("duts", []) if isinstance(data, dict) else data
+            self.observe(host, items or [], resp.headers.get("ETag"))
+            with self._lock:
+                pi = self._pis.get(host)
+                if pi is not None:
+                    pi.latency_ms = round((time.monotonic() - t0) * 1000, 1)
+        except Exception as e:
+            self._failed(host, str(e))
+
+    def heartbeat(self) -> None:
+        """One round: every Pi at once, returning when all have answered."""
+        with self._lock:
+            targets = [(pi.host, pi.etag) for pi in self._pis.values()]
+        futures = [self._client.submit(self._beat, host, etag)
+                   for host, etag in targets]
+        for fut in futures:
+            fut.result()
+        self.heartbeats += 1
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.clear()
+            self.heartbeat()
+            self._wake.wait(self.interval)
+
+    def start(self) -> None:
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pi-heartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout + self._client.connect_timeout + 1)
+            self._thread = None
+
+    def status(self) -> dict:
+        with self._lock:
+            pis = [pi.status() for pi in self._pis.values()]
+            routes = len(self._route)
+            ambiguous = {d: sorted(h) for d, h in self._route.items() if len(h) > 1}
+        return {"pis": pis, "routes": routes, "ambiguous": ambiguous,
+                "heartbeats": self.heartbeats, "interval_s": self.interval}
+
+    def collect(self):
+        with self._lock:
+            pis = list(self._pis.values())
+        return [
+            metrics.gauge_family("pi_up", "1 if the Pi answers heartbeats",
+                                 [({"pi": p.host}, int(p.healthy)) for p in pis]),
+            metrics.gauge_family("pi_duts", "DUTs routed to each Pi",
+                                 [({"pi": p.host}, len(p.duts) if p.healthy else 0) for p in pis]),
+        ]
+
+
+pi_registry = PiRegistry()
+metrics.register_collector(pi_registry.collect)
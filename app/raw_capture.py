@@ -0,0 +1,236 @@
+"""
+raw_capture.py — Raw (binary) serial capture files and an mmap reader.
+
+For DUTs that stream binary telemetry, line splitting/decoding is both
+wrong (frames get mangled) and too slow at multi-Mbaud rates. In raw mode
+every chunk read from the tty is written as-is behind a 16-byte header:
+
+    file   := b"LNTRAW01" | u32 meta_len | meta (JSON) | record*
+    record := u64 monotonic_ns | u32 length | u16 port_id | u16 flags | data
+
+All integers little-endian. `meta` records the port, its id, the baud rate
+and one (wall clock ns, monotonic ns) pair taken at open, so record times
+can be mapped to UTC. Records are in time order.
+
+RawCapture maps the file and iterates or time-slices the records without
+reading the payloads it skips; a trailing record cut short by a crash is
+ignored.
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import re
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from typing import Iterator, List, Optional, Tuple
+
+MAGIC = b"LNTRAW01"
+_META_LEN = struct.Struct("<I")
+RECORD = struct.Struct("<QIHH")
+
+
+class PortInRawCapture(RuntimeError):
+    """txrx/scripts on a port whose capture keeps bytes, not lines."""
+
+
+def find_raw_capture(log_dir: str, job_id: str) -> Optional[str]:
+    """Latest `<job_id>_<YYYYmmdd_HHMMSS>_raw.bin` in `log_dir`, if any."""
+    pat = re.compile(re.escape(job_id) + r"_\d{8}_\d{6}_raw\.bin$")
+    try:
+        names = sorted(n for n in os.listdir(log_dir) if pat.match(n))
+    except FileNotFoundError:
+        return None
+    return os.path.join(log_dir, names[-1]) if names else None
+
+
+class RawSink:
+    """
+    Writer side, driven by LogWriter like a LogSink: the capture reactor
+    submits (monotonic_ns, chunk) pairs, the writer thread frames them into
+    a buffer and flush() writes it out.
+    """
+
+    def __init__(self, path: str, port: str, port_id: int, baudrate: int,
+                 fsync: bool = False) -> None:
+        self.path = path
+        self.log_dir = os.path.dirname(path)
+        # `<run>_raw.bin`; the disk budget counts the file as one unit of the run
+        self.run = os.path.basename(path)[: -len("_raw.bin")]
+        self.port_id = port_id
+        self._fsync = fsync
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            meta = json.dumps({
+                "port": port, "port_id": port_id, "baudrate": baudrate,
+                "wall_ns": time.time_ns(), "mono_ns": time.monotonic_ns(),
+            }).encode()
+            self._file.write(MAGIC + _META_LEN.pack(len(meta)) + meta)
+            self._file.flush()
+        self._buf = bytearray()
+        self.oldest_pending: Optional[float] = None
+        self.chunks_written = 0
+        self.bytes_written = 0
+        self.chunks_dropped = 0
+        self.bytes_dropped = 0
+        self._pending_chunks = 0
+
+    @property
+    def pending_bytes(self) -> int:
+        return len(self._buf)
+
+    @property
+    def segment_key(self) -> Tuple[str, str]:
+        return self.run, "raw"
+
+    def append(self, mono_ns: int, data: bytes) -> None:
+        if self.oldest_pending is None:
+            self.oldest_pending = time.monotonic()
+        self._buf += RECORD.pack(mono_ns, len(data), self.port_id, 0)
+        self._buf += data
+        self._pending_chunks += 1
+        self.bytes_written += len(data)
+
+    def dropped(self, data: bytes) -> int:
+        """Account a chunk the writer couldn't take; returns lines lost (none)."""
+        self.chunks_dropped += 1
+        self.bytes_dropped += len(data)
+        return 0
+
+    def flush(self) -> int:
+        n = len(self._buf)
+        if n:
+            self._file.write(self._buf)
+            self._buf.clear()
+        self._file.flush()
+        if self._fsync and n:
+            os.fsync(self._file.fileno())
+        self.chunks_written += self._pending_chunks
+        self._pending_chunks = 0
+        self.oldest_pending = None
+        return n
+
+    def maybe_rotate(self) -> bool:
+        return False
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+    def status(self) -> dict:
+        return {
+            "raw_path": self.path,
+            "chunks_written": self.chunks_written,
+            "bytes_written": self.bytes_written,
+            "chunks_dropped": self.chunks_dropped,
+            "bytes_dropped": self.bytes_dropped,
+        }
+
+
+class RawCapture:
+    """
+    Read side. Iterating yields (monotonic_ns, port_id, data) per record;
+    slice() narrows to a time window with a bisect over a header-only
+    index built on first use.
+
+        with RawCapture(path) as cap:
+            for ts, port_id, data in cap.slice(t0, t1):
+                ...
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        if self._mm is None or self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"not a raw capture: {path}")
+        (meta_len,) = _META_LEN.unpack_from(self._mm, len(MAGIC))
+        start = len(MAGIC) + _META_LEN.size
+        self.meta = json.loads(self._mm[start:start + meta_len])
+        self._data_start = start + meta_len
+        self._ts: Optional[array] = None
+        self._offsets: Optional[array] = None
+
+    def __enter__(self) -> "RawCapture":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    # -------------------------------------------------
+    # clocks
+    # -------------------------------------------------
+    def wall_ns(self, mono_ns: int) -> int:
+        return mono_ns - self.meta["mono_ns"] + self.meta["wall_ns"]
+
+    def mono_ns(self, wall_ns: int) -> int:
+        return wall_ns - self.meta["wall_ns"] + self.meta["mono_ns"]
+
+    # -------------------------------------------------
+    # records
+    # -------------------------------------------------
+    def _records(self, pos: int) -> Iterator[Tuple[int, int, int, int]]:
+        """(offset, ts, port_id, length) from `pos`, headers only."""
+        mm = self._mm
+        end = len(mm)
+        while pos + RECORD.size <= end:
+            ts, length, port_id, _ = RECORD.unpack_from(mm, pos)
+            if pos + RECORD.size + length > end:
+                return  # torn final record
+            yield pos, ts, port_id, length
+            pos += RECORD.size + length
+
+    def _index(self) -> Tuple[array, array]:
+        if self._ts is None:
+            ts, offsets = array("Q"), array("Q")
+            for off, t, _, _ in self._records(self._data_start):
+                ts.append(t)
+                offsets.append(off)
+            self._ts, self._offsets = ts, offsets
+        return self._ts, self._offsets
+
+    def __iter__(self) -> Iterator[Tuple[int, int, bytes]]:
+        return self.slice()
+
+    def __len__(self) -> int:
+        return len(self._index()[0])
+
+    def slice(self, start_ns: Optional[int] = None,
+              end_ns: Optional[int] = None) -> Iterator[Tuple[int, int, bytes]]:
+        """Records with start_ns <= monotonic ts < end_ns."""
+        pos = self._data_start
+        if start_ns is not None:
+            ts, offsets = self._index()
+            i = bisect_left(ts, start_ns)
+            if i >= len(ts):
+                return
+            pos = offsets[i]
+        mm = self._mm
+        for off, t, port_id, length in self._records(pos):
+            if end_ns is not None and t >= end_ns:
+                return
+            data_at = off + RECORD.size
+            yield t, port_id, mm[data_at:data_at + length]
+
+    def read(self, start_ns: Optional[int] = None, end_ns: Optional[int] = None,
+             limit: Optional[int] = None) -> Tuple[bytes, int, bool]:
+        """Concatenated payload of a window: (data, chunks, truncated)."""
+        parts: List[bytes] = []
+        size = 0
+        for _, _, data in self.slice(start_ns, end_ns):
+            if limit is not None and size + len(data) > limit:
+                return b"".join(parts), len(parts), True
+            parts.append(data)
+            size += len(data)
+        return b"".join(parts), len(parts), False
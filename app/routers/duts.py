@@ -1,10 +1,18 @@
-from fastapi import APIRouter
-from typing import List
+from fastapi import APIRouter, Header, Response
+from typing import List, Optional
 from ..models.dut import DutModel
-from ..services.usb import list_duts
+from ..services.usb import inventory
 
 router = APIRouter()
 
 @router.get("/duts", response_model=List[DutModel])
-def get_duts():
-    return list_duts()
+def get_duts(response: Response, if_none_match: Optional[str] = Header(default=None)):
+    etag, duts = inventory.snapshot()
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return duts
+
+@router.get("/duts/inventory")
+def get_inventory():
+    return inventory.status()
@@ -1,29 +1,429 @@
-import glob, os, time
-import serial
-from dotenv import load_dotenv
+from __future__ import annotations
 
-load_dotenv()
-BAUD = int(os.getenv("SERIAL_BAUD", "115200"))
+import glob, re, threading, time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
-def _guess_serial_port():
+from .core.config import settings
+from .raw_capture import PortInRawCapture
+from .serial_logger import SerialLogger, serial_logger
+
+if TYPE_CHECKING:
+    import serial
+
+BAUD = settings.SERIAL_BAUD
+# pooled ports nobody has used for this long are closed
+SERIAL_POOL_IDLE_S = settings.SERIAL_POOL_IDLE_S
+# how long serial_txrx waits for a response line
+SERIAL_TXRX_TIMEOUT_S = settings.SERIAL_TXRX_TIMEOUT_S
+# longest send/expect script accepted in one call
+SERIAL_SCRIPT_MAX_STEPS = settings.SERIAL_SCRIPT_MAX_STEPS
+
+def _serial_candidates() -> List[str]:
     # macOS typical device names
     candidates = sorted(glob.glob("/dev/tty.usbmodem*")) + sorted(glob.glob("/dev/tty.usbserial*"))
     # Linux fallback if you run on Pi later
     candidates += sorted(glob.glob("/dev/ttyACM*")) + sorted(glob.glob("/dev/ttyUSB*"))
-    return candidates[0] if candidates else None
+    return candidates
+
+
+class UnknownDut(LookupError):
+    """A DUT id that names no serial port on this host."""
+
+
+def match_port(dut_id: str) -> Optional[str]:
+    """
+    The tty a DUT id names: a device path, or the id format used by /duts
+    (device path with "/" replaced by "_"). None if no port matches.
+    """
+    if dut_id.startswith("/"):
+        return dut_id
+    from serial.tools import list_ports
+
+    for p in list_ports.comports():
+        if p.device.replace("/", "_") == dut_id:
+            return p.device
+    return None
+
+
+def resolve_port(dut_id: str) -> Optional[str]:
+    """
+    match_port(), except that an unknown id falls back to the host's serial
+    port when it has exactly one, as single-DUT setups always did. With
+    several ports an unknown id is ambiguous and resolves to None.
+    """
+    port = match_port(dut_id)
+    if port is None:
+        candidates = _serial_candidates()
+        port = candidates[0] if len(candidates) == 1 else None
+    return port
+
+
+class _PooledPort:
+    def __init__(self, port: str) -> None:
+        self.port = port
+        self.lock = threading.Lock()
+        self.ser: Optional[serial.Serial] = None
+        self.baud = BAUD
+        self.last_used = time.monotonic()
+        self.commands = 0
+
+
+class SerialPool:
+    """
+    Keeps serial ports open between serial_txrx calls.
+
+    One entry per port, each with its own lock, so concurrent commands to
+    the same DUT are serialized while different DUTs proceed in parallel.
+    Ports idle for `idle_s` are closed by a background sweep. When a
+    SerialLogger capture owns the port, commands are written through the
+    capture's handle and the reply is taken from its line ring instead of
+    opening a second reader on the tty.
+    """
+
+    def __init__(self, capture: Optional[SerialLogger] = None,
+                 idle_s: float = SERIAL_POOL_IDLE_S) -> None:
+        self._capture = capture
+        self._idle_s = idle_s
+        self._ports: Dict[str, _PooledPort] = {}
+        self._resolved: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+        if capture is not None:
+            capture.add_claim_hook(self.release)
+
+    def _entry(self, port: str) -> _PooledPort:
+        with self._lock:
+            entry = self._ports.get(port)
+            if entry is None:
+                entry = self._ports[port] = _PooledPort(port)
+            if self._reaper is None or not self._reaper.is_alive():
+                self._reaper = threading.Thread(
+                    target=self._reap, name="SerialPoolReaper", daemon=True,
+                )
+                self._reaper.start()
+            return entry
+
+    def _reap(self) -> None:
+        while True:
+            time.sleep(max(self._idle_s / 2, 0.5))
+            self.close_idle()
+
+    def close_idle(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._ports.values())
+        closed = 0
+        for entry in entries:
+            if now - entry.last_used < self._idle_s or not entry.lock.acquire(blocking=False):
+                continue
+            try:
+                if entry.ser is not None:
+                    entry.ser.close()
+                    entry.ser = None
+                    closed += 1
+            finally:
+                entry.lock.release()
+        return closed
+
+    def release(self, port: str) -> None:
+        """Close `port` if pooled (waits for an in-flight command to finish)."""
+        with self._lock:
+            entry = self._ports.get(port)
+        if entry is None:
+            return
+        with entry.lock:
+            if entry.ser is not None:
+                entry.ser.close()
+                entry.ser = None
+
+    def forget(self, dut_id: str) -> None:
+        self._resolved.pop(dut_id, None)
+
+    def resolve(self, dut_id: str) -> Optional[str]:
+        port = self._resolved.get(dut_id)
+        if port is None:
+            port = match_port(dut_id)
+            if port is None:
+                # the single-port fallback isn't cached: it changes as ports come and go
+                return resolve_port(dut_id)
+            self._resolved[dut_id] = port
+        return port
+
+    def _open(self, entry: _PooledPort, baud: int) -> serial.Serial:
+        import serial
+
+        if entry.ser is None or not entry.ser.is_open or entry.baud != baud:
+            if entry.ser is not None:
+                entry.ser.close()
+            entry.ser = serial.Serial(entry.port, baud, timeout=SERIAL_TXRX_TIMEOUT_S)
+            entry.baud = baud
+        return entry.ser
+
+    def txrx(self, port: str, data: str, terminator: str = "\n",
+             timeout: float = SERIAL_TXRX_TIMEOUT_S, baud: int = BAUD) -> dict:
+        import serial
+
+        payload = (data + (terminator or "")).encode()
+        entry = self._entry(port)
+        with entry.lock:
+            t0 = time.monotonic()
+            capture = self._capture.capture_for_port(port) if self._capture else None
+            if capture is not None:
+                cap_ser, ring = capture
+                after = ring.head
+                cap_ser.write(payload)
+                entries = ring.wait_after(after, timeout, limit=1)
+                line = entries[0][2] if entries else ""
+                via, used_baud = "capture", cap_ser.baudrate
+            else:
+                try:
+                    ser = self._open(entry, baud)
+                    ser.reset_input_buffer()
+                    ser.write(payload)
+                    line = _read_line(ser, t0 + timeout)
+                except serial.SerialException:
+                    # stale handle (DUT replugged): next call reopens
+                    if entry.ser is not None:
+                        entry.ser.close()
+                    entry.ser = None
+                    raise
+                via, used_baud = "pool", baud
+            entry.last_used = time.monotonic()
+            entry.commands += 1
+        return {
+            "port": port, "baud": used_baud, "sent": data, "received": line,
+            "via": via, "elapsed_ms": round((entry.last_used - t0) * 1000, 2),
+        }
+
+    def run_script(self, port: str, steps: List[Dict[str, Any]], baud: int = BAUD) -> dict:
+        """
+        Run send/expect `steps` back to back on one held port (see _run_step
+        for the step fields). The port lock is held for the whole script, so
+        no other caller's command can interleave with it.
+        """
+        import serial
+
+        if len(steps) > SERIAL_SCRIPT_MAX_STEPS:
+            raise ValueError(f"script has {len(steps)} steps (max {SERIAL_SCRIPT_MAX_STEPS})")
+        compiled = [_compile_step(step) for step in steps]
+        entry = self._entry(port)
+        results: List[dict] = []
+        captured: Dict[str, str] = {}
+        with entry.lock:
+            t0 = time.monotonic()
+            capture = self._capture.capture_for_port(port) if self._capture else None
+            if capture is not None:
+                lines: Any = _RingLines(*capture)
+                via, used_baud = "capture", capture[0].baudrate
+            else:
+                try:
+                    lines = _SerialLines(self._open(entry, baud))
+                    lines.ser.reset_input_buffer()
+                except serial.SerialException:
+                    if entry.ser is not None:
+                        entry.ser.close()
+                    entry.ser = None
+                    raise
+                via, used_baud = "pool", baud
+            try:
+                for i, step in enumerate(compiled):
+                    res = _run_step(lines, step, captured)
+                    res["index"] = i
+                    results.append(res)
+                    if not res["ok"] and step["on_fail"] == "abort":
+                        break
+            except serial.SerialException:
+                if entry.ser is not None:
+                    entry.ser.close()
+                entry.ser = None
+                raise
+            entry.last_used = time.monotonic()
+            entry.commands += len(results)
+        return {
+            "port": port, "baud": used_baud, "via": via,
+            "ok": len(results) == len(steps) and all(r["ok"] for r in results),
+            "steps_run": len(results), "steps": results, "vars": captured,
+            "elapsed_ms": round((entry.last_used - t0) * 1000, 2),
+        }
 
-def serial_txrx(dut_id: str, data: str, terminator: str = "\n"):
-    port = _guess_serial_port()
+    def status(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._ports.values())
+        return {
+            "ports": [
+                {"port": e.port, "open": e.ser is not None, "baud": e.baud,
+                 "commands": e.commands, "idle_s": round(now - e.last_used, 1)}
+                for e in entries
+            ],
+        }
+
+
+def _read_line(ser: serial.Serial, deadline: float) -> str:
+    # terminator-driven: returns as soon as a non-empty line arrives
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return ""
+        ser.timeout = remaining
+        line = ser.read_until(b"\n").decode(errors="ignore").strip()
+        if line:
+            return line
+
+
+class _SerialLines:
+    """Line reader over a pooled port that keeps partial lines across timeouts."""
+
+    def __init__(self, ser: serial.Serial) -> None:
+        self.ser = ser
+        self._buf = b""
+
+    def write(self, payload: bytes) -> None:
+        self.ser.write(payload)
+
+    def readline(self, deadline: float) -> Optional[str]:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.ser.timeout = remaining
+            self._buf += self.ser.read_until(b"\n")
+            if not self._buf.endswith(b"\n"):
+                continue
+            line = self._buf.decode(errors="ignore").strip()
+            self._buf = b""
+            if line:
+                return line
+
+
+class _RingLines:
+    """Line reader over a running capture: writes through its handle, reads its ring."""
+
+    def __init__(self, ser: serial.Serial, ring) -> None:
+        self.ser = ser
+        self._ring = ring
+        self._cursor = ring.head
+
+    def write(self, payload: bytes) -> None:
+        self.ser.write(payload)
+
+    def readline(self, deadline: float) -> Optional[str]:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        entries = self._ring.wait_after(self._cursor, remaining, limit=1)
+        if not entries:
+            return None
+        self._cursor = entries[0][0]
+        return entries[0][2]
+
+
+_VAR = re.compile(r"\$\{(\w+)\}")
+_CAPTURE_MODES = ("match", "all", "none")
+
+
+def _compile_step(step: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Step fields:
+      send        text to write (None: don't write); ${name} is replaced by
+                  a value captured by an earlier step
+      terminator  appended to `send` (default "\n")
+      expect      regex searched in each received line; None takes the
+                  first line, like serial_txrx
+      read        False: send only, don't wait for a reply
+      timeout     seconds to wait for the expected line
+      capture     "match": the matching line and its named groups (default),
+                  "all": also every line received before it, "none"
+      on_fail     "abort" (default) or "continue"
+    """
+    capture = step.get("capture") or "match"
+    if capture not in _CAPTURE_MODES:
+        raise ValueError(f"capture must be one of {', '.join(_CAPTURE_MODES)}")
+    on_fail = step.get("on_fail") or "abort"
+    if on_fail not in ("abort", "continue"):
+        raise ValueError("on_fail must be 'abort' or 'continue'")
+    expect = step.get("expect")
+    try:
+        regex = re.compile(expect) if expect else None
+    except re.error as e:
+        raise ValueError(f"bad expect pattern {expect!r}: {e}") from None
+    terminator = step.get("terminator")
+    return {
+        "send": step.get("send"),
+        "terminator": "\n" if terminator is None else terminator,
+        "expect": regex,
+        "read": step.get("read", True) is not False,
+        "timeout": float(step.get("timeout") or SERIAL_TXRX_TIMEOUT_S),
+        "capture": capture,
+        "on_fail": on_fail,
+    }
+
+
+def _run_step(lines: Any, step: Dict[str, Any], captured: Dict[str, str]) -> dict:
+    t0 = time.monotonic()
+    res: Dict[str, Any] = {"ok": True}
+    if step["send"] is not None:
+        sent = _VAR.sub(lambda m: captured.get(m.group(1), m.group(0)), step["send"])
+        lines.write((sent + step["terminator"]).encode())
+        res["sent"] = sent
+    if step["read"]:
+        deadline = t0 + step["timeout"]
+        seen: List[str] = []
+        match = None
+        while True:
+            line = lines.readline(deadline)
+            if line is None:
+                break
+            if step["expect"] is None:
+                match = line
+                break
+            m = step["expect"].search(line)
+            if m:
+                match = line
+                groups = {k: v for k, v in m.groupdict().items() if v is not None}
+                captured.update(groups)
+                if step["capture"] != "none":
+                    res["groups"] = groups
+                break
+            seen.append(line)
+        res["ok"] = match is not None
+        if step["capture"] != "none":
+            res["received"] = match
+        if step["capture"] == "all":
+            res["lines"] = seen + ([match] if match is not None else [])
+        if match is None:
+            res["error"] = f"timed out after {step['timeout']:g}s"
+    res["elapsed_ms"] = round((time.monotonic() - t0) * 1000, 2)
+    return res
+
+
+serial_pool = SerialPool(capture=serial_logger)
+
+def serial_txrx(dut_id: str, data: str, terminator: str = "\n",
+                timeout: float = SERIAL_TXRX_TIMEOUT_S):
+    port = serial_pool.resolve(dut_id)
     if not port:
-        return {"error": "No serial port found (looked for tty.usbmodem/usbserial/ACM/USB)"}
+        raise UnknownDut(f"No serial port for dut_id={dut_id}")
     try:
-        with serial.Serial(port, BAUD, timeout=1) as ser:
-            ser.write((data + terminator).encode())
-            time.sleep(0.2)
-            line = ser.readline().decode(errors="ignore").strip()
-            return {"port": port, "baud": BAUD, "sent": data, "received": line}
+        return serial_pool.txrx(port, data, terminator, timeout=timeout)
+    except PortInRawCapture:
+        raise
     except Exception as e:
+        serial_pool.forget(dut_id)
         return {"error": str(e)}
+
+def serial_script(dut_id: str, steps: List[Dict[str, Any]], baud: int = BAUD) -> dict:
+    port = serial_pool.resolve(dut_id)
+    if not port:
+        raise UnknownDut(f"No serial port for dut_id={dut_id}")
+    try:
+        return serial_pool.run_script(port, steps, baud=baud)
+    except (ValueError, PortInRawCapture):
+        raise
+    except Exception as e:
+        serial_pool.forget(dut_id)
+        return {"error": str(e)}
+
 class SerialPort:
     def __init__(self, port: str = "/dev/ttyUSB0", baudrate: int = 115200):
         # placeholder, real code would open pyserial here
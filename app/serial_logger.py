@@ -1,119 +1,527 @@
+from __future__ import annotations
+
 import os
+import selectors
 import threading
 import time
+from collections import deque
 from datetime import datetime
-from typing import Optional, TextIO
+from typing import TYPE_CHECKING, Callable, Deque, Dict, List, Optional, Tuple, Union
 
-import serial
-from dotenv import load_dotenv
+from . import metrics
+from .core.config import settings
+from .line_stream import LineRing
+from .log_writer import LogSink, LogWriter
+from .raw_capture import PortInRawCapture, RawSink
+from .triggers import FAIL_JOB, STOP_CAPTURE, Trigger, TriggerEngine
 
-load_dotenv()
+if TYPE_CHECKING:
+    import serial
 
-SERIAL_PORT = os.getenv("SERIAL_PORT", "/dev/cu.usbmodemL1100WEU4")
-SERIAL_BAUDRATE = int(os.getenv("SERIAL_BAUDRATE", "115200"))
-LOG_DIR = os.getenv("LOG_DIR", "logs")
+SERIAL_PORT = settings.SERIAL_PORT
+SERIAL_BAUDRATE = settings.SERIAL_BAUDRATE
+LOG_DIR = settings.LOG_DIR
+TRIGGER_RETAIN_S = settings.TRIGGER_RETAIN_S
 
-os.makedirs(LOG_DIR, exist_ok=True)
+# bytes pulled from a tty per readiness event; a 921600 baud port
+# delivers ~92 KB/s, so one read drains several ms of traffic
+READ_CHUNK = 64 * 1024
+# a "line" that never sees a newline is cut here so a chatty binary
+# DUT can't grow the reassembly buffer without bound
+MAX_LINE = 64 * 1024
 
+# capture modes: decoded lines (`_text.log` + `_vars.csv`), or the bytes
+# exactly as read, framed into `_raw.bin` (see raw_capture.py)
+LINES, RAW = "lines", "raw"
 
-class SerialLogger:
-    def __init__(self) -> None:
-        self._thread: Optional[threading.Thread] = None
-        self._stop_event = threading.Event()
-        self._ser: Optional[serial.Serial] = None
-        self._text_file: Optional[TextIO] = None
-        self._vars_file: Optional[TextIO] = None
-        self._current_job_id: Optional[str] = None
 
-    def start(self, job_id: str, port: Optional[str] = None, baudrate: Optional[int] = None) -> str:
-        if self._thread and self._thread.is_alive():
-            return f"logger already running for job_id={self._current_job_id}"
+def session_id_for(job_id: str, port: str) -> str:
+    return f"{job_id}@{port}"
 
-        port = port or SERIAL_PORT
-        baudrate = baudrate or SERIAL_BAUDRATE
 
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        base_name = f"{job_id}_{timestamp}"
+class _Session:
+    """One capture: a (job_id, port) pair with its open tty and log files."""
+
+    def __init__(self, job_id: str, port: str, baudrate: int,
+                 ser: serial.Serial, sink: Union[LogSink, RawSink], mode: str = LINES,
+                 ring: Optional[LineRing] = None) -> None:
+        self.job_id = job_id
+        self.port = port
+        self.baudrate = baudrate
+        self.mode = mode
+        self.ser = ser
+        self.fd = ser.fileno()
+        self.sink = sink
+        self.ring = ring if ring is not None else LineRing()
+        self.buf = bytearray()
+        self.started_at = datetime.utcnow().isoformat()
+        self.bytes_read = 0
+        self.lines = 0
+        self.decode_errors = 0
+        self.error: Optional[str] = None
+        self.triggers = TriggerEngine()
+        # set by a FAIL_JOB trigger: why the job under test failed
+        self.job_failed: Optional[str] = None
+
+    @property
+    def session_id(self) -> str:
+        return session_id_for(self.job_id, self.port)
+
+    @property
+    def running(self) -> bool:
+        return self.error is None
+
+    def status(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "job_id": self.job_id,
+            "port": self.port,
+            "baudrate": self.baudrate,
+            "mode": self.mode,
+            "running": self.running,
+            "started_at": self.started_at,
+            "bytes": self.bytes_read,
+            "lines": self.lines,
+            "decode_errors": self.decode_errors,
+            "error": self.error,
+            "job_failed": self.job_failed,
+            **self.sink.status(),
+            "triggers": self.triggers.status(),
+            "stream": self.ring.status(),
+        }
+
 
-        text_path = os.path.join(LOG_DIR, f"{base_name}_text.log")
-        vars_path = os.path.join(LOG_DIR, f"{base_name}_vars.csv")
+class SerialLogger:
+    """
+    Captures any number of serial ports concurrently.
+
+    Every session's tty fd is registered with one selector (epoll on Linux)
+    and served by a single reactor thread, so adding a port costs a fd and a
+    buffer, not a thread. Sessions are keyed by (job_id, port).
 
-        self._ser = serial.Serial(port, baudrate, timeout=1)
-        self._text_file = open(text_path, "a", encoding="utf-8")
-        self._vars_file = open(vars_path, "a", encoding="utf-8")
+    Only the reactor thread touches the selector; start()/stop() hand it
+    callables through a command queue and wake it via a self-pipe. Decoded
+    lines are handed to a LogWriter so disk I/O never runs on the reactor.
 
-        # CSV header for variables file
-        self._vars_file.write("ts_utc,line\n")
-        self._vars_file.flush()
+    `ring_factory(session_id)` makes each session's line ring; the capture
+    daemon passes one that puts it in shared memory.
+    """
 
-        self._stop_event.clear()
-        self._current_job_id = job_id
+    def __init__(self, log_dir: Optional[str] = None,
+                 writer: Optional[LogWriter] = None,
+                 ring_factory: Optional[Callable[[str], LineRing]] = None) -> None:
+        self._log_dir = log_dir or LOG_DIR
+        self._writer = writer or LogWriter()
+        self._ring_factory = ring_factory
+        self._sessions: Dict[Tuple[str, str], _Session] = {}
+        self._lock = threading.Lock()
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._thread: Optional[threading.Thread] = None
+        self._commands: Deque[Tuple[Callable[[], None], threading.Event]] = deque()
+        self._wake_r = -1
+        self._wake_w = -1
+        self._claim_hooks: List[Callable[[str], None]] = []
+        # per-port totals of finished sessions, so counters survive stop()
+        self._port_totals: Dict[str, List[int]] = {}
+        # trigger engines of stopped sessions, for waiters that arrive after
+        # a stop_capture hit: session_id -> (stopped at, engine)
+        self._retired: Dict[str, Tuple[float, TriggerEngine]] = {}
+        # small stable ids for the port field of raw capture records
+        self._port_ids: Dict[str, int] = {}
+        self.reactor_errors = 0
+        self.last_reactor_error: Optional[str] = None
 
+    # -------------------------------------------------
+    # reactor plumbing
+    # -------------------------------------------------
+    def _ensure_reactor(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
         self._thread = threading.Thread(
             target=self._run,
-            name="SerialLoggerThread",
+            name="SerialLoggerReactor",
             daemon=True,
         )
         self._thread.start()
 
-        return f"serial logging started (job_id={job_id}, port={port}, baud={baudrate})"
+    def _call_in_reactor(self, fn: Callable[[], None], timeout: float = 2.0) -> None:
+        done = threading.Event()
+        self._commands.append((fn, done))
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass  # pipe already full of wakeups; the reactor will see ours
+        done.wait(timeout)
 
     def _run(self) -> None:
-        assert self._ser is not None
-        assert self._text_file is not None
-        assert self._vars_file is not None
-
-        while not self._stop_event.is_set():
+        assert self._selector is not None
+        while True:
             try:
-                raw = self._ser.readline()
-                if not raw:
+                events = self._selector.select(timeout=1.0)
+            except OSError as e:
+                self._reactor_error(e)
+                time.sleep(0.1)
+                continue
+            for key, _ in events:
+                if key.data is None:
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
                     continue
+                try:
+                    self._read_ready(key.data)
+                except Exception as e:
+                    # never let one session's failure kill the reactor
+                    self._reactor_error(e)
+                    self._fail(key.data, str(e))
+
+            while self._commands:
+                fn, done = self._commands.popleft()
+                try:
+                    fn()
+                except Exception as e:
+                    self._reactor_error(e)
+                finally:
+                    done.set()
 
+    def _reactor_error(self, e: Exception) -> None:
+        self.reactor_errors += 1
+        self.last_reactor_error = f"{type(e).__name__}: {e}"
+
+    def _read_ready(self, sess: _Session) -> None:
+        try:
+            data = os.read(sess.fd, READ_CHUNK)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(sess, str(e))
+            return
+        if not data:
+            self._fail(sess, "port closed")
+            return
+
+        sess.bytes_read += len(data)
+        if sess.mode == RAW:
+            # no splitting or decoding: the chunk goes to disk as read
+            self._writer.submit(sess.sink, time.monotonic_ns(), data)
+            return
+        sess.buf += data
+        if b"\n" not in data and len(sess.buf) < MAX_LINE:
+            return
+
+        *complete, rest = sess.buf.split(b"\n")
+        if len(rest) >= MAX_LINE:
+            complete.append(rest)
+            rest = b""
+        sess.buf = bytearray(rest)
+
+        lines: List[str] = []
+        for raw in complete:
+            try:
+                line = raw.decode().strip()
+            except UnicodeDecodeError:
+                sess.decode_errors += 1
                 line = raw.decode(errors="ignore").strip()
-                if not line:
-                    continue
+            if line:
+                lines.append(line)
+        if not lines:
+            return
+
+        sess.lines += len(lines)
+        # one timestamp per read: every line in the chunk arrived together
+        ts = datetime.utcnow().isoformat()
+        self._writer.submit(sess.sink, ts, lines)
+        first_seq = sess.ring.head + 1
+        sess.ring.publish(ts, lines)
+        sess.triggers.scan(ts, lines, first_seq)
 
-                ts = datetime.utcnow().isoformat()
+    def _fail(self, sess: _Session, reason: str) -> None:
+        # runs on the reactor thread; files stay open until stop()
+        sess.error = reason
+        try:
+            assert self._selector is not None
+            self._selector.unregister(sess.fd)
+        except (KeyError, ValueError):
+            pass
 
-                # Text log (everything)
-                self._text_file.write(f"[{ts}] {line}\n")
-                self._text_file.flush()
+    # -------------------------------------------------
+    # public API
+    # -------------------------------------------------
+    def start(self, job_id: str, port: Optional[str] = None, baudrate: Optional[int] = None,
+              mode: str = LINES) -> str:
+        port = port or SERIAL_PORT
+        baudrate = baudrate or SERIAL_BAUDRATE
+        if mode not in (LINES, RAW):
+            raise ValueError(f"unknown capture mode {mode!r} (expected {LINES!r} or {RAW!r})")
+        key = (job_id, port)
+
+        # outside our lock: hooks may wait on callers that need it
+        for hook in self._claim_hooks:
+            hook(port)
+
+        with self._lock:
+            existing = self._sessions.get(key)
+            if existing and existing.running:
+                return f"logger already running for session_id={existing.session_id}"
+            for other in self._sessions.values():
+                if other.port == port and other.running:
+                    raise RuntimeError(
+                        f"port {port} already captured by session_id={other.session_id}"
+                    )
+            if existing:
+                self._close(existing)
+                del self._sessions[key]
 
-                # Variables log (for now, whole line;
-                # later we can parse key=value pairs)
-                self._vars_file.write(f"{ts},{line}\n")
-                self._vars_file.flush()
+            timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+            base_name = f"{job_id}_{timestamp}"
+
+            import serial  # loaded on the first capture, not at app start
+
+            os.makedirs(self._log_dir, exist_ok=True)
+            ser = serial.Serial(port, baudrate, timeout=0)
+            os.set_blocking(ser.fileno(), False)
+            try:
+                if mode == RAW:
+                    port_id = self._port_ids.setdefault(port, len(self._port_ids) + 1)
+                    sink = self._writer.open_raw(
+                        os.path.join(self._log_dir, f"{base_name}_raw.bin"),
+                        port, port_id, baudrate,
+                    )
+                else:
+                    sink = self._writer.open(
+                        os.path.join(self._log_dir, f"{base_name}_text.log"),
+                        os.path.join(self._log_dir, f"{base_name}_vars.csv"),
+                    )
             except Exception:
-                time.sleep(0.1)
+                ser.close()
+                raise
+            try:
+                ring = self._ring_factory(session_id_for(job_id, port)) if self._ring_factory else None
+            except Exception:
+                self._writer.close(sink)
+                ser.close()
+                raise
 
-    def stop(self) -> str:
-        if not self._thread or not self._thread.is_alive():
-            return "serial logger not running"
+            sess = _Session(job_id, port, baudrate, ser, sink, mode, ring)
+            sess.triggers = TriggerEngine(
+                on_action=lambda trigger, hit, sess=sess: self._on_trigger(sess, trigger, hit)
+            )
+            self._sessions[key] = sess
 
-        self._stop_event.set()
-        self._thread.join(timeout=2.0)
+            self._ensure_reactor()
+            self._call_in_reactor(
+                lambda: self._selector.register(sess.fd, selectors.EVENT_READ, sess)
+            )
 
-        if self._ser and self._ser.is_open:
-            self._ser.close()
-        if self._text_file:
-            self._text_file.close()
-        if self._vars_file:
-            self._vars_file.close()
+        return f"serial logging started (job_id={job_id}, port={port}, baud={baudrate}, mode={mode})"
 
-        job_id = self._current_job_id
-        self._ser = None
-        self._text_file = None
-        self._vars_file = None
-        self._thread = None
-        self._current_job_id = None
+    def _close(self, sess: _Session) -> None:
+        def detach() -> None:
+            try:
+                self._selector.unregister(sess.fd)
+            except (KeyError, ValueError):
+                pass
 
-        return f"serial logging stopped (job_id={job_id})"
+        if self._thread and self._thread.is_alive():
+            self._call_in_reactor(detach)
+        if sess.ser.is_open:
+            sess.ser.close()
+        sess.ring.close()
+        sess.triggers.close()
+        # explicit group-commit flush: everything read so far hits the disk
+        self._writer.close(sess.sink)
+        totals = self._port_totals.setdefault(sess.port, [0, 0, 0])
+        totals[0] += sess.bytes_read
+        totals[1] += sess.lines
+        totals[2] += sess.decode_errors
 
-    def status(self) -> dict:
+    def _select(self, session_id: Optional[str], job_id: Optional[str],
+                port: Optional[str]) -> List[Tuple[str, str]]:
+        keys = []
+        for key, sess in self._sessions.items():
+            if session_id and sess.session_id != session_id:
+                continue
+            if job_id and sess.job_id != job_id:
+                continue
+            if port and sess.port != port:
+                continue
+            keys.append(key)
+        return keys
+
+    def stop(self, session_id: Optional[str] = None, job_id: Optional[str] = None,
+             port: Optional[str] = None) -> str:
+        """Stop matching sessions; with no filter, stop all of them."""
+        with self._lock:
+            keys = self._select(session_id, job_id, port)
+            if not keys:
+                return "serial logger not running"
+            stopped = []
+            for key in keys:
+                sess = self._sessions.pop(key)
+                self._close(sess)
+                stopped.append(sess.session_id)
+                self._retired[sess.session_id] = (time.monotonic(), sess.triggers)
+            self._prune_retired()
+
+        return f"serial logging stopped (session_id={', '.join(stopped)})"
+
+    def add_claim_hook(self, fn: Callable[[str], None]) -> None:
+        """`fn(port)` runs before a capture opens `port`, so other owners can let go."""
+        self._claim_hooks.append(fn)
+
+    def capture_for_port(self, port: str) -> Optional[Tuple[serial.Serial, LineRing]]:
+        """
+        The open serial handle and line ring of a running capture on `port`.
+        A raw capture publishes no lines to reply with and can't be shared.
+        """
+        with self._lock:
+            for sess in self._sessions.values():
+                if sess.port == port and sess.running:
+                    if sess.mode == RAW:
+                        raise PortInRawCapture(
+                            f"port {port} is under raw capture by session_id={sess.session_id}"
+                        )
+                    return sess.ser, sess.ring
+        return None
+
+    # -------------------------------------------------
+    # triggers
+    # -------------------------------------------------
+    def _session(self, session_id: str) -> Optional[_Session]:
+        with self._lock:
+            for sess in self._sessions.values():
+                if sess.session_id == session_id:
+                    return sess
+        return None
+
+    def _prune_retired(self) -> None:
+        # caller holds the lock
+        cutoff = time.monotonic() - TRIGGER_RETAIN_S
+        for sid in [s for s, (at, _) in self._retired.items() if at < cutoff]:
+            del self._retired[sid]
+
+    def triggers(self, session_id: str) -> Optional[TriggerEngine]:
+        """The session's engine; a stopped session's (closed) one for TRIGGER_RETAIN_S."""
+        sess = self._session(session_id)
+        if sess is not None:
+            return sess.triggers
+        with self._lock:
+            self._prune_retired()
+            retired = self._retired.get(session_id)
+        return retired[1] if retired else None
+
+    def add_trigger(self, session_id: str, pattern: str, literal: bool = False,
+                    action: Optional[str] = None, name: Optional[str] = None,
+                    since: Optional[int] = None) -> Trigger:
+        """
+        Register a trigger on a running session. With `since` (a stream
+        sequence number) lines already captured after it are matched too,
+        so a trigger added late still sees the line it's waiting for.
+        """
+        sess = self._session(session_id)
+        if sess is None or not sess.running:
+            raise KeyError(session_id)
+        if sess.mode == RAW:
+            raise ValueError("triggers need a line capture (mode='lines')")
+        trigger = Trigger(pattern, literal, action, name)
+
+        def insert() -> None:
+            history = sess.ring.read(since, sess.ring.capacity) if since is not None else ()
+            sess.triggers.insert(trigger, history)
+
+        # on the reactor, between two reads: no line is matched twice or missed
+        self._call_in_reactor(insert)
+        return trigger
+
+    def _on_trigger(self, sess: _Session, trigger: Trigger, hit: dict) -> None:
+        # reactor thread: must not block on stop(), which waits for the reactor
+        if trigger.action == FAIL_JOB and sess.job_failed is None:
+            sess.job_failed = f"{trigger.name}: {hit['line']}"
+        elif trigger.action == STOP_CAPTURE:
+            threading.Thread(
+                target=self.stop, kwargs={"session_id": sess.session_id},
+                name="TriggerStop", daemon=True,
+            ).start()
+
+    def ring(self, session_id: str) -> Optional[LineRing]:
+        with self._lock:
+            for sess in self._sessions.values():
+                if sess.session_id == session_id:
+                    return sess.ring
+        return None
+
+    def status(self, session_id: Optional[str] = None) -> dict:
+        with self._lock:
+            if session_id is not None:
+                for sess in self._sessions.values():
+                    if sess.session_id == session_id:
+                        return sess.status()
+                return {"session_id": session_id, "running": False}
+            sessions = [s.status() for s in self._sessions.values()]
         return {
-            "running": bool(self._thread and self._thread.is_alive()),
-            "job_id": self._current_job_id,
+            "running": any(s["running"] for s in sessions),
+            "sessions": sessions,
+            "writer": self._writer.stats(),
+            "reactor_errors": self.reactor_errors,
+            "last_reactor_error": self.last_reactor_error,
         }
 
+    def collect(self) -> List[metrics.Family]:
+        """Prometheus families, read from the counters the hot path keeps anyway."""
+        with self._lock:
+            totals = {port: list(t) for port, t in self._port_totals.items()}
+            live = list(self._sessions.values())
+        for sess in live:
+            t = totals.setdefault(sess.port, [0, 0, 0])
+            t[0] += sess.bytes_read
+            t[1] += sess.lines
+            t[2] += sess.decode_errors
+        w = self._writer.stats()
+        return [
+            metrics.counter_family("serial_read_bytes_total", "Bytes read from serial ports",
+                                   (({"port": p}, t[0]) for p, t in totals.items())),
+            metrics.counter_family("serial_read_lines_total", "Lines captured from serial ports",
+                                   (({"port": p}, t[1]) for p, t in totals.items())),
+            metrics.counter_family("serial_decode_errors_total",
+                                   "Captured lines that were not valid UTF-8",
+                                   (({"port": p}, t[2]) for p, t in totals.items())),
+            metrics.gauge_family("serial_capture_sessions", "Capture sessions by state", [
+                ({"state": "running"}, sum(1 for s in live if s.running)),
+                ({"state": "failed"}, sum(1 for s in live if not s.running)),
+            ]),
+            metrics.counter_family("serial_reactor_errors_total",
+                                   "Exceptions caught in the capture reactor",
+                                   [({}, self.reactor_errors)]),
+            metrics.gauge_family("serial_log_queue_depth", "Batches waiting for the log writer",
+                                 [({}, w["queue_depth"])]),
+            metrics.counter_family("serial_log_backpressure_total",
+                                   "Times the capture loop found the writer queue full",
+                                   [({}, w["backpressure_events"])]),
+            metrics.counter_family("serial_log_dropped_lines_total",
+                                   "Lines dropped because the writer queue stayed full",
+                                   [({}, w["dropped_lines"])]),
+            metrics.counter_family("serial_log_flushed_bytes_total", "Bytes written to log files",
+                                   [({}, w["bytes_flushed"])]),
+            metrics.counter_family("serial_log_writer_errors_total",
+                                   "Exceptions caught in the log writer",
+                                   [({}, w["errors"])]),
+            metrics.counter_family("serial_log_rotations_total", "Log segment rotations",
+                                   [({}, w["rotations"])]),
+        ]
+
+
+if settings.CAPTURE_DAEMON_SOCKET:
+    # capture runs in the capture daemon (capture_daemon.py); this process talks to it
+    from .capture_client import CaptureClient
 
-serial_logger = SerialLogger()
+    serial_logger = CaptureClient(settings.CAPTURE_DAEMON_SOCKET)
+else:
+    serial_logger = SerialLogger()
+metrics.register_collector(serial_logger.collect)
@@ -1,46 +1,228 @@
-from typing import List, Set
+import ctypes
+import os
+import secrets
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
 from serial.tools import list_ports
 from ..core.config import settings
 from ..models.dut import DutModel
 
+# /dev names list_ports.comports() considers on Linux
+_SERIAL_PREFIXES = ("ttyS", "ttyUSB", "ttyXRUSB", "ttyACM", "ttyAMA", "rfcomm", "ttyAP")
+
 def _parse_filters() -> Set[str]:
     if not settings.DEVICE_FILTERS:
         return set()
     return {f.strip().lower() for f in settings.DEVICE_FILTERS.split(",") if f.strip()}
 
-def list_duts() -> List[DutModel]:
-    # MOCK mode for development without hardware
-    if settings.MOCK_DUTS:
-        return [
-            DutModel(
-                id="mock-tty-usbmodem1234",
-                bus="usb",
-                device="/dev/tty.usbmodem1234",
-                vid="0451",
-                pid="bef3",
-                description="TI XDS110 Debug Probe (MOCK)",
-                status="idle",
-            )
-        ]
+def _mock_duts() -> List[DutModel]:
+    return [
+        DutModel(
+            id="mock-tty-usbmodem1234",
+            bus="usb",
+            device="/dev/tty.usbmodem1234",
+            vid="0451",
+            pid="bef3",
+            description="TI XDS110 Debug Probe (MOCK)",
+            status="idle",
+        )
+    ]
 
+def _to_model(p, filters: Set[str]) -> Optional[DutModel]:
+    vid = f"{p.vid:04x}" if p.vid is not None else "0000"
+    pid = f"{p.pid:04x}" if p.pid is not None else "0000"
+    if filters and f"{vid}:{pid}" not in filters:
+        return None
+    desc = p.description or p.product or "USB Serial Device"
+    devpath = p.device
+    return DutModel(
+        id=devpath.replace("/", "_"),
+        bus="usb",
+        device=devpath,
+        vid=vid,
+        pid=pid,
+        description=desc,
+        status="idle",
+        serial=getattr(p, "serial_number", None),
+    )
+
+def _scan_all() -> List[DutModel]:
     filters = _parse_filters()
     duts: List[DutModel] = []
     for p in list_ports.comports():
-        vid = f"{p.vid:04x}" if p.vid is not None else "0000"
-        pid = f"{p.pid:04x}" if p.pid is not None else "0000"
-        if filters and f"{vid}:{pid}" not in filters:
-            continue
-        desc = p.description or p.product or "USB Serial Device"
-        devpath = p.device
-        duts.append(
-            DutModel(
-                id=devpath.replace("/", "_"),
-                bus="usb",
-                device=devpath,
-                vid=vid,
-                pid=pid,
-                description=desc,
-                status="idle",
-            )
-        )
+        dut = _to_model(p, filters)
+        if dut is not None:
+            duts.append(dut)
     return duts
+
+def _probe_one(device: str) -> Optional[DutModel]:
+    """Describe a single tty from sysfs; None if it isn't a usable port."""
+    if not sys.platform.startswith("linux") or not os.path.exists(device):
+        return None
+    from serial.tools.list_ports_linux import SysFS
+    info = SysFS(device)
+    if info.subsystem in (None, "platform"):
+        return None
+    return _to_model(info, _parse_filters())
+
+
+# -------------------------------------------------
+# /dev watcher (inotify via libc, no extra dependency)
+# -------------------------------------------------
+_IN_ATTRIB = 0x004
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_EVENT = struct.Struct("iIII")
+
+class _Inotify:
+    def __init__(self, path: str) -> None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_ATTRIB
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch({path}) failed")
+
+    def read(self) -> List[Tuple[int, str]]:
+        """Block until events arrive; returns [(mask, name), ...]."""
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        pos = 0
+        while pos + _IN_EVENT.size <= len(data):
+            _, mask, _, length = _IN_EVENT.unpack_from(data, pos)
+            pos += _IN_EVENT.size
+            name = data[pos:pos + length].rstrip(b"\0").decode(errors="ignore")
+            pos += length
+            events.append((mask, name))
+        return events
+
+
+class DutInventory:
+    """
+    In-memory DUT list, built once and then kept current from /dev events.
+
+    On Linux an inotify watch on `dev_dir` reports tty nodes appearing and
+    disappearing; only the affected device is re-probed from sysfs. Where
+    inotify isn't available (macOS, restricted containers) the inventory
+    falls back to a full rescan at most every DUT_INVENTORY_POLL_S. A full
+    resync also runs every DUT_INVENTORY_RESYNC_S as a safety net.
+
+    Every change bumps `generation`; `etag` combines it with a per-process
+    token so clients can send If-None-Match and get 304 when nothing moved.
+    """
+
+    def __init__(self, dev_dir: str = "/dev",
+                 scan: Callable[[], List[DutModel]] = _scan_all,
+                 probe: Callable[[str], Optional[DutModel]] = _probe_one,
+                 watch: bool = True) -> None:
+        self._dev_dir = dev_dir
+        self._scan = scan
+        self._probe = probe
+        self._watch = watch
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._duts: Dict[str, DutModel] = {}
+        self._list: List[DutModel] = []
+        self._built = False
+        self._watching = False
+        self._last_scan = 0.0
+        self._token = secrets.token_hex(4)
+        self.generation = 0
+        self.events = 0
+
+    @property
+    def etag(self) -> str:
+        return f'"{self._token}-{self.generation}"'
+
+    def _publish(self, duts: Dict[str, DutModel]) -> None:
+        # caller holds the lock; readers get an immutable sorted snapshot
+        if duts != self._duts:
+            self._duts = duts
+            self._list = sorted(duts.values(), key=lambda d: d.device)
+            self.generation += 1
+
+    def refresh(self) -> None:
+        duts = {d.device: d for d in self._scan()}
+        with self._lock:
+            self._publish(duts)
+            self._last_scan = time.monotonic()
+
+    def _ensure(self) -> None:
+        if not self._built:
+            with self._build_lock:
+                if not self._built:
+                    self.refresh()
+                    if self._watch:
+                        self._start_watcher()
+                    self._built = True
+            return
+        interval = settings.DUT_INVENTORY_RESYNC_S if self._watching \
+            else settings.DUT_INVENTORY_POLL_S
+        if time.monotonic() - self._last_scan >= interval:
+            self.refresh()
+
+    def _start_watcher(self) -> None:
+        try:
+            watcher = _Inotify(self._dev_dir)
+        except (OSError, AttributeError):
+            return  # no inotify: _ensure() falls back to polling
+        self._watching = True
+        threading.Thread(
+            target=self._watch_loop, args=(watcher,),
+            name="DutInventoryWatcher", daemon=True,
+        ).start()
+
+    def _watch_loop(self, watcher: _Inotify) -> None:
+        while True:
+            try:
+                events = watcher.read()
+            except OSError:
+                self._watching = False
+                return
+            names = {n for _, n in events if n.startswith(_SERIAL_PREFIXES)}
+            for name in names:
+                self.events += 1
+                self.apply(os.path.join(self._dev_dir, name))
+
+    def apply(self, device: str) -> None:
+        """Re-probe one device node after it appeared, changed or vanished."""
+        dut = self._probe(device)
+        with self._lock:
+            duts = dict(self._duts)
+            if dut is None:
+                duts.pop(device, None)
+            else:
+                duts[device] = dut
+            self._publish(duts)
+
+    def snapshot(self) -> Tuple[str, List[DutModel]]:
+        # MOCK mode for development without hardware
+        if settings.MOCK_DUTS:
+            return '"mock"', _mock_duts()
+        self._ensure()
+        with self._lock:
+            return self.etag, self._list
+
+    def status(self) -> dict:
+        return {
+            "generation": self.generation,
+            "etag": self.etag,
+            "count": len(self._list),
+            "watching": self._watching,
+            "events": self.events,
+        }
+
+
+inventory = DutInventory()
+
+def list_duts() -> List[DutModel]:
+    return inventory.snapshot()[1]
@@ -0,0 +1,236 @@
+"""
+shm_ring.py — A LineRing in POSIX shared memory, readable from other processes.
+
+The capture daemon publishes each session's lines here; API workers map
+the same segment and read lines straight out of it, with no socket hop
+and no copy besides decoding the line they return. One writer, any
+number of readers, no locks across processes:
+
+    header  magic, slots, data_bytes, head, write_pos, closed
+    index   `slots` entries of (seq, pos, ts_len, line_len)
+    data    `data_bytes` of ts+line records, written round robin
+
+`pos` is an absolute byte position (it only grows); a record lives at
+`pos % data_bytes` and never wraps, the writer skips to the start instead.
+Before writing a record the writer advances `write_pos` in the header
+and zeroes the record's index entry, and fills the entry last. A reader
+copies a record and then checks that its index entry still carries the
+same seq and that `write_pos` hasn't moved more than `data_bytes` past
+it; if either fails the record was overwritten while being read and
+counts as lost, exactly like a LineRing slot that was reused.
+
+Cross-process readers can't be woken by publish(), so waits poll the
+header (every STREAM_POLL_S at most).
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import secrets
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import List, Optional
+
+from .core.config import settings
+from .line_stream import STREAM_BATCH, STREAM_RING_SIZE, Entry
+
+# bytes of line data kept per session, on top of the index
+CAPTURE_SHM_BYTES = settings.CAPTURE_SHM_BYTES
+STREAM_POLL_S = settings.STREAM_POLL_S
+
+_MAGIC = b"LNTRING1"
+_HDR = struct.Struct("<8sQQQQQ")  # magic, slots, data_bytes, head, write_pos, closed
+_SLOT = struct.Struct("<QQII")  # seq, pos, ts_len, line_len
+_HEAD_OFF = 24
+_WRITE_POS_OFF = 32
+_CLOSED_OFF = 40
+_U64 = struct.Struct("<Q")
+
+_sub_ids = itertools.count(1)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13: no `track`; keep the tracker from unlinking it
+        shm = shared_memory.SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class ShmSubscriber:
+    """Subscriber for sse_events() that polls the ring instead of being woken."""
+
+    def __init__(self, ring: "ShmLineRing", cursor: int) -> None:
+        self.id = next(_sub_ids)
+        self.cursor = cursor
+        self.max_lag_seen = 0
+        self._ring = ring
+
+    @property
+    def lag(self) -> int:
+        return self._ring.head - self.cursor
+
+    async def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while self._ring.head <= self.cursor and not self._ring.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, STREAM_POLL_S)
+        return True
+
+    def status(self) -> dict:
+        return {"id": self.id, "cursor": self.cursor, "lag": self.lag,
+                "max_lag": self.max_lag_seen}
+
+
+class ShmLineRing:
+    """
+    LineRing's interface over a shared-memory segment. The process that
+    creates it (`create=True`) is the only one that may publish/close;
+    others attach by `name`.
+    """
+
+    def __init__(self, name: Optional[str] = None, create: bool = False,
+                 capacity: int = STREAM_RING_SIZE, data_bytes: int = CAPTURE_SHM_BYTES) -> None:
+        if create:
+            name = name or f"lnt_{secrets.token_hex(6)}"
+            size = _HDR.size + capacity * _SLOT.size + data_bytes
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            _HDR.pack_into(self._shm.buf, 0, _MAGIC, capacity, data_bytes, 0, 0, 0)
+        else:
+            if name is None:
+                raise ValueError("name is required to attach to a ring")
+            self._shm = _attach(name)
+            magic, capacity, data_bytes, *_ = _HDR.unpack_from(self._shm.buf, 0)
+            if magic != _MAGIC:
+                self._shm.close()
+                raise ValueError(f"{name} is not a line ring")
+        self.name = name
+        self.owner = create
+        self.capacity = capacity
+        self.data_bytes = data_bytes
+        self._data_off = _HDR.size + capacity * _SLOT.size
+        self._buf = self._shm.buf
+        self._pos = 0  # writer's copy of write_pos
+        self._head = 0  # writer's copy of head
+        self._subs: dict = {}
+        self.slow_disconnects = 0
+
+    # -------------------------------------------------
+    # header
+    # -------------------------------------------------
+    @property
+    def head(self) -> int:
+        return _U64.unpack_from(self._buf, _HEAD_OFF)[0]
+
+    @property
+    def closed(self) -> bool:
+        return bool(_U64.unpack_from(self._buf, _CLOSED_OFF)[0])
+
+    @property
+    def oldest(self) -> int:
+        return max(1, self.head - self.capacity + 1)
+
+    # -------------------------------------------------
+    # writer
+    # -------------------------------------------------
+    def publish(self, ts: str, lines: List[str]) -> None:
+        buf, data = self._buf, self.data_bytes
+        tsb = ts.encode()
+        seq = self._head
+        for line in lines:
+            lb = line.encode()[: max(0, data - len(tsb))]
+            n = len(tsb) + len(lb)
+            pos = self._pos
+            if pos % data + n > data:
+                pos += data - pos % data  # don't wrap a record
+            self._pos = pos + n
+            seq += 1
+            slot = _HDR.size + (seq % self.capacity) * _SLOT.size
+            _U64.pack_into(buf, _WRITE_POS_OFF, self._pos)
+            _U64.pack_into(buf, slot, 0)
+            off = self._data_off + pos % data
+            buf[off:off + len(tsb)] = tsb
+            buf[off + len(tsb):off + n] = lb
+            _SLOT.pack_into(buf, slot, seq, pos, len(tsb), len(lb))
+        self._head = seq
+        _U64.pack_into(buf, _HEAD_OFF, seq)
+
+    def close(self) -> None:
+        """Mark the ring finished; the owner also removes the segment's name."""
+        if self.owner and not self.closed:
+            _U64.pack_into(self._buf, _CLOSED_OFF, 1)
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    # -------------------------------------------------
+    # readers
+    # -------------------------------------------------
+    def read(self, since: int, limit: int) -> List[Entry]:
+        """Entries with seq > since (at most `limit`); overwritten ones are left out."""
+        buf, data = self._buf, self.data_bytes
+        head = self.head
+        first = max(since + 1, max(1, head - self.capacity + 1))
+        out: List[Entry] = []
+        for seq in range(first, min(head, first + limit - 1) + 1):
+            slot = _HDR.size + (seq % self.capacity) * _SLOT.size
+            s, pos, ts_len, line_len = _SLOT.unpack_from(buf, slot)
+            if s != seq:
+                continue  # overwritten (only ever the oldest ones)
+            off = self._data_off + pos % data
+            raw = bytes(buf[off:off + ts_len + line_len])
+            if (_U64.unpack_from(buf, slot)[0] != seq
+                    or _U64.unpack_from(buf, _WRITE_POS_OFF)[0] > pos + data):
+                continue
+            out.append((seq, raw[:ts_len].decode(errors="replace"),
+                        raw[ts_len:].decode(errors="replace")))
+        return out
+
+    def wait_after(self, since: int, timeout: float, limit: int = STREAM_BATCH) -> List[Entry]:
+        """Blocking read for plain threads: polls for seq > since up to `timeout`."""
+        deadline = time.monotonic() + timeout
+        delay = 0.0005
+        while self.head <= since and not self.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, STREAM_POLL_S)
+        return self.read(since, limit)
+
+    def subscribe(self, since: Optional[int]) -> ShmSubscriber:
+        sub = ShmSubscriber(self, self.head if since is None else max(0, since))
+        self._subs[sub.id] = sub
+        return sub
+
+    def unsubscribe(self, sub: ShmSubscriber) -> None:
+        self._subs.pop(sub.id, None)
+
+    def detach(self) -> None:
+        """Unmap the segment in this process (readers, once done with it)."""
+        self._buf = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass
+
+    def status(self) -> dict:
+        head = self.head
+        return {
+            "head": head,
+            "oldest": self.oldest if head else 0,
+            "capacity": self.capacity,
+            "subscribers": [s.status() for s in list(self._subs.values())],
+            "slow_disconnects": self.slow_disconnects,
+            "shm": self.name,
+            "data_bytes": self.data_bytes,
+        }
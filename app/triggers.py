@@ -0,0 +1,256 @@
+"""
+triggers.py — Pattern triggers on live serial captures.
+
+Each capture session has a TriggerEngine. Clients register any number of
+patterns (literals or regexes); the engine compiles them into one combined
+alternation, so every captured line is searched once however many
+triggers exist. Only lines the combined matcher hits are re-checked
+against the individual patterns to find out which triggers fired.
+Patterns with backreferences are left out of the alternation (it
+renumbers their groups) and searched on every line by themselves.
+
+Hits are numbered per engine. wait()/wait_async() block until a hit
+newer than `after` arrives for any of the given triggers, which gives
+test scripts a long-poll "wait for BOOT OK" instead of polling log files.
+A trigger may also carry an action (stop the capture, mark the job
+failed) that the owning SerialLogger carries out.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from .core.config import settings
+
+# hits kept per session for waiters that arrive late
+TRIGGER_HIT_HISTORY = settings.TRIGGER_HIT_HISTORY
+# upper bound on a single wait_for call
+TRIGGER_WAIT_MAX_S = settings.TRIGGER_WAIT_MAX_S
+
+STOP_CAPTURE, FAIL_JOB = "stop_capture", "fail_job"
+ACTIONS = (STOP_CAPTURE, FAIL_JOB)
+
+_trigger_ids = itertools.count(1)
+
+
+class Trigger:
+    def __init__(self, pattern: str, literal: bool = False, action: Optional[str] = None,
+                 name: Optional[str] = None) -> None:
+        if action is not None and action not in ACTIONS:
+            raise ValueError(f"unknown action {action!r} (expected one of {', '.join(ACTIONS)})")
+        self.source = re.escape(pattern) if literal else pattern
+        try:
+            self.regex = re.compile(self.source)
+        except re.error as e:
+            raise ValueError(f"bad pattern {pattern!r}: {e}") from None
+        self.id = f"trg-{next(_trigger_ids)}"
+        self.name = name or pattern
+        self.pattern = pattern
+        self.literal = literal
+        self.action = action
+        self.hits = 0
+        self.last_hit: Optional[dict] = None
+        self.created = time.time()
+
+    def status(self) -> dict:
+        return {
+            "trigger_id": self.id,
+            "name": self.name,
+            "pattern": self.pattern,
+            "literal": self.literal,
+            "action": self.action,
+            "hits": self.hits,
+            "last_hit": self.last_hit,
+        }
+
+
+# numbered/named backreferences and group conditionals: they depend on group
+# numbering, which the combined alternation shifts (an odd run of backslashes
+# before the digit, so an escaped backslash followed by a digit doesn't count)
+_GROUP_REF = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]|\(\?P=|\(\?\(")
+
+
+def _poolable(trigger: Trigger) -> bool:
+    """Whether `trigger` can go into the combined prefilter."""
+    return _GROUP_REF.search(trigger.source) is None
+
+
+def _combine(triggers: Iterable[Trigger]) -> Optional["re.Pattern[str]"]:
+    sources = [t.source for t in triggers]
+    if not sources:
+        return None
+    try:
+        return re.compile("|".join(f"(?:{s})" for s in sources))
+    except re.error:
+        # e.g. a pattern with global inline flags; scan one by one instead
+        return None
+
+
+def _wake(waiters: Iterable[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]) -> None:
+    for loop, event in waiters:
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            pass  # loop already closed
+
+
+class TriggerEngine:
+    def __init__(self, on_action: Optional[Callable[[Trigger, dict], None]] = None) -> None:
+        self._on_action = on_action
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._triggers: Dict[str, Trigger] = {}
+        # (combined prefilter or None, triggers, which of them it covers)
+        # swapped as one tuple so the reactor never sees a half-updated set
+        self._matcher: Tuple[Optional["re.Pattern[str]"], Tuple[Trigger, ...],
+                             Tuple[bool, ...]] = (None, (), ())
+        self._hits: Deque[dict] = deque(maxlen=TRIGGER_HIT_HISTORY)
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self.seq = 0
+        self.lines_scanned = 0
+        self.closed = False
+
+    # -------------------------------------------------
+    # registration
+    # -------------------------------------------------
+    def _rebuild(self) -> None:
+        triggers = tuple(self._triggers.values())
+        pooled = tuple(_poolable(t) for t in triggers)
+        combined = _combine(t for t, p in zip(triggers, pooled) if p)
+        if combined is None:
+            pooled = (False,) * len(triggers)  # nothing to prefilter with
+        self._matcher = (combined, triggers, pooled)
+
+    def add(self, pattern: str, literal: bool = False, action: Optional[str] = None,
+            name: Optional[str] = None) -> Trigger:
+        trigger = Trigger(pattern, literal, action, name)
+        self.insert(trigger)
+        return trigger
+
+    def insert(self, trigger: Trigger,
+               history: Iterable[Tuple[int, str, str]] = ()) -> None:
+        """
+        Start matching `trigger`, first against `history` ((line_seq, ts, line)
+        entries already captured). Call on the thread that runs scan() so no
+        line is matched twice or missed in between.
+        """
+        with self._lock:
+            self._triggers[trigger.id] = trigger
+            self._rebuild()
+        for line_seq, ts, line in history:
+            if trigger.regex.search(line):
+                self._hit(trigger, ts, line, line_seq)
+
+    def remove(self, trigger_id: str) -> bool:
+        with self._lock:
+            found = self._triggers.pop(trigger_id, None) is not None
+            if found:
+                self._rebuild()
+        return found
+
+    def get(self, trigger_id: str) -> Optional[Trigger]:
+        return self._triggers.get(trigger_id)
+
+    def list(self) -> List[dict]:
+        return [t.status() for t in self._matcher[1]]
+
+    # -------------------------------------------------
+    # matching (capture reactor thread)
+    # -------------------------------------------------
+    def scan(self, ts: str, lines: List[str], line_seq: Optional[int] = None) -> int:
+        """Check a batch of lines; returns the number of hits."""
+        combined, triggers, pooled = self._matcher
+        if not triggers:
+            return 0
+        self.lines_scanned += len(lines)
+        solo = not all(pooled)
+        found = 0
+        for i, line in enumerate(lines):
+            prefiltered = combined is None or combined.search(line) is not None
+            if not (prefiltered or solo):
+                continue
+            for trigger, in_prefilter in zip(triggers, pooled):
+                if in_prefilter and not prefiltered:
+                    continue
+                if trigger.regex.search(line):
+                    self._hit(trigger, ts, line, None if line_seq is None else line_seq + i)
+                    found += 1
+        return found
+
+    def _hit(self, trigger: Trigger, ts: str, line: str, line_seq: Optional[int]) -> None:
+        with self._cond:
+            self.seq += 1
+            hit = {"seq": self.seq, "trigger_id": trigger.id, "name": trigger.name,
+                   "ts": ts, "line": line, "line_seq": line_seq}
+            trigger.hits += 1
+            trigger.last_hit = hit
+            self._hits.append(hit)
+            self._cond.notify_all()
+            waiters = list(self._waiters)
+        _wake(waiters)
+        if trigger.action and self._on_action is not None:
+            self._on_action(trigger, hit)
+
+    # -------------------------------------------------
+    # waiting
+    # -------------------------------------------------
+    def _find(self, ids: Optional[Iterable[str]], after: int) -> Optional[dict]:
+        wanted = set(ids) if ids else None
+        for hit in self._hits:
+            if hit["seq"] > after and (wanted is None or hit["trigger_id"] in wanted):
+                return hit
+        return None
+
+    def wait(self, ids: Optional[Iterable[str]] = None, after: int = 0,
+             timeout: float = 30.0) -> Optional[dict]:
+        """First hit with seq > `after` for any of `ids` (all triggers if None)."""
+        ids = list(ids) if ids else None
+        deadline = time.monotonic() + min(timeout, TRIGGER_WAIT_MAX_S)
+        with self._cond:
+            while True:
+                hit = self._find(ids, after)
+                remaining = deadline - time.monotonic()
+                if hit is not None or remaining <= 0 or self.closed:
+                    return hit
+                self._cond.wait(remaining)
+
+    async def wait_async(self, ids: Optional[Iterable[str]] = None, after: int = 0,
+                         timeout: float = 30.0) -> Optional[dict]:
+        """wait() for the event loop: no worker thread is held while blocked."""
+        ids = list(ids) if ids else None
+        deadline = time.monotonic() + min(timeout, TRIGGER_WAIT_MAX_S)
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            while True:
+                waiter[1].clear()
+                with self._lock:
+                    hit = self._find(ids, after)
+                remaining = deadline - time.monotonic()
+                if hit is not None or remaining <= 0 or self.closed:
+                    return hit
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def close(self) -> None:
+        """The capture ended: release every waiter (they return what they have)."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+            waiters = list(self._waiters)
+        _wake(waiters)
+
+    def status(self) -> dict:
+        return {"triggers": len(self._matcher[1]), "hits": self.seq,
+                "lines_scanned": self.lines_scanned}
@@ -1,28 +1,175 @@
-import subprocess, json, re
+"""
+usbip.py — Device discovery helper for connected DUTs.
 
-def list_duts():
+Purpose:
+- Enumerate USB devices straight from sysfs (`/sys/bus/usb/devices`): one
+  directory listing, a few small attribute reads per device, no fork/exec.
+  Each device is joined to its ttyACM*/ttyUSB* node and serial number.
+- Parse 'lsusb' output where sysfs isn't available (e.g. macOS dev boxes).
+- Designed for safe use (no root privileges required).
+- Supports mock data injection for testing: a provider for lsusb lines, or
+  a fake sysfs root.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Iterable, List, Optional
+import os
+import re
+import subprocess
+
+from .core.config import settings
+from .models import DutInternal
+
+# sysfs mount point; override to point the enumerator at a fake tree
+SYSFS_ROOT = settings.SYSFS_ROOT
+
+@dataclass(frozen=True)
+class DUT:
+    """Represent a single USB-connected DUT."""
+    bus: str
+    device: str
+    vid: str
+    pid: str
+    description: str
+
+    def as_dict(self) -> dict:
+        """Convert DUT object into a dictionary for JSON serialization."""
+        return asdict(self)
+
+# -------------------------------------------------
+# sysfs enumeration
+# -------------------------------------------------
+_HUB_CLASS = "09"
+
+def _attr(path: str, name: str) -> Optional[str]:
+    try:
+        with open(os.path.join(path, name), encoding="utf-8", errors="replace") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def _interface_ttys(path: str) -> List[str]:
+    """tty names bound to one interface: cdc_acm puts them under `tty/`,
+    usb-serial drivers (ftdi_sio, cp210x, ...) as `ttyUSB*` directly."""
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return []
+    ttys = [n for n in names if n.startswith("ttyUSB")]
+    if "tty" in names:
+        try:
+            ttys += os.listdir(os.path.join(path, "tty"))
+        except OSError:
+            pass
+    return ttys
+
+def enumerate_sysfs(root: Optional[str] = None) -> List[DutInternal]:
+    """
+    One pass over `<root>/bus/usb/devices`. Device entries (`1-1.2`) carry
+    the ids; interface entries (`1-1.2:1.0`) carry the tty. Root hubs and
+    hubs are skipped. Sorted by port path.
+    """
+    base = os.path.join(root or SYSFS_ROOT, "bus", "usb", "devices")
+    try:
+        entries = sorted(os.listdir(base))
+    except FileNotFoundError:
+        return []
+
+    ttys: Dict[str, List[str]] = {}
+    devices: List[str] = []
+    for name in entries:
+        if ":" in name:
+            found = _interface_ttys(os.path.join(base, name))
+            if found:
+                # interfaces sort by number, so the first tty is interface 0's
+                ttys.setdefault(name.split(":", 1)[0], []).extend(found)
+        elif not name.startswith("usb"):
+            devices.append(name)
+
+    duts: List[DutInternal] = []
+    for port in devices:
+        path = os.path.join(base, port)
+        if _attr(path, "bDeviceClass") == _HUB_CLASS:
+            continue
+        vid = (_attr(path, "idVendor") or "").lower() or None
+        pid = (_attr(path, "idProduct") or "").lower() or None
+        serial = _attr(path, "serial")
+        busnum, devnum = _attr(path, "busnum"), _attr(path, "devnum")
+        product = " ".join(filter(None, (_attr(path, "manufacturer"), _attr(path, "product"))))
+        tty = ttys.get(port)
+        duts.append(DutInternal(
+            id=f"{vid}:{pid}:{serial}" if serial else f"{vid}:{pid}@{port}",
+            vendor_id=vid,
+            product_id=pid,
+            serial=serial,
+            bus=f"{int(busnum):03d}" if busnum and busnum.isdigit() else busnum,
+            device=f"{int(devnum):03d}" if devnum and devnum.isdigit() else devnum,
+            port=port,
+            tty=f"/dev/{tty[0]}" if tty else None,
+            description=product or "USB Device",
+        ))
+    return duts
+
+def list_duts_internal(root: Optional[str] = None) -> List[DutInternal]:
+    """Connected USB devices with serial number, tty and port path."""
+    return enumerate_sysfs(root)
+
+# -------------------------------------------------
+# lsusb parsing (fallback where there is no sysfs)
+# -------------------------------------------------
+# Regex pattern that matches one line of `lsusb` output
+# macOS lsusb often has NO trailing description; make it optional.
+_LSUSB_LINE = re.compile(
+    r"Bus\s+(?P<bus>\d+)\s+Device\s+(?P<device>\d+):\s+ID\s+"
+    r"(?P<vid>[0-9a-fA-F]{4}):(?P<pid>[0-9a-fA-F]{4})(?:\s+(?P<desc>.*))?$"
+)
+
+def _default_lsusb_provider() -> Iterable[str]:
     """
-    Parse `lsusb` to produce a list of connected devices.
-    Marks TI 0451:bef3 explicitly as 'ti-launchpad' when present.
+    Default provider: runs `lsusb` command.
+    Returns each output line.
+    If `lsusb` is not found or fails, returns empty list (safe fail).
     """
     try:
-        res = subprocess.run(["lsusb"], capture_output=True, text=True, check=False)
-        duts = []
-        for line in res.stdout.splitlines():
-            m = re.search(r'ID\s+([0-9a-f]{4}):([0-9a-f]{4})', line, re.I)
-            if not m: 
-                continue
-            vid, pid = m.group(1).lower(), m.group(2).lower()
-            desc = "USB Device"
-            if vid == "0451" and pid == "bef3":
-                desc = "TI CC1352 LaunchPad"
-            duts.append({"id": f"{vid}:{pid}", "description": desc, "status": "connected"})
-        return duts
-    except Exception as e:
-        return {"error": str(e)}
-def list_duts_internal():
-    # temporary stub so FastAPI can import it
-    # later we can make this run `usbip list` on the Pi
-    return []
-def list_duts_internal():
-    return []
+        output = subprocess.check_output(["lsusb"], text=True)
+        return output.splitlines()
+    except Exception:
+        return []
+
+def parse_lsusb_lines(lines: Iterable[str]) -> List[DUT]:
+    """
+    Parse raw lsusb output lines into a list of DUT objects.
+    Each valid line becomes a DUT instance.
+    """
+    devices: List[DUT] = []
+    for line in lines:
+        match = _LSUSB_LINE.match(line.strip())
+        if not match:
+            continue  # skip invalid lines
+        devices.append(
+            DUT(
+                bus=match.group("bus"),
+                device=match.group("device"),
+                vid=match.group("vid").lower(),
+                pid=match.group("pid").lower(),
+                description=(match.group("desc") or "").strip(),
+            )
+        )
+    return devices
+
+def list_duts(provider: Optional[Callable[[], Iterable[str]]] = None,
+              root: Optional[str] = None) -> List[DUT]:
+    """
+    Return a list of all connected DUTs.
+    - provider: optional custom function returning mock lsusb lines for testing.
+    - root: sysfs root; without a provider sysfs is read directly, and lsusb
+      is only run when there is no `<root>/bus/usb` (non-Linux hosts).
+    """
+    if provider is None and os.path.isdir(os.path.join(root or SYSFS_ROOT, "bus", "usb")):
+        return [
+            DUT(bus=d.bus or "", device=d.device or "", vid=d.vendor_id or "",
+                pid=d.product_id or "", description=d.description or "")
+            for d in enumerate_sysfs(root)
+        ]
+    src = provider or _default_lsusb_provider
+    return parse_lsusb_lines(src())
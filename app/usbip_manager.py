@@ -0,0 +1,396 @@
+"""
+usbip_manager.py — Export and attach DUTs over USB/IP, many at a time.
+
+Runs `usbip bind`/`unbind` (on the Pi that has the boards) and `usbip
+attach`/`detach` (on the machine that uses them) as asyncio subprocesses.
+A batch runs all its devices side by side, one command per device at a
+time and at most USBIP_MAX_PARALLEL overall, so re-attaching a rack of
+eight boards after a Pi reboot takes one round instead of eight.
+
+Each device's state is kept in memory:
+
+- exports, keyed by bus id ("1-1.2"): bound / unbound / absent;
+- imports, keyed by "<remote host>/<bus id>": attached (with its vhci
+  port) / detached, and whether it is wanted, so `reattach()` knows what
+  to bring back.
+
+A background task reconciles this against `usbip list -l`, `usbip port`
+and the usbip-host driver in sysfs every USBIP_RECONCILE_S, for changes
+made behind the manager's back (a reboot, someone at a shell).
+
+Commands go through a runner, `runner(argv, timeout) -> (rc, stdout,
+stderr)`; the default runs USBIP_BIN as a subprocess. Pointing USBIP_BIN
+at a script or passing another runner lets tests stand in for usbip.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from . import metrics
+from .core.config import settings
+
+USBIP_BIN = settings.USBIP_BIN
+USBIP_TIMEOUT_S = settings.USBIP_TIMEOUT_S
+USBIP_MAX_PARALLEL = settings.USBIP_MAX_PARALLEL
+USBIP_RECONCILE_S = settings.USBIP_RECONCILE_S
+
+EXPORT, IMPORT = "export", "import"
+BOUND, UNBOUND, ABSENT, ATTACHED, DETACHED = (
+    "bound", "unbound", "absent", "attached", "detached",
+)
+
+Runner = Callable[[List[str], float], Awaitable[Tuple[int, str, str]]]
+
+USBIP_OPS = metrics.counter(
+    "usbip_ops_total", "usbip bind/unbind/attach/detach commands by result", ("op", "result"))
+USBIP_SECONDS = metrics.histogram(
+    "usbip_op_duration_seconds", "Run time of usbip commands", ("op",))
+
+# `usbip list -l`:  " - busid 1-1.2 (0451:bef3)"
+_LIST_LINE = re.compile(r"^\s*-\s*busid\s+(?P<busid>\S+)\s+\((?P<vid>[0-9a-fA-F]{4}):(?P<pid>[0-9a-fA-F]{4})\)")
+# `usbip port`:  "Port 00: <Port in Use> ..." then "... -> usbip://10.0.0.5:3240/1-1.2"
+_PORT_LINE = re.compile(r"^Port\s+(?P<port>\d+):")
+_REMOTE = re.compile(r"usbip://(?P<host>\[[^\]]+\]|[^:/\s]+)(?::\d+)?/(?P<busid>\S+)")
+_BUSID = re.compile(r"^\d+-[\d.]+$")
+# bind/unbind answers that mean the device is already where we want it
+_ALREADY = re.compile(r"already bound|not bound to usbip-host", re.IGNORECASE)
+
+
+async def subprocess_runner(argv: List[str], timeout: float) -> Tuple[int, str, str]:
+    proc = await asyncio.create_subprocess_exec(
+        *argv,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        raise TimeoutError(f"{' '.join(argv[:2])} timed out after {timeout:g}s")
+    return proc.returncode, out.decode(errors="replace"), err.decode(errors="replace")
+
+
+def parse_list(text: str) -> Dict[str, Tuple[str, str]]:
+    """busid -> (vid, pid) from `usbip list -l`."""
+    found: Dict[str, Tuple[str, str]] = {}
+    for line in text.splitlines():
+        m = _LIST_LINE.match(line)
+        if m:
+            found[m.group("busid")] = (m.group("vid").lower(), m.group("pid").lower())
+    return found
+
+
+def parse_port(text: str) -> Dict[Tuple[str, str], int]:
+    """(remote host, busid) -> vhci port from `usbip port`."""
+    found: Dict[Tuple[str, str], int] = {}
+    port: Optional[int] = None
+    for line in text.splitlines():
+        m = _PORT_LINE.match(line.strip())
+        if m:
+            port = int(m.group("port"))
+            continue
+        m = _REMOTE.search(line)
+        if m and port is not None:
+            found[(m.group("host").strip("[]"), m.group("busid"))] = port
+            port = None
+    return found
+
+
+def remote_host(host: str) -> str:
+    """Bare host name for `usbip attach -r`; accepts a Pi's base URL too."""
+    return (urlparse(host).hostname or host) if "://" in host else host
+
+
+class UsbipDevice:
+    def __init__(self, role: str, busid: str, host: Optional[str] = None) -> None:
+        self.role = role
+        self.busid = busid
+        self.host = host
+        self.key = f"{host}/{busid}" if role == IMPORT else busid
+        self.state = UNBOUND if role == EXPORT else DETACHED
+        self.busy: Optional[str] = None  # op in flight
+        self.port: Optional[int] = None
+        self.want = False  # imports: re-attach when found detached
+        self.vid: Optional[str] = None
+        self.pid: Optional[str] = None
+        self.error: Optional[str] = None
+        self.returncode: Optional[int] = None
+        self.updated = time.time()
+        self._changed = time.monotonic()
+
+    def _set(self, state: str) -> None:
+        if state != self.state:
+            self.state = state
+            self.updated = time.time()
+        self._changed = time.monotonic()
+
+    def status(self) -> dict:
+        return {
+            "device": self.key,
+            "role": self.role,
+            "busid": self.busid,
+            "host": self.host,
+            "state": self.state,
+            "busy": self.busy,
+            "port": self.port,
+            "want": self.want if self.role == IMPORT else None,
+            "usb_id": f"{self.vid}:{self.pid}" if self.vid else None,
+            "error": self.error,
+            "returncode": self.returncode,
+            "updated": self.updated,
+        }
+
+
+class UsbipManager:
+    def __init__(self, bin: str = USBIP_BIN, runner: Optional[Runner] = None,
+                 timeout_s: float = USBIP_TIMEOUT_S,
+                 max_parallel: int = USBIP_MAX_PARALLEL,
+                 reconcile_s: float = USBIP_RECONCILE_S,
+                 sysfs_root: Optional[str] = None) -> None:
+        self.bin = bin
+        self._runner = runner or subprocess_runner
+        self.timeout_s = timeout_s
+        self.max_parallel = max_parallel
+        self.reconcile_s = reconcile_s
+        self.sysfs_root = sysfs_root or settings.SYSFS_ROOT
+        self._devices: Dict[str, UsbipDevice] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self.reconciled: Optional[float] = None
+        self.reconcile_error: Optional[str] = None
+        self.reconciles = 0
+
+    # -------------------------------------------------
+    # devices
+    # -------------------------------------------------
+    def _export(self, busid: str) -> UsbipDevice:
+        dev = self._devices.get(busid)
+        if dev is None:
+            dev = self._devices[busid] = UsbipDevice(EXPORT, busid)
+        return dev
+
+    def _import(self, host: str, busid: str) -> UsbipDevice:
+        host = remote_host(host)
+        dev = self._devices.get(f"{host}/{busid}")
+        if dev is None:
+            dev = UsbipDevice(IMPORT, busid, host)
+            self._devices[dev.key] = dev
+        return dev
+
+    def get(self, key: str) -> Optional[UsbipDevice]:
+        return self._devices.get(key)
+
+    def devices(self, role: Optional[str] = None) -> List[UsbipDevice]:
+        return [d for d in list(self._devices.values()) if role is None or d.role == role]
+
+    # -------------------------------------------------
+    # commands
+    # -------------------------------------------------
+    async def _run(self, *args: str) -> Tuple[Optional[int], str, str]:
+        try:
+            return await self._runner([self.bin, *args], self.timeout_s)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # no usbip binary, timeout, ...
+            return None, "", str(e) or type(e).__name__
+
+    async def _op(self, dev: UsbipDevice, op: str, target: str,
+                  args: Callable[[], Optional[Tuple[str, ...]]]) -> dict:
+        """Run one command for `dev`, serialized per device. `args()` is
+        evaluated under the device's lock; None means nothing to do."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_parallel)
+        lock = self._locks.setdefault(dev.key, asyncio.Lock())
+        async with lock:
+            argv = args() if dev.state != target else None
+            if argv is None:
+                return {"op": op, "ok": True, "changed": False, **dev.status()}
+            dev.busy = op
+            t0 = time.monotonic()
+            try:
+                async with self._slots:
+                    rc, out, err = await self._run(*argv)
+            finally:
+                dev.busy = None
+            USBIP_SECONDS.labels(op).observe(time.monotonic() - t0)
+            ok = rc == 0 or (op in ("bind", "unbind") and bool(_ALREADY.search(err)))
+            USBIP_OPS.labels(op, "ok" if ok else "failed").inc()
+            dev.returncode = rc
+            if ok:
+                dev.error = None
+                dev._set(target)
+                if target == DETACHED:
+                    dev.port = None
+            else:
+                dev.error = (err.strip() or out.strip() or f"exit {rc}").splitlines()[-1]
+                dev._changed = time.monotonic()
+            return {"op": op, "ok": ok, "changed": ok, **dev.status()}
+
+    async def bind(self, busids: Iterable[str]) -> List[dict]:
+        """Export local devices (`usbip bind -b`), all at once."""
+        devs = [self._export(b) for b in dict.fromkeys(busids)]
+        return list(await asyncio.gather(*(
+            self._op(d, "bind", BOUND, lambda d=d: ("bind", "-b", d.busid)) for d in devs)))
+
+    async def unbind(self, busids: Iterable[str]) -> List[dict]:
+        devs = [self._export(b) for b in dict.fromkeys(busids)]
+        return list(await asyncio.gather(*(
+            self._op(d, "unbind", UNBOUND, lambda d=d: ("unbind", "-b", d.busid)) for d in devs)))
+
+    async def attach(self, host: str, busids: Iterable[str]) -> List[dict]:
+        """Attach devices exported by `host`, all at once."""
+        return await self._attach([self._import(host, b) for b in dict.fromkeys(busids)])
+
+    async def reattach(self, host: Optional[str] = None) -> List[dict]:
+        """Attach every wanted import that is detached (e.g. after its Pi rebooted)."""
+        host = remote_host(host) if host else None
+        # the cached state may predate the reboot: ask `usbip port` what is attached now
+        await self._refresh_ports(time.monotonic())
+        return await self._attach([
+            d for d in self.devices(IMPORT)
+            if d.want and d.state != ATTACHED and (host is None or d.host == host)
+        ])
+
+    async def _attach(self, devs: List[UsbipDevice]) -> List[dict]:
+        for d in devs:
+            d.want = True
+        results = await asyncio.gather(*(
+            self._op(d, "attach", ATTACHED, lambda d=d: ("attach", "-r", d.host, "-b", d.busid))
+            for d in devs))
+        if any(r["changed"] for r in results):
+            # attach doesn't say which port it got; one `usbip port` for the batch
+            await self._refresh_ports(time.monotonic())
+        return [{**r, "port": self._devices[r["device"]].port} for r in results]
+
+    async def detach(self, keys: Iterable[str]) -> List[dict]:
+        """Detach imports by key ("<host>/<busid>"); they are no longer wanted."""
+        keys = list(dict.fromkeys(keys))
+        devs = [self._devices.get(k) for k in keys]
+        if any(d is not None and d.role == IMPORT and d.port is None and d.state == ATTACHED
+               for d in devs):
+            await self._refresh_ports(time.monotonic())
+
+        async def one(key: str, dev: Optional[UsbipDevice]) -> dict:
+            if dev is None or dev.role != IMPORT:
+                return {"op": "detach", "ok": False, "changed": False, "device": key,
+                        "error": f"no imported device {key}"}
+            dev.want = False
+            return await self._op(dev, "detach", DETACHED,
+                                  lambda: ("detach", "-p", str(dev.port)) if dev.port is not None
+                                  else None)
+
+        return list(await asyncio.gather(*(one(k, d) for k, d in zip(keys, devs))))
+
+    # -------------------------------------------------
+    # reconcile
+    # -------------------------------------------------
+    def _bound_busids(self) -> Set[str]:
+        path = os.path.join(self.sysfs_root, "bus", "usb", "drivers", "usbip-host")
+        try:
+            return {n for n in os.listdir(path) if _BUSID.match(n)}
+        except OSError:
+            return set()
+
+    def _stale(self, dev: UsbipDevice, since: float) -> bool:
+        # changed by a command after the snapshot was taken, or one is running
+        lock = self._locks.get(dev.key)
+        return dev._changed > since or (lock is not None and lock.locked())
+
+    async def _refresh_ports(self, since: float) -> Optional[str]:
+        rc, out, err = await self._run("port")
+        if rc != 0:
+            return f"usbip port: {err.strip() or f'exit {rc}'}"
+        self._apply_ports(parse_port(out), since)
+        return None
+
+    def _apply_ports(self, ports: Dict[Tuple[str, str], int], since: float) -> None:
+        for (host, busid), port in ports.items():
+            new = f"{host}/{busid}" not in self._devices
+            dev = self._import(host, busid)
+            if new:
+                dev.want = True  # attached outside the manager; keep it attached
+            if not self._stale(dev, since) or dev.port is None:
+                dev.port = port
+                dev._set(ATTACHED)
+        seen = {f"{h}/{b}" for h, b in ports}
+        for dev in self.devices(IMPORT):
+            if dev.key not in seen and not self._stale(dev, since):
+                dev.port = None
+                dev._set(DETACHED)
+
+    async def reconcile(self) -> dict:
+        """Bring the in-memory state in line with what usbip and sysfs report."""
+        since = time.monotonic()
+        (lrc, lout, lerr), port_error = await asyncio.gather(
+            self._run("list", "-l"), self._refresh_ports(since))
+        errors = [port_error] if port_error else []
+        if lrc == 0:
+            present = parse_list(lout)
+            bound = self._bound_busids()
+            for busid, (vid, pid) in present.items():
+                dev = self._export(busid)
+                dev.vid, dev.pid = vid, pid
+                if not self._stale(dev, since):
+                    dev._set(BOUND if busid in bound else UNBOUND)
+            for dev in self.devices(EXPORT):
+                if dev.busid not in present and not self._stale(dev, since):
+                    dev._set(ABSENT)
+        else:
+            errors.append(f"usbip list: {lerr.strip() or f'exit {lrc}'}")
+        self.reconciles += 1
+        self.reconciled = time.time()
+        self.reconcile_error = "; ".join(errors) or None
+        return self.status()
+
+    async def _reconcile_loop(self) -> None:
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                self.reconcile_error = str(e)
+            await asyncio.sleep(self.reconcile_s)
+
+    def start(self) -> None:
+        """Start the background reconcile; call from the event loop."""
+        if self.reconcile_s > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._reconcile_loop(), name="usbip-reconcile")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        return {
+            "devices": [d.status() for d in self.devices()],
+            "reconciled": self.reconciled,
+            "reconcile_error": self.reconcile_error,
+            "reconcile_s": self.reconcile_s,
+        }
+
+    def collect(self):
+        counts: Dict[Tuple[str, str], int] = {}
+        for d in self.devices():
+            counts[(d.role, d.state)] = counts.get((d.role, d.state), 0) + 1
+        return [
+            metrics.gauge_family("usbip_devices", "USB/IP devices by role and state",
+                                 [({"role": r, "state": s}, n) for (r, s), n in counts.items()]),
+        ]
+
+
+usbip_manager = UsbipManager()
+metrics.register_collector(usbip_manager.collect)
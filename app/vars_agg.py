@@ -0,0 +1,354 @@
+"""
+vars_agg.py — Downsampled views of one variable from the columnar vars store.
+
+A soak run can hold hundreds of millions of rows per variable; a plot
+needs a few thousand points. Two reductions, both NumPy over the
+memory-mapped float64 columns (vars_store.py), read VARS_AGG_CHUNK_ROWS
+rows at a time so memory stays flat whatever the size of the store:
+
+- "agg": fixed-width time buckets with count/min/max/mean/last. Bucket
+  widths are powers of two seconds and bucket edges are multiples of the
+  width, so a given resolution always cuts time at the same places.
+  Buckets of each (store, variable, resolution) are cached; panning
+  only computes the buckets that scrolled into view, zooming back to a
+  seen resolution computes nothing. Edge buckets are always whole, even
+  where they reach past start/end. The bucket holding the newest row is
+  never cached, since a live capture may still add to it.
+- "lttb": Largest-Triangle-Three-Buckets, which keeps real samples and
+  the visual shape of the series; computed bucket by bucket over
+  equal-row buckets, holding two buckets in memory.
+
+NumPy is imported on first use only.
+"""
+from __future__ import annotations
+
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from . import metrics
+from .core.config import settings
+from .vars_store import TS_FILE, column_path, list_columns
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# rows read per step of a reduction (8 bytes each, per column)
+VARS_AGG_CHUNK_ROWS = settings.VARS_AGG_CHUNK_ROWS
+# upper bound on points per query
+VARS_AGG_MAX_POINTS = settings.VARS_AGG_MAX_POINTS
+# (store, variable, resolution) entries kept, and buckets kept per entry
+VARS_AGG_CACHE_ENTRIES = settings.VARS_AGG_CACHE_ENTRIES
+VARS_AGG_CACHE_BUCKETS = settings.VARS_AGG_CACHE_BUCKETS
+
+AGG, LTTB = "agg", "lttb"
+MODES = (AGG, LTTB)
+
+AGG_CACHE = metrics.counter(
+    "vars_agg_buckets_total", "Aggregate buckets served, by where they came from", ("source",))
+_CACHED, _COMPUTED = AGG_CACHE.labels("cache"), AGG_CACHE.labels("computed")
+
+
+def _memmap(path: str) -> "np.ndarray":
+    import numpy as np
+
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return np.empty(0, dtype="<f8")
+    n = size // 8
+    if n == 0:
+        return np.empty(0, dtype="<f8")
+    return np.memmap(path, dtype="<f8", mode="r", shape=(n,))
+
+
+def _values(col: "np.ndarray", first: int, a: int, b: int) -> "np.ndarray":
+    """Rows [a, b) of a column that starts at row `first`; NaN outside it."""
+    import numpy as np
+
+    out = np.full(b - a, np.nan)
+    lo, hi = max(a, first), min(b, first + len(col))
+    if lo < hi:
+        out[lo - a:hi - a] = col[lo - first:hi - first]
+    return out
+
+
+class _Series:
+    """The mapped timestamp and value columns of one variable."""
+
+    def __init__(self, store: str, name: str) -> None:
+        columns = list_columns(store)
+        if name not in columns:
+            raise KeyError(name)
+        self.ts = _memmap(os.path.join(store, TS_FILE))
+        self.col = _memmap(column_path(store, name))
+        self.first = columns[name]
+
+    def rows(self, start: Optional[float], end: Optional[float]) -> Tuple[int, int]:
+        import numpy as np
+
+        n = len(self.ts)
+        lo = 0 if start is None else int(np.searchsorted(self.ts, start, "left"))
+        hi = n if end is None else int(np.searchsorted(self.ts, end, "left"))
+        return lo, max(lo, hi)
+
+
+# -------------------------------------------------
+# fixed-width buckets
+# -------------------------------------------------
+class _Buckets:
+    """count/sum/min/max/last for buckets b0 .. b0 + len - 1."""
+
+    def __init__(self, b0: int, n: int) -> None:
+        import numpy as np
+
+        self.b0 = b0
+        self.count = np.zeros(n, dtype=np.int64)
+        self.sum = np.zeros(n)
+        self.min = np.full(n, np.inf)
+        self.max = np.full(n, -np.inf)
+        self.last = np.full(n, np.nan)
+
+    def __len__(self) -> int:
+        return len(self.count)
+
+    def slice(self, b_lo: int, b_hi: int) -> "_Buckets":
+        out = _Buckets.__new__(_Buckets)
+        i, j = b_lo - self.b0, b_hi - self.b0
+        out.b0 = b_lo
+        for field in ("count", "sum", "min", "max", "last"):
+            setattr(out, field, getattr(self, field)[i:j])
+        return out
+
+    @staticmethod
+    def concat(parts) -> "_Buckets":
+        import numpy as np
+
+        out = _Buckets.__new__(_Buckets)
+        out.b0 = parts[0].b0
+        for field in ("count", "sum", "min", "max", "last"):
+            setattr(out, field, np.concatenate([getattr(p, field) for p in parts]))
+        return out
+
+
+def _reduce(series: _Series, width: float, b_lo: int, b_hi: int) -> _Buckets:
+    """Aggregate buckets [b_lo, b_hi) straight from the columns, chunk by chunk."""
+    import numpy as np
+
+    out = _Buckets(b_lo, b_hi - b_lo)
+    lo, hi = series.rows(b_lo * width, b_hi * width)
+    for a in range(lo, hi, VARS_AGG_CHUNK_ROWS):
+        b = min(hi, a + VARS_AGG_CHUNK_ROWS)
+        v = _values(series.col, series.first, a, b)
+        ok = ~np.isnan(v)
+        if not ok.any():
+            continue
+        t = np.asarray(series.ts[a:b])[ok]
+        v = v[ok]
+        idx = np.clip(np.floor(t / width).astype(np.int64), b_lo, b_hi - 1) - b_lo
+        # timestamps are sorted, so each bucket is one run of equal idx
+        starts = np.flatnonzero(np.r_[True, idx[1:] != idx[:-1]])
+        ends = np.r_[starts[1:], len(idx)]
+        ub = idx[starts]
+        out.count[ub] += ends - starts
+        out.sum[ub] += np.add.reduceat(v, starts)
+        out.min[ub] = np.minimum(out.min[ub], np.minimum.reduceat(v, starts))
+        out.max[ub] = np.maximum(out.max[ub], np.maximum.reduceat(v, starts))
+        out.last[ub] = v[ends - 1]
+    return out
+
+
+def resolution_for(span: float, points: int) -> float:
+    """Smallest power-of-two bucket width (seconds) giving at most `points` buckets."""
+    if span <= 0:
+        return 1.0
+    return 2.0 ** math.ceil(math.log2(span / points))
+
+
+class _Entry:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.buckets: Optional[_Buckets] = None
+
+
+class AggregateCache:
+    def __init__(self, max_entries: int = VARS_AGG_CACHE_ENTRIES,
+                 max_buckets: int = VARS_AGG_CACHE_BUCKETS) -> None:
+        self.max_entries = max_entries
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str, float], _Entry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, key: Tuple[str, str, float]) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+            return entry
+
+    def buckets(self, store: str, name: str, series: _Series, width: float,
+                b_lo: int, b_hi: int) -> _Buckets:
+        """Buckets [b_lo, b_hi), computing only what the cache lacks."""
+        # everything before the newest row's bucket is final
+        n = len(series.ts)
+        final = int(math.floor(series.ts[n - 1] / width)) if n else b_lo
+        entry = self._entry((store, name, width))
+        with entry.lock:
+            have = entry.buckets
+            if have is not None and (b_hi < have.b0 or b_lo > have.b0 + len(have)):
+                have = None  # disjoint: start over around this view
+            parts = []
+            if have is None:
+                c_lo = c_hi = b_lo
+            else:
+                c_lo, c_hi = have.b0, have.b0 + len(have)
+            if b_lo < c_lo:
+                parts.append(_reduce(series, width, b_lo, c_lo))
+            if have is not None:
+                parts.append(have)
+            if c_hi < b_hi:
+                parts.append(_reduce(series, width, c_hi, b_hi))
+            merged = _Buckets.concat(parts) if len(parts) > 1 else parts[0]
+            computed = sum(len(p) for p in parts if p is not have)
+            _COMPUTED.inc(computed)
+            _CACHED.inc((b_hi - b_lo) - computed)
+            if computed:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            keep_hi = min(merged.b0 + len(merged), final)
+            keep_lo = max(merged.b0, keep_hi - self.max_buckets)
+            entry.buckets = merged.slice(keep_lo, keep_hi) if keep_lo < keep_hi else None
+            return merged.slice(b_lo, b_hi)
+
+    def status(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+aggregate_cache = AggregateCache()
+
+
+def aggregate(store: str, name: str, start: Optional[float] = None,
+              end: Optional[float] = None, points: int = 1000,
+              cache: Optional[AggregateCache] = None) -> dict:
+    """Non-empty buckets of `name` between start and end, at most ~`points` of them."""
+    series = _Series(store, name)
+    lo, hi = series.rows(start, end)
+    if lo >= hi:
+        return {"resolution_s": None, "t": [], "count": [], "min": [], "max": [],
+                "mean": [], "last": []}
+    t0 = start if start is not None else float(series.ts[lo])
+    t1 = end if end is not None else float(series.ts[hi - 1])
+    width = resolution_for(t1 - t0, points)
+    while True:
+        b_lo = int(math.floor(t0 / width))
+        b_hi = int(math.floor(t1 / width)) + 1
+        if end is not None and b_hi * width - width >= end:
+            b_hi -= 1  # `end` is exclusive and sits on a bucket edge
+        if b_hi - b_lo <= max(points, 1):
+            break
+        width *= 2  # the window straddles bucket edges: one more bucket than asked
+    buckets = (cache or aggregate_cache).buckets(store, name, series, width, b_lo, b_hi)
+
+    import numpy as np
+
+    keep = np.flatnonzero(buckets.count)
+    count = buckets.count[keep]
+    return {
+        "resolution_s": width,
+        "t": ((keep + buckets.b0) * width).tolist(),
+        "count": count.tolist(),
+        "min": buckets.min[keep].tolist(),
+        "max": buckets.max[keep].tolist(),
+        "mean": (buckets.sum[keep] / count).tolist(),
+        "last": buckets.last[keep].tolist(),
+    }
+
+
+# -------------------------------------------------
+# LTTB
+# -------------------------------------------------
+def _finite(series: _Series, a: int, b: int) -> Tuple["np.ndarray", "np.ndarray"]:
+    import numpy as np
+
+    v = _values(series.col, series.first, a, b)
+    ok = ~np.isnan(v)
+    return np.asarray(series.ts[a:b])[ok], v[ok]
+
+
+def _finite_bounds(series: _Series, lo: int, hi: int) -> Optional[Tuple[int, int]]:
+    """[a, b) trimmed so rows a and b - 1 have a value; None if no row has."""
+    import numpy as np
+
+    a = None
+    for c in range(lo, hi, VARS_AGG_CHUNK_ROWS):
+        v = _values(series.col, series.first, c, min(hi, c + VARS_AGG_CHUNK_ROWS))
+        ok = np.flatnonzero(~np.isnan(v))
+        if len(ok):
+            a = c + int(ok[0])
+            break
+    if a is None:
+        return None
+    for c in range(hi, a, -VARS_AGG_CHUNK_ROWS):
+        start = max(a, c - VARS_AGG_CHUNK_ROWS)
+        ok = np.flatnonzero(~np.isnan(_values(series.col, series.first, start, c)))
+        if len(ok):
+            return a, start + int(ok[-1]) + 1
+    return a, a + 1
+
+
+def lttb(store: str, name: str, start: Optional[float] = None,
+         end: Optional[float] = None, points: int = 1000) -> dict:
+    """`points` real samples chosen by Largest-Triangle-Three-Buckets."""
+    import numpy as np
+
+    series = _Series(store, name)
+    bounds = _finite_bounds(series, *series.rows(start, end))
+    if bounds is None:
+        return {"t": [], "v": []}
+    lo, hi = bounds
+    n = hi - lo
+    if n <= max(points, 2):
+        t, v = _finite(series, lo, hi)
+        return {"t": t.tolist(), "v": v.tolist()}
+    if points <= 2:
+        # no buckets between the two kept ends
+        (t_a,), (v_a,) = _finite(series, lo, lo + 1)
+        (t_b,), (v_b,) = _finite(series, hi - 1, hi)
+        return {"t": [float(t_a), float(t_b)], "v": [float(v_a), float(v_b)]}
+
+    # first and last samples are kept; the rows between are split into
+    # points - 2 buckets with one sample picked from each
+    edges = lo + 1 + np.linspace(0, n - 2, points - 1).astype(np.int64)
+    first_t, first_v = _finite(series, lo, lo + 1)
+    out_t, out_v = [first_t[0]], [first_v[0]]
+    prev = (first_t[0], first_v[0])
+    cur = _finite(series, edges[0], edges[1])
+    for i in range(points - 2):
+        nxt = _finite(series, edges[i + 1], edges[i + 2]) if i + 2 < len(edges) \
+            else _finite(series, hi - 1, hi)
+        t, v = cur
+        if len(t):
+            # third vertex: mean of the next bucket (this one's if that is empty)
+            ct, cv = (nxt[0].mean(), nxt[1].mean()) if len(nxt[0]) else (t.mean(), v.mean())
+            area = np.abs((prev[0] - ct) * (v - prev[1]) - (prev[0] - t) * (cv - prev[1]))
+            j = int(np.argmax(area))
+            prev = (t[j], v[j])
+            out_t.append(t[j])
+            out_v.append(v[j])
+        cur = nxt
+    last_t, last_v = _finite(series, hi - 1, hi)
+    out_t.append(last_t[0])
+    out_v.append(last_v[0])
+    return {"t": [float(x) for x in out_t], "v": [float(x) for x in out_v]}
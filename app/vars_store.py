@@ -0,0 +1,261 @@
+"""
+vars_store.py — Columnar store for numeric variables printed by DUTs.
+
+Lines such as "temp=21.5 rssi=-73 vbat=3.29" are parsed into one
+append-only float64 column per variable plus a shared timestamp column:
+
+    <job>_<ts>_vars/
+        ts.f64            epoch seconds (UTC), one entry per parsed line
+        v.<name>.f64      values of <name>, starting at row first_row
+        columns.json      {"<name>": first_row, ...}
+
+Only lines carrying at least one numeric key=value become rows. A column
+starts at the row its variable was first seen; rows where it is missing
+are NaN. Columns are written before `ts.f64`, so a reader that trusts the
+timestamp column never sees a row whose values are not on disk yet.
+"""
+from __future__ import annotations
+
+import json
+import math
+import mmap
+import os
+import re
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TS_FILE = "ts.f64"
+COLUMNS_FILE = "columns.json"
+_ITEM = 8  # float64
+
+_NAN = float("nan")
+
+# key=value with a numeric value; the key doubles as a file name, so it
+# is restricted to a safe character set
+_VAR = re.compile(
+    r"(?<![\w.])(?P<key>[A-Za-z_][A-Za-z0-9_.]*)\s*=\s*"
+    r"(?P<val>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(?![\w.])"
+)
+
+
+def parse_vars(line: str) -> List[Tuple[str, float]]:
+    """Return the numeric key=value pairs in `line`, in order of appearance."""
+    return [(m.group("key"), float(m.group("val"))) for m in _VAR.finditer(line)]
+
+
+def iso_to_epoch(ts: str) -> float:
+    """Convert a naive UTC ISO timestamp (as written in the logs) to epoch seconds."""
+    return datetime.fromisoformat(ts).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _column_file(name: str) -> str:
+    return f"v.{name}.f64"
+
+
+class _Column:
+    def __init__(self, first_row: int, length: int = 0) -> None:
+        self.first_row = first_row
+        self.next_row = first_row + length
+        self.pending = array("d")
+        self.file = None
+
+
+class VarsStore:
+    """
+    Append side of the store; owned by the log writer thread like LogSink.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._cols: Dict[str, _Column] = {}
+        self._ts = array("d")
+        self._ts_file = open(os.path.join(path, TS_FILE), "ab")
+        self.rows = self._ts_file.tell() // _ITEM
+        self._schema_dirty = False
+
+        # reopening an existing store (e.g. after a restart) keeps appending
+        for name, first_row in _load_columns(path).items():
+            col_path = os.path.join(path, _column_file(name))
+            size = os.path.getsize(col_path) if os.path.exists(col_path) else 0
+            self._cols[name] = _Column(first_row, size // _ITEM)
+
+    def append(self, epoch: float, lines: Iterable[str]) -> int:
+        """Parse `lines` (all stamped `epoch`); returns the number of rows added."""
+        added = 0
+        for line in lines:
+            found = parse_vars(line)
+            if not found:
+                continue
+            row = self.rows
+            for name, value in found:
+                col = self._cols.get(name)
+                if col is None:
+                    col = self._cols[name] = _Column(row)
+                    self._schema_dirty = True
+                elif col.next_row > row:
+                    continue  # same key twice on one line: first one wins
+                gap = row - col.next_row
+                if gap:
+                    col.pending.extend(array("d", [_NAN]) * gap)
+                col.pending.append(value)
+                col.next_row = row + 1
+            self._ts.append(epoch)
+            self.rows += 1
+            added += 1
+        return added
+
+    def flush(self) -> None:
+        if self._schema_dirty:
+            _save_columns(self.path, {n: c.first_row for n, c in self._cols.items()})
+            self._schema_dirty = False
+        for name, col in self._cols.items():
+            if not col.pending:
+                continue
+            if col.file is None:
+                col.file = open(os.path.join(self.path, _column_file(name)), "ab")
+            col.pending.tofile(col.file)
+            col.file.flush()
+            del col.pending[:]
+        if self._ts:
+            self._ts.tofile(self._ts_file)
+            self._ts_file.flush()
+            del self._ts[:]
+
+    def fsync(self) -> None:
+        for col in self._cols.values():
+            if col.file is not None:
+                os.fsync(col.file.fileno())
+        os.fsync(self._ts_file.fileno())
+
+    def close(self) -> None:
+        self.flush()
+        for col in self._cols.values():
+            if col.file is not None:
+                col.file.close()
+        self._ts_file.close()
+
+
+def _load_columns(path: str) -> Dict[str, int]:
+    try:
+        with open(os.path.join(path, COLUMNS_FILE), encoding="utf-8") as f:
+            return {str(k): int(v) for k, v in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def _save_columns(path: str, columns: Dict[str, int]) -> None:
+    tmp = os.path.join(path, COLUMNS_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(columns, f)
+    os.replace(tmp, os.path.join(path, COLUMNS_FILE))
+
+
+# -------------------------------------------------
+# read side
+# -------------------------------------------------
+def store_path_for(text_or_vars_path: str) -> str:
+    """`<base>_vars.csv` / `<base>_text.log` -> `<base>_vars`."""
+    for suffix in ("_vars.csv", "_text.log"):
+        if text_or_vars_path.endswith(suffix):
+            return text_or_vars_path[: -len(suffix)] + "_vars"
+    raise ValueError(f"not a serial log path: {text_or_vars_path}")
+
+
+def find_store(log_dir: str, job_id: str) -> Optional[str]:
+    """Latest `<job_id>_<YYYYmmdd_HHMMSS>_vars` store in `log_dir`, if any."""
+    pat = re.compile(re.escape(job_id) + r"_\d{8}_\d{6}_vars$")
+    try:
+        names = sorted(n for n in os.listdir(log_dir) if pat.match(n))
+    except FileNotFoundError:
+        return None
+    return os.path.join(log_dir, names[-1]) if names else None
+
+
+def list_columns(path: str) -> Dict[str, int]:
+    return _load_columns(path)
+
+
+def column_path(path: str, name: str) -> str:
+    return os.path.join(path, _column_file(name))
+
+
+def row_count(path: str) -> int:
+    try:
+        return os.path.getsize(os.path.join(path, TS_FILE)) // _ITEM
+    except FileNotFoundError:
+        return 0
+
+
+def parse_time(value: str) -> float:
+    """Accept epoch seconds or a (UTC) ISO timestamp."""
+    try:
+        return float(value)
+    except ValueError:
+        return iso_to_epoch(value)
+
+
+def _map(path: str) -> Tuple[Optional[mmap.mmap], memoryview]:
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return None, memoryview(b"").cast("d")
+    usable = size - size % _ITEM
+    if usable == 0:
+        return None, memoryview(b"").cast("d")
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), usable, access=mmap.ACCESS_READ)
+    return mm, memoryview(mm).cast("d")
+
+
+def _bisect(view: memoryview, x: float, lo: int, hi: int) -> int:
+    """First index in [lo, hi) whose value is >= x."""
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if view[mid] < x:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def read_columns(path: str, names: Optional[List[str]] = None,
+                 start: Optional[float] = None, end: Optional[float] = None) -> Dict[str, List[float]]:
+    """
+    Return {"ts": [...], name: [...]} for rows with start <= ts < end.
+
+    The timestamp column is memory-mapped and bisected, so the cost is
+    proportional to the rows returned, not to the size of the store.
+    Missing values come back as None (JSON null).
+    """
+    columns = _load_columns(path)
+    wanted = list(columns) if names is None else [n for n in names if n in columns]
+
+    ts_mm, ts = _map(os.path.join(path, TS_FILE))
+    try:
+        n = len(ts)
+        lo = 0 if start is None else _bisect(ts, start, 0, n)
+        hi = n if end is None else _bisect(ts, end, lo, n)
+        out: Dict[str, List[float]] = {"ts": ts[lo:hi].tolist()}
+    finally:
+        ts.release()
+        if ts_mm is not None:
+            ts_mm.close()
+
+    for name in wanted:
+        first = columns[name]
+        mm, col = _map(os.path.join(path, _column_file(name)))
+        try:
+            values: List[Optional[float]] = [None] * (hi - lo)
+            a = max(lo, first)
+            b = min(hi, first + len(col))
+            if a < b:
+                chunk = col[a - first:b - first].tolist()
+                values[a - lo:b - lo] = [None if math.isnan(v) else v for v in chunk]
+            out[name] = values
+        finally:
+            col.release()
+            if mm is not None:
+                mm.close()
+    return out
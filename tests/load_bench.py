@@ -0,0 +1,471 @@
+"""
+API load test: the host app against stand-in Pis with fake DUTs.
+
+Starts one or more MockPi servers (configurable latency, jitter, failure
+rate and DUT count; DUTs look like the MOCK_DUTS ones), then `uvicorn
+app.main:app` pointed at them with PI_HOSTS, and waits until the Pi
+registry routes every DUT. A burst of client threads, released together
+like a batch of CI jobs, then hits the API for a fixed time with a
+weighted mix of:
+
+- duts:   GET /duts
+- txrx:   POST /dut/serial/txrx    (routed to the owning Pi)
+- script: POST /dut/serial/script  (routed to the owning Pi)
+- flash:  POST /dut/flash          (routed to the owning Pi)
+
+Meanwhile /metrics is sampled for the threadpool_* gauges, which show
+whether sync handlers are queueing for a worker thread.
+
+    python tests/load_bench.py --clients 64 --seconds 10 --pis 2 --latency-ms 20
+    python tests/load_bench.py --out before.json
+    python tests/load_bench.py --compare before.json
+
+prints a JSON report: requests/s, errors, and p50/p95/p99 latency overall
+and per scenario, plus threadpool use. With --compare, the change of each
+number against an earlier report.
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+SCENARIOS = ("duts", "txrx", "script", "flash")
+
+
+@dataclass
+class PiProfile:
+    duts: int = 8
+    latency_ms: float = 5.0  # added to every answer
+    jitter_ms: float = 0.0  # plus uniform 0..jitter
+    fail_rate: float = 0.0  # share of answers that are 503
+    seed: int = 1
+
+
+@dataclass
+class LoadProfile:
+    clients: int = 32
+    seconds: float = 5.0
+    mix: str = "duts=4,txrx=3,script=2,flash=1"
+    pis: int = 2
+    sample_ms: float = 100.0  # /metrics sampling interval
+    seed: int = 1
+
+
+def mock_dut(pi: str, i: int) -> dict:
+    """A fake DUT shaped like the MOCK_DUTS one."""
+    return {
+        "id": f"mock-{pi}-{i:02d}",
+        "bus": "usb",
+        "device": f"/dev/ttyACM{i}",
+        "vid": "0451",
+        "pid": "bef3",
+        "description": "TI XDS110 Debug Probe (MOCK)",
+        "status": "idle",
+    }
+
+
+class MockPi:
+    """Stand-in Pi answering /duts, serial and flash requests about its fake DUTs."""
+
+    def __init__(self, name: str, profile: PiProfile) -> None:
+        self.name = name
+        self.profile = profile
+        self.duts = [mock_dut(name, i) for i in range(profile.duts)]
+        self.hits: Dict[str, int] = {}
+        self.failed = 0
+        self._rng = random.Random(profile.seed)
+        self._lock = threading.Lock()
+        self._jobs = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "MockPi":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _delay_and_fail(self, path: str) -> bool:
+        """Sleep the profile's latency; True if this answer should fail."""
+        p = self.profile
+        with self._lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+            jitter = self._rng.uniform(0, p.jitter_ms) if p.jitter_ms else 0.0
+            fail = p.fail_rate > 0 and self._rng.random() < p.fail_rate
+            if fail:
+                self.failed += 1
+        time.sleep((p.latency_ms + jitter) / 1000)
+        return fail
+
+    def _answer(self, method: str, path: str, body: dict, if_none_match: Optional[str]
+                ) -> Tuple[int, Optional[object], Dict[str, str]]:
+        if path == "/ping":
+            return 200, {"status": "ok"}, {}
+        if self._delay_and_fail(path):
+            return 503, {"detail": f"{self.name}: injected failure"}, {}
+        if method == "GET" and path == "/duts":
+            etag = f'"{self.name}-{len(self.duts)}"'
+            if if_none_match == etag:
+                return 304, None, {"ETag": etag}
+            return 200, self.duts, {"ETag": etag}
+        if method == "POST" and path == "/dut/serial/txrx":
+            return 200, {"port": body["dut_id"], "sent": body.get("data"),
+                         "received": f"OK {body.get('data')}", "via": "pool"}, {}
+        if method == "POST" and path == "/dut/serial/script":
+            steps = [{"ok": True, "sent": s.get("send"), "line": "OK"}
+                     for s in body.get("steps", [])]
+            return 200, {"port": body["dut_id"], "ok": True, "steps_run": len(steps),
+                         "steps": steps, "vars": {}}, {}
+        if method == "POST" and path == "/dut/flash":
+            with self._lock:
+                self._jobs += 1
+                job = self._jobs
+            return 200, {"dry_run": False, "executed": True, "job_id": f"flash-{job}",
+                         "dut_id": body["dut_id"], "state": "queued"}, {}
+        return 404, {"detail": f"no route {method} {path}"}, {}
+
+    def _handler(self):
+        pi = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self, method: str) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else {}
+                code, data, headers = pi._answer(method, self.path.split("?")[0], body,
+                                                 self.headers.get("If-None-Match"))
+                raw = json.dumps(data).encode() if data is not None else b""
+                self.send_response(code)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class HostApp:
+    """`uvicorn app.main:app` in a subprocess, pointed at the given Pis."""
+
+    def __init__(self, pi_urls: List[str], env: Optional[Dict[str, str]] = None) -> None:
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._log_dir = tempfile.mkdtemp(prefix="load_bench_")
+        self.env = {
+            **os.environ,
+            "PI_HOSTS": ",".join(pi_urls),
+            "PI_HEARTBEAT_S": "0.5",
+            "MOCK_DUTS": "1",
+            "LOG_DIR": self._log_dir,
+            "USBIP_RECONCILE_S": "0",
+            "ALLOW_FLASH": "0",
+            **(env or {}),
+        }
+        self._proc: Optional[subprocess.Popen] = None
+
+    def get(self, path: str, timeout: float = 2.0) -> dict:
+        with urllib.request.urlopen(self.url + path, timeout=timeout) as resp:
+            return json.loads(resp.read())
+
+    def start(self, routes: int = 0, timeout: float = 30.0) -> "HostApp":
+        """Spawn the app; return once /ping answers and `routes` DUTs are routed."""
+        self._proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--log-level", "warning"],
+            cwd=ROOT, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited: {self._proc.stderr.read().decode()[-2000:]}")
+            try:
+                if self.get("/pis", timeout=1)["routes"] >= routes:
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.05)
+        self.stop()
+        raise TimeoutError(f"host app not ready with {routes} routes after {timeout}s")
+
+    def stop(self) -> None:
+        if self._proc is None:
+            return
+        self._proc.terminate()
+        try:
+            self._proc.wait(5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+        self._proc.stderr.close()
+        self._proc = None
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    for part in filter(None, (p.strip() for p in mix.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"unknown scenario {name!r}; expected one of {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("mix selects no scenario")
+    return weights
+
+
+def _request(scenario: str, dut_id: str) -> Tuple[str, str, Optional[dict]]:
+    if scenario == "duts":
+        return "GET", "/duts", None
+    if scenario == "txrx":
+        return "POST", "/dut/serial/txrx", {"dut_id": dut_id, "data": "ping", "timeout": 1}
+    if scenario == "script":
+        return "POST", "/dut/serial/script", {"dut_id": dut_id, "steps": [
+            {"send": "version", "expect": "OK"}, {"send": "status"}]}
+    return "POST", "/dut/flash", {"dut_id": dut_id, "firmware_path": "/fw/app.hex"}
+
+
+def _percentile(sorted_vals: List[float], p: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    k = min(len(sorted_vals) - 1, int(round(p / 100 * (len(sorted_vals) - 1))))
+    return round(sorted_vals[k], 3)
+
+
+def _summary(samples: List[Tuple[float, bool]], elapsed: float) -> dict:
+    latencies = sorted(ms for ms, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {**{f"p{p}": _percentile(latencies, p) for p in (50, 95, 99)},
+                       "max": round(latencies[-1], 3) if latencies else None},
+    }
+
+
+_GAUGE = re.compile(r"^(threadpool_\w+) (\S+)$", re.MULTILINE)
+
+
+class _Sampler(threading.Thread):
+    """Polls the threadpool_* gauges from /metrics."""
+
+    def __init__(self, host: str, interval: float) -> None:
+        super().__init__(daemon=True)
+        self.host, self.interval = host, interval
+        self.samples: List[Dict[str, float]] = []
+        self.stop = threading.Event()
+
+    def run(self) -> None:
+        conn = http.client.HTTPConnection(self.host, timeout=5)
+        while not self.stop.is_set():
+            try:
+                conn.request("GET", "/metrics")
+                text = conn.getresponse().read().decode()
+                self.samples.append({k: float(v) for k, v in _GAUGE.findall(text)})
+            except (OSError, http.client.HTTPException):
+                conn.close()
+            self.stop.wait(self.interval)
+        conn.close()
+
+    def report(self) -> dict:
+        samples = [s for s in self.samples if "threadpool_threads" in s]
+        if not samples:
+            return {"samples": 0}
+        busy = [s["threadpool_busy"] for s in samples]
+        waiting = [s["threadpool_waiting"] for s in samples]
+        threads = samples[-1]["threadpool_threads"]
+        return {
+            "samples": len(samples),
+            "threads": threads,
+            "busy_max": max(busy),
+            "busy_mean": round(sum(busy) / len(busy), 2),
+            "waiting_max": max(waiting),
+            "saturated_pct": round(100 * sum(1 for b in busy if b >= threads) / len(busy), 1),
+        }
+
+
+@dataclass
+class Report:
+    profile: Dict
+    pis: List[Dict]
+    seconds: float = 0.0
+    requests: int = 0
+    errors: int = 0
+    rps: float = 0.0
+    latency_ms: Dict[str, Optional[float]] = field(default_factory=dict)
+    scenarios: Dict[str, Dict] = field(default_factory=dict)
+    status_codes: Dict[str, int] = field(default_factory=dict)
+    threadpool: Dict[str, float] = field(default_factory=dict)
+
+
+def drive(url: str, dut_ids: List[str], load: LoadProfile) -> Report:
+    """Run `load.clients` client threads against a running host app at `url`."""
+    weights = parse_mix(load.mix)
+    names, cum = list(weights), []
+    total = 0.0
+    for name in names:
+        total += weights[name]
+        cum.append(total)
+    host = url.split("://", 1)[1]
+    results: List[List[Tuple[str, float, bool, str]]] = [[] for _ in range(load.clients)]
+    start = threading.Barrier(load.clients + 1)
+    deadline = [0.0]
+
+    def client(i: int) -> None:
+        rng = random.Random(load.seed * 1000 + i)
+        conn = http.client.HTTPConnection(host, timeout=30)
+        out = results[i]
+        start.wait()
+        while time.monotonic() < deadline[0]:
+            x = rng.random() * total
+            scenario = next(n for n, c in zip(names, cum) if x < c)
+            method, path, body = _request(scenario, rng.choice(dut_ids) if dut_ids else "none")
+            data = json.dumps(body).encode() if body is not None else None
+            headers = {"Content-Type": "application/json"} if data is not None else {}
+            t0 = time.perf_counter()
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                code = str(resp.status)
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                code = type(e).__name__
+            ms = (time.perf_counter() - t0) * 1000
+            out.append((scenario, ms, code.isdigit() and int(code) < 400, code))
+        conn.close()
+
+    sampler = _Sampler(host, load.sample_ms / 1000)
+    threads = [threading.Thread(target=client, args=(i,), daemon=True)
+               for i in range(load.clients)]
+    for t in threads:
+        t.start()
+    sampler.start()
+    t0 = time.monotonic()
+    deadline[0] = t0 + load.seconds
+    start.wait()
+    for t in threads:
+        t.join(load.seconds + 60)
+    elapsed = time.monotonic() - t0
+    sampler.stop.set()
+    sampler.join(5)
+
+    flat = [r for rs in results for r in rs]
+    report = Report(profile=asdict(load), pis=[], seconds=round(elapsed, 3))
+    overall = _summary([(ms, ok) for _, ms, ok, _ in flat], elapsed)
+    report.requests, report.errors = overall["requests"], overall["errors"]
+    report.rps, report.latency_ms = overall["rps"], overall["latency_ms"]
+    for name in names:
+        report.scenarios[name] = _summary(
+            [(ms, ok) for s, ms, ok, _ in flat if s == name], elapsed)
+    for *_, code in flat:
+        report.status_codes[code] = report.status_codes.get(code, 0) + 1
+    report.threadpool = sampler.report()
+    return report
+
+
+def run(load: LoadProfile, pi: Optional[PiProfile] = None,
+        env: Optional[Dict[str, str]] = None) -> Report:
+    """Start `load.pis` MockPis and the host app, drive the load, tear it all down."""
+    pi = pi or PiProfile()
+    pis = [MockPi(f"pi{i}", PiProfile(**{**asdict(pi), "seed": pi.seed + i})).start()
+           for i in range(load.pis)]
+    app = None
+    try:
+        dut_ids = [d["id"] for p in pis for d in p.duts]
+        # with injected failures a Pi may be marked down at any moment; don't wait on routes
+        app = HostApp([p.url for p in pis], env).start(routes=0 if pi.fail_rate else len(dut_ids))
+        report = drive(app.url, dut_ids, load)
+    finally:
+        if app is not None:
+            app.stop()
+        for p in pis:
+            p.stop()
+    report.pis = [{"url": p.url, **asdict(p.profile), "hits": p.hits, "failed": p.failed}
+                  for p in pis]
+    return report
+
+
+def compare(before: dict, after: dict) -> dict:
+    """Per scenario (and overall): each number before, after and the change in %."""
+    def delta(a, b):
+        if a is None or b is None:
+            return {"before": a, "after": b}
+        return {"before": a, "after": b,
+                "change_pct": round(100 * (b - a) / a, 1) if a else None}
+
+    def rows(x: dict, y: dict) -> dict:
+        out = {"rps": delta(x.get("rps"), y.get("rps")),
+               "errors": delta(x.get("errors"), y.get("errors"))}
+        for p, v in (y.get("latency_ms") or {}).items():
+            out[p] = delta((x.get("latency_ms") or {}).get(p), v)
+        return out
+
+    result = {"overall": rows(before, after)}
+    for name in after.get("scenarios", {}):
+        result[name] = rows(before.get("scenarios", {}).get(name, {}), after["scenarios"][name])
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    for profile in (LoadProfile(), PiProfile()):
+        for name, value in asdict(profile).items():
+            if name == "seed" and isinstance(profile, PiProfile):
+                continue
+            ap.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    ap.add_argument("--out", help="also write the report to this file")
+    ap.add_argument("--compare", help="report to compare against (e.g. from before a change)")
+    args = vars(ap.parse_args(argv))
+    out, baseline = args.pop("out"), args.pop("compare")
+    pi_fields = set(asdict(PiProfile()))
+    load = LoadProfile(**{k: v for k, v in args.items() if k not in pi_fields or k == "seed"})
+    pi = PiProfile(**{k: v for k, v in args.items() if k in pi_fields and k != "seed"})
+    report = asdict(run(load, pi))
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            report = {"report": report, "compare": compare(json.load(f), report)}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
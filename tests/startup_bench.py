@@ -0,0 +1,113 @@
+"""
+Cold-start benchmark for the host app.
+
+Measures, each in a fresh interpreter:
+
+- import: wall time of `import app.main`, and which heavy optional
+  modules (requests, serial, numpy, ...) that import dragged in;
+- first_200: time from spawning `uvicorn app.main:app` until GET /ping
+  first answers 200.
+
+    python tests/startup_bench.py --runs 5
+
+prints a JSON report with the median and max of each.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# modules only some endpoints need; importing the app must not load them
+HEAVY_MODULES = ("requests", "urllib3", "serial", "numpy")
+
+_IMPORT_SNIPPET = f"""
+import json, sys, time
+t0 = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"import_s": elapsed,
+                   "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def _env() -> Dict[str, str]:
+    # no heartbeats to lab Pis from a benchmark
+    return {**os.environ, "PI_HEARTBEAT_S": "0"}
+
+
+def measure_import() -> dict:
+    out = subprocess.run([sys.executable, "-c", _IMPORT_SNIPPET], cwd=ROOT, env=_env(),
+                         capture_output=True, text=True, check=True, timeout=60)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_first_200(timeout: float = 30.0) -> float:
+    """Seconds from process spawn to the first 200 from /ping."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/ping"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        while time.perf_counter() - t0 < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited: {proc.stderr.read().decode()[-2000:]}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - t0
+            except OSError:
+                time.sleep(0.005)
+        raise TimeoutError(f"/ping not up after {timeout}s")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        proc.stderr.close()
+
+
+def run(runs: int = 3) -> dict:
+    imports = [measure_import() for _ in range(runs)]
+    first = [measure_first_200() for _ in range(runs)]
+    import_s = [r["import_s"] for r in imports]
+    return {
+        "runs": runs,
+        "import_s": {"median": round(statistics.median(import_s), 4),
+                     "max": round(max(import_s), 4)},
+        "first_200_s": {"median": round(statistics.median(first), 4),
+                        "max": round(max(first), 4)},
+        "heavy_modules": sorted({m for r in imports for m in r["heavy"]}),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--runs", type=int, default=3)
+    args = ap.parse_args(argv)
+    print(json.dumps(run(args.runs), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
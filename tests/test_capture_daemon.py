@@ -0,0 +1,211 @@
+"""
+Capture daemon: shared-memory line rings and the control socket, with the
+daemon in a subprocess capturing a pseudo-terminal (no hardware required).
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from app.capture_client import CaptureClient, CaptureUnavailable
+from app.line_stream import sse_events
+from app.serial_io import SerialPool
+from app.shm_ring import ShmLineRing
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def _wait_for(pred, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_shm_ring_readers_see_lines_gaps_and_close():
+    ring = ShmLineRing(create=True, capacity=8, data_bytes=256)
+    reader = ShmLineRing(ring.name)
+    try:
+        ring.publish("t0", ["boot", "ready"])
+        assert reader.head == 2 and reader.read(0, 10) == [(1, "t0", "boot"), (2, "t0", "ready")]
+        assert reader.wait_after(2, 0.05) == []
+
+        # 20 more lines: the 8 index slots and the 256 data bytes both wrap
+        for i in range(20):
+            ring.publish(f"t{i + 1}", [f"line {i} " + "x" * 20])
+        entries = reader.read(0, 100)
+        seqs = [seq for seq, _, _ in entries]
+        assert seqs == list(range(seqs[0], 23)) and seqs[0] > reader.oldest
+        assert entries[-1] == (22, "t20", "line 19 " + "x" * 20)
+
+        ring.close()
+        assert reader.closed
+        with pytest.raises(FileNotFoundError):
+            ShmLineRing(ring.name)  # unlinked; mapped readers keep working
+        assert reader.read(21, 10)[0][0] == 22
+    finally:
+        reader.detach()
+        ring.detach()
+
+
+def test_sse_over_shm_ring_replays_and_ends():
+    ring = ShmLineRing(create=True, capacity=64, data_bytes=4096)
+    reader = ShmLineRing(ring.name)
+
+    async def collect():
+        events = []
+        async for chunk in sse_events(reader, since=0):
+            events.append(chunk)
+        return "".join(events)
+
+    async def run():
+        task = asyncio.create_task(collect())
+        await asyncio.sleep(0.05)
+        ring.publish("t", ["one", "two"])
+        await asyncio.sleep(0.05)
+        ring.close()
+        return await asyncio.wait_for(task, 5)
+
+    text = asyncio.run(run())
+    assert '"line": "one"' in text and '"line": "two"' in text and "event: end" in text
+    reader.detach()
+    ring.detach()
+
+
+
+def test_ring_unlinked_before_attach_is_a_missing_session(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from app import main
+
+    client = CaptureClient(str(tmp_path / "capture.sock"))
+    gone = ShmLineRing(create=True, capacity=8, data_bytes=1024)
+    gone.close()  # the daemon stopped the session between its reply and our attach
+    gone.detach()
+    replies = {"ring": {"shm": gone.name},
+               "capture_for_port": {"shm": gone.name, "baudrate": 115200}}
+    monkeypatch.setattr(client, "call", lambda op, timeout=None, **args: replies[op])
+
+    assert client.ring("job@tty0") is None
+    assert client.capture_for_port("/dev/tty0") is None
+    monkeypatch.setattr(main, "serial_logger", client)
+    r = TestClient(main.app).get("/serial/log/stream", params={"session_id": "job@tty0"})
+    assert r.status_code == 404
+
+@pytest.fixture
+def daemon(tmp_path):
+    sock = str(tmp_path / "capture.sock")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "app.capture_daemon", "--socket", sock,
+         "--log-dir", str(tmp_path / "logs")],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+    )
+    client = CaptureClient(sock, timeout=5)
+
+    def up():
+        try:
+            return client.call("ping")["pid"] == proc.pid
+        except CaptureUnavailable:
+            return False
+
+    assert _wait_for(up, 15), proc.stdout.read1().decode() if proc.poll() is not None else ""
+    yield client, proc, tmp_path
+    if proc.poll() is None:
+        proc.terminate()
+        proc.wait(10)
+    proc.stdout.close()
+
+
+def test_sessions_survive_clients_and_are_shared(daemon):
+    client, proc, tmp_path = daemon
+    master, slave = os.openpty()
+    port = os.ttyname(slave)
+    try:
+        # an "API worker" process starts the capture and exits
+        code = (f"from app.capture_client import CaptureClient\n"
+                f"print(CaptureClient({client.socket_path!r}).start('job1', {port!r}, 115200))\n")
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True,
+                             text=True, check=True, timeout=30).stdout
+        assert "serial logging started" in out
+
+        os.write(master, b"boot ok\nadc=17\n")
+        other = CaptureClient(client.socket_path)
+        ring = other.ring(f"job1@{port}")
+        assert _wait_for(lambda: ring.head >= 2)
+        assert [line for _, _, line in ring.read(0, 10)] == ["boot ok", "adc=17"]
+        status = client.status(f"job1@{port}")
+        assert status["running"] and status["lines"] == 2
+        assert status["stream"]["shm"] == ring.name
+        assert other.status()["sessions"] == client.status()["sessions"]
+
+        with pytest.raises(RuntimeError, match="already captured"):
+            client.start("job2", port, 115200)
+        with pytest.raises(ValueError):
+            client.start("job3", port, 115200, mode="bogus")
+        assert client.ring("nope@nowhere") is None
+    finally:
+        client.stop(job_id="job1")
+        os.close(master)
+        os.close(slave)
+    assert ring.closed
+    logs = os.listdir(tmp_path / "logs")
+    assert any(name.startswith("job1_") and name.endswith("_text.log") for name in logs)
+
+
+def test_txrx_and_triggers_through_the_daemon(daemon):
+    client, proc, _ = daemon
+    master, slave = os.openpty()
+    port = os.ttyname(slave)
+    stop = threading.Event()
+
+    def dut():
+        # answers every command written through the capture
+        buf = b""
+        while not stop.is_set():
+            try:
+                buf += os.read(master, 1024)
+            except OSError:
+                return
+            while b"\n" in buf:
+                cmd, buf = buf.split(b"\n", 1)
+                os.write(master, b"OK " + cmd + b"\n")
+
+    responder = threading.Thread(target=dut, daemon=True)
+    responder.start()
+    try:
+        client.start("job1", port, 115200)
+        sid = f"job1@{port}"
+        trigger = client.add_trigger(sid, "OK status")
+        assert trigger.status()["pattern"] == "OK status"
+
+        pool = SerialPool(capture=client)
+        reply = pool.txrx(port, "version", timeout=2)
+        assert reply["via"] == "capture" and reply["received"] == "OK version"
+        pool.txrx(port, "status", timeout=2)
+
+        engine = client.triggers(sid)
+        hit = asyncio.run(engine.wait_async(after=0, timeout=3))
+        assert hit["line"] == "OK status" and hit["trigger_id"] == trigger.id
+        assert [t["hits"] for t in client.triggers(sid).list()] == [1]
+        assert engine.remove(trigger.id) and client.triggers(sid).list() == []
+    finally:
+        client.stop(job_id="job1")
+        stop.set()
+        os.close(slave)
+        os.close(master)
+        responder.join(2)
+
+
+def test_unreachable_daemon_and_sigterm(daemon, tmp_path):
+    client, proc, _ = daemon
+    proc.terminate()
+    assert proc.wait(10) == 0
+    assert not os.path.exists(client.socket_path)
+    with pytest.raises(CaptureUnavailable):
+        client.status()
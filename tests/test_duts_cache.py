@@ -0,0 +1,133 @@
+"""
+/duts cache: TTL, stale-while-revalidate, coalesced misses and ETags.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.duts_cache import DutsCache
+from app.pi_client import PiClient
+
+
+def _pi(duts, delay=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            server = self.server
+            with server.lock:
+                server.gets += 1
+            time.sleep(server.delay)
+            etag = f'"v{server.version}"'
+            if self.headers.get("If-None-Match") == etag:
+                server.not_modified += 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = json.dumps([{"id": d} for d in server.duts]).encode()
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.duts, server.delay, server.version = list(duts), delay, 1
+    server.gets = server.not_modified = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.fixture
+def pi():
+    server, url = _pi(["a1", "a2"], delay=0.2)
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+
+def _cache(url, **kw):
+    return DutsCache(PiClient(hosts=[url], connect_timeout=0.5, timeout=1.0), **kw)
+
+
+def test_concurrent_misses_share_one_request(pi):
+    server, url = pi
+    cache = _cache(url, ttl=5, stale=5)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get()))
+               for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert server.gets == 1
+    assert len({etag for etag, _ in results}) == 1
+    assert all(sorted(d["id"] for d in r["duts"]) == ["a1", "a2"] for _, r in results)
+
+    # within the TTL the Pi isn't asked again
+    for _ in range(50):
+        cache.get()
+    assert server.gets == 1
+
+
+def test_stale_is_served_while_revalidating(pi):
+    server, url = pi
+    cache = _cache(url, ttl=0.1, stale=5)
+    etag, _ = cache.get()
+    time.sleep(0.15)
+
+    t0 = time.monotonic()
+    stale_etag, result = cache.get()
+    assert time.monotonic() - t0 < 0.1  # didn't wait for the 0.2 s Pi
+    assert stale_etag == etag and result["pis"][0]["ok"]
+
+    deadline = time.monotonic() + 2
+    while server.gets < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.3)
+    assert server.not_modified == 1  # revalidated with If-None-Match
+    assert cache.get()[0] == etag
+
+    server.duts, server.version = ["a1", "a3"], 2
+    time.sleep(0.15)
+    cache.get()  # stale: starts the refresh
+    time.sleep(0.4)
+    etag2, result = cache.get()
+    assert etag2 != etag
+    assert sorted(d["id"] for d in result["duts"]) == ["a1", "a3"]
+
+
+def test_failed_pi_is_not_retried_every_poll():
+    cache = _cache("http://127.0.0.1:9", ttl=0.5, stale=0)
+    calls = []
+    real = cache._fetch
+    cache._fetch = lambda *a: (calls.append(1), real(*a))
+    for _ in range(10):
+        _, result = cache.get()
+        assert result["pis"][0]["ok"] is False and result["pis"][0]["error"]
+    assert len(calls) == 1
+
+
+def test_duts_endpoint_supports_conditional_requests(pi, monkeypatch):
+    server, url = pi
+    monkeypatch.setattr(main, "duts_cache", _cache(url, ttl=5, stale=5))
+    monkeypatch.setattr(main.pi_registry, "hosts", lambda: [url])
+    client = TestClient(main.app)
+
+    r = client.get("/duts")
+    assert r.status_code == 200 and r.headers["etag"]
+    r2 = client.get("/duts", headers={"If-None-Match": r.headers["etag"]})
+    assert r2.status_code == 304
+    assert server.gets == 1
@@ -0,0 +1,99 @@
+"""
+Firmware cache tests, including the flash short-circuit (no hardware required).
+"""
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.firmware_store import FirmwareStore
+
+
+def test_hash_is_memoized_until_file_changes(tmp_path):
+    fw = tmp_path / "app.out"
+    fw.write_bytes(b"\x7fELF" + b"\0" * 4096)
+    store = FirmwareStore(str(tmp_path / "store"))
+
+    first = store.sha256(str(fw))
+    assert store.sha256(str(fw)) == first
+    assert (store.hash_misses, store.hash_hits) == (1, 1)
+
+    fw.write_bytes(b"\x7fELF" + b"\1" * 4096)
+    os.utime(fw, ns=(time.time_ns(), time.time_ns() + 1_000_000))
+    assert store.sha256(str(fw)) != first
+    assert store.hash_misses == 2
+
+
+def test_put_is_content_addressed(tmp_path):
+    store = FirmwareStore(str(tmp_path / "store"))
+    a, b = tmp_path / "a.hex", tmp_path / "b.hex"
+    a.write_bytes(b"same image")
+    b.write_bytes(b"same image")
+    da, pa = store.put(str(a))
+    db, pb = store.put(str(b))
+    assert da == db and pa == pb and pa.endswith(".hex")
+    assert open(pa, "rb").read() == b"same image"
+
+
+def test_flash_skips_when_dut_already_has_image(tmp_path, monkeypatch):
+    fake_openocd = tmp_path / "openocd"
+    fake_openocd.write_text("#!/bin/sh\necho programmed\n")
+    fake_openocd.chmod(0o755)
+    fw = tmp_path / "fw.bin"
+    fw.write_bytes(b"firmware v1")
+
+    monkeypatch.setenv("ALLOW_FLASH", "1")
+    monkeypatch.setenv("FLASH_TOOL", "openocd")
+    monkeypatch.setenv("OPENOCD_PATH", str(fake_openocd))
+    monkeypatch.setenv("OPENOCD_CFG", "interface/xds110.cfg")
+    monkeypatch.setattr(main, "firmware_store", FirmwareStore(str(tmp_path / "store")))
+
+    body = {"dut_id": "dut1", "firmware_path": str(fw)}
+    with TestClient(main.app) as client:
+        def done(job):
+            deadline = time.monotonic() + 5
+            while (state := client.get(f"/dut/flash/jobs/{job['job_id']}").json()["state"]) \
+                    in ("queued", "running"):
+                assert time.monotonic() < deadline
+                time.sleep(0.02)
+            return state
+
+        first = client.post("/dut/flash", json=body).json()
+        assert first["executed"] and done(first) == "succeeded"
+
+        again = client.post("/dut/flash", json=body).json()
+        assert done(again) == "skipped" and again["sha256"] == first["sha256"]
+
+        forced = client.post("/dut/flash", json={**body, "force": True}).json()
+        assert done(forced) == "succeeded"
+
+        # v2 queued ahead of a v1 request: v1 is decided after v2 ran, so it flashes
+        fw2 = tmp_path / "fw2.bin"
+        fw2.write_bytes(b"firmware v2")
+        v2 = client.post("/dut/flash", json={**body, "firmware_path": str(fw2)}).json()
+        v1 = client.post("/dut/flash", json=body).json()
+        assert done(v2) == "succeeded" and done(v1) == "succeeded"
+        assert main.firmware_store.is_current("dut1", first["sha256"])
+
+
+def test_prune_keeps_flashed_and_pinned_images(tmp_path):
+    store = FirmwareStore(str(tmp_path / "store"), max_bytes=2500)
+    paths = []
+    for i in range(4):
+        p = tmp_path / f"fw{i}.bin"
+        p.write_bytes(bytes([i]) * 1000)
+        paths.append(str(p))
+    d0, _ = store.put(paths[0])
+    store.record_flash("dut1", d0, paths[0])
+    d1, _ = store.put(paths[1], pin=True)
+    time.sleep(0.01)
+    d2, _ = store.put(paths[2])
+    time.sleep(0.01)
+    d3, _ = store.put(paths[3])  # 4000 bytes > 2500: the oldest prunable (d2) goes
+
+    objects = {n.split(".")[0] for n in os.listdir(tmp_path / "store" / "objects")}
+    assert objects == {d0, d1, d3} and store.pruned == 1
+    store.unpin(d1)
+    store.prune()
+    assert {n.split(".")[0] for n in os.listdir(tmp_path / "store" / "objects")} == {d0, d3}
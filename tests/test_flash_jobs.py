@@ -0,0 +1,96 @@
+"""
+Flash job scheduler tests with stand-in flash commands (no hardware required).
+"""
+import asyncio
+import sys
+import time
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.firmware_store import FirmwareStore
+from app.flash_jobs import FlashScheduler
+
+
+def _fake_flash(seconds, rc=0):
+    return [sys.executable, "-c",
+            "import sys, time\n"
+            "print('erasing', flush=True)\n"
+            f"time.sleep({seconds})\n"
+            "print('verify ok', flush=True)\n"
+            "print('warn: slow probe', file=sys.stderr)\n"
+            f"sys.exit({rc})"]
+
+
+def test_different_probes_run_in_parallel_same_probe_serializes():
+    async def run():
+        sched = FlashScheduler(max_parallel=8)
+        t0 = time.monotonic()
+        jobs = [sched.submit(_fake_flash(0.4), probe=f"probe{i}") for i in range(6)]
+        for job in jobs:
+            await sched.wait(job.id)
+        parallel = time.monotonic() - t0
+
+        t0 = time.monotonic()
+        same = [sched.submit(_fake_flash(0.2), probe="shared") for _ in range(3)]
+        for job in same:
+            await sched.wait(job.id)
+        serial = time.monotonic() - t0
+        return jobs, parallel, same, serial
+
+    jobs, parallel, same, serial = asyncio.run(run())
+    assert all(j.state == "succeeded" and j.status()["ok"] for j in jobs + same)
+    assert parallel < 1.2
+    assert serial >= 0.6
+    # stdout and stderr interleave in arrival order
+    assert sorted(jobs[0].tail()) == ["[stderr] warn: slow probe", "erasing", "verify ok"]
+
+
+def test_failure_timeout_and_cancel():
+    async def run():
+        sched = FlashScheduler(timeout_s=1.0)
+        failed = sched.submit(_fake_flash(0, rc=3), probe="a")
+        slow = sched.submit(_fake_flash(5), probe="b")
+        running = sched.submit([sys.executable, "-c", "import time; time.sleep(5)"], probe="c")
+        queued = sched.submit(_fake_flash(0), probe="c")
+        await sched.wait(failed.id)
+        await asyncio.sleep(0.1)
+        await sched.cancel(queued.id)
+        await sched.cancel(running.id)
+        await sched.wait(slow.id)
+        return failed, slow, running, queued
+
+    failed, slow, running, queued = asyncio.run(run())
+    assert failed.state == "failed" and failed.returncode == 3
+    assert slow.state == "failed" and "timed out" in slow.error
+    assert running.state == "cancelled" and running.returncode is not None
+    assert queued.state == "cancelled" and queued.started is None
+
+
+def test_flash_lock_is_the_probe_the_command_targets(tmp_path, monkeypatch):
+    tool = tmp_path / "flashtool"
+    tool.write_text("#!/bin/sh\necho \"$@\"\n")
+    tool.chmod(0o755)
+    fw = tmp_path / "fw.bin"
+    fw.write_bytes(b"firmware")
+    monkeypatch.setenv("ALLOW_FLASH", "1")
+    monkeypatch.setenv("OPENOCD_PATH", str(tool))
+    monkeypatch.setenv("OPENOCD_CFG", "interface/xds110.cfg")
+    monkeypatch.setenv("DSLITE_PATH", str(tool))
+    monkeypatch.setenv("CCXML_PATH", "board.ccxml")
+    monkeypatch.setattr(main, "probe_serial", {"dut1": "L1100A", "dut2": "L1100B"}.get)
+    monkeypatch.setattr(main, "firmware_store", FirmwareStore(str(tmp_path / "store")))
+
+    with TestClient(main.app) as client:
+        def flash(dut_id, tool_name):
+            return client.post("/dut/flash", json={"dut_id": dut_id, "firmware_path": str(fw),
+                                                   "tool": tool_name, "force": True}).json()
+
+        a, b = flash("dut1", "openocd"), flash("dut2", "openocd")
+        assert (a["probe"], b["probe"]) == ("L1100A", "L1100B")
+        assert a["command"][-4:-2] == ["-c", "adapter serial L1100A"]
+        # no serial known, or a tool that can't pick a probe: the shared default
+        assert flash("dut3", "openocd")["probe"] == "default"
+        c, d = flash("dut1", "dslite"), flash("dut2", "dslite")
+        assert c["probe"] == d["probe"] == "default"
+        assert not any("L1100" in arg for arg in c["command"])
@@ -0,0 +1,66 @@
+"""
+Ring buffer fan-out tests (no hardware required).
+"""
+import asyncio
+import json
+
+from app.line_stream import LineRing, sse_events
+
+
+def _lines(chunks):
+    out = []
+    for chunk in chunks:
+        for block in chunk.split("\n\n"):
+            if "event: line" in block:
+                out.append(json.loads(block.split("data: ", 1)[1])["seq"])
+    return out
+
+
+def test_ring_overwrites_oldest():
+    ring = LineRing(capacity=4)
+    ring.publish("t", [f"l{i}" for i in range(1, 7)])
+    assert ring.head == 6 and ring.oldest == 3
+    assert [e[0] for e in ring.read(0, 10)] == [3, 4, 5, 6]
+    assert [e[2] for e in ring.read(4, 10)] == ["l5", "l6"]
+
+
+def test_resume_and_live_lines_then_end():
+    async def run():
+        ring = LineRing(capacity=100)
+        ring.publish("t", ["a", "b", "c"])
+        chunks = []
+
+        async def consume():
+            async for chunk in sse_events(ring, since=1):
+                chunks.append(chunk)
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        # publish from another thread, as the reactor does
+        await asyncio.to_thread(ring.publish, "t", ["d"])
+        await asyncio.sleep(0.01)
+        ring.close()
+        await asyncio.wait_for(task, 1)
+        return chunks
+
+    chunks = asyncio.run(run())
+    assert _lines(chunks) == [2, 3, 4]
+    assert "event: end" in chunks[-1]
+
+
+def test_slow_subscriber_is_disconnected_without_blocking_publish():
+    async def run():
+        ring = LineRing(capacity=1000)
+        gen = sse_events(ring, since=0, max_lag=10)
+        ring.publish("t", ["x"])
+        first = await gen.__anext__()
+        # the subscriber stalls while the producer races ahead
+        ring.publish("t", [str(i) for i in range(50)])
+        rest = [c async for c in gen]
+        return ring, first, rest
+
+    ring, first, rest = asyncio.run(run())
+    assert _lines([first]) == [1]
+    assert "event: lagged" in rest[-1]
+    assert ring.slow_disconnects == 1
+    assert ring.status()["subscribers"] == []
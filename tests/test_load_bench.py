@@ -0,0 +1,73 @@
+"""
+API load harness: stand-in Pis and a short end-to-end run.
+
+A small profile so it stays quick in CI; run tests/load_bench.py directly
+for real numbers.
+"""
+import json
+import shutil
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from load_bench import LoadProfile, MockPi, PiProfile, compare, parse_mix, run
+
+
+def _get(url, headers=None):
+    req = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.status, resp.headers, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_mock_pi_latency_failures_and_etag():
+    pi = MockPi("pi0", PiProfile(duts=3, latency_ms=50)).start()
+    flaky = MockPi("pi1", PiProfile(duts=1, latency_ms=0, fail_rate=1.0)).start()
+    try:
+        t0 = time.monotonic()
+        code, headers, body = _get(pi.url + "/duts")
+        assert time.monotonic() - t0 >= 0.05
+        duts = json.loads(body)
+        assert code == 200 and [d["id"] for d in duts] == ["mock-pi0-00", "mock-pi0-01", "mock-pi0-02"]
+        assert duts[0]["description"].endswith("(MOCK)")
+        assert _get(pi.url + "/duts", {"If-None-Match": headers["ETag"]})[0] == 304
+
+        assert _get(flaky.url + "/duts")[0] == 503
+        assert _get(flaky.url + "/ping")[0] == 200  # liveness is never failed
+        assert flaky.failed == 1 and pi.hits == {"/duts": 2}
+    finally:
+        pi.stop()
+        flaky.stop()
+
+
+def test_parse_mix_and_compare():
+    assert parse_mix("duts=3, flash") == {"duts": 3.0, "flash": 1.0}
+    with pytest.raises(ValueError):
+        parse_mix("dust=1")
+    before = {"rps": 100.0, "errors": 0, "latency_ms": {"p99": 20.0},
+              "scenarios": {"duts": {"rps": 50.0, "errors": 0, "latency_ms": {"p99": 10.0}}}}
+    after = {"rps": 150.0, "errors": 2, "latency_ms": {"p99": 10.0},
+             "scenarios": {"duts": {"rps": 50.0, "errors": 0, "latency_ms": {"p99": 5.0}}}}
+    diff = compare(before, after)
+    assert diff["overall"]["rps"]["change_pct"] == 50.0
+    assert diff["overall"]["p99"]["change_pct"] == -50.0
+    assert diff["duts"]["p99"] == {"before": 10.0, "after": 5.0, "change_pct": -50.0}
+
+
+@pytest.mark.skipif(shutil.which("uvicorn") is None, reason="uvicorn not installed")
+def test_short_run_routes_every_scenario_to_the_pis():
+    report = run(LoadProfile(clients=8, seconds=1.0, pis=2), PiProfile(duts=4, latency_ms=2))
+    assert report.requests > 0 and report.errors == 0
+    assert set(report.scenarios) == {"duts", "txrx", "script", "flash"}
+    assert all(s["requests"] > 0 for s in report.scenarios.values())
+    assert report.latency_ms["p50"] <= report.latency_ms["p95"] <= report.latency_ms["p99"]
+    # generous: a loaded CI box still answers well within this
+    assert report.latency_ms["p99"] < 2000
+    # serial and flash requests were served by the owning Pis, not locally
+    hits = [p["hits"] for p in report.pis]
+    assert all(h.get("/dut/serial/txrx") and h.get("/dut/flash") for h in hits)
+    assert report.threadpool["samples"] > 0 and report.threadpool["threads"] > 0
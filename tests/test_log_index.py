@@ -0,0 +1,68 @@
+"""
+Sparse text-log index and range query tests (no hardware required).
+"""
+import os
+from datetime import datetime, timedelta
+
+from app.log_index import build_index, index_path_for, load_index, read_range
+from app.log_writer import LogSink
+
+T0 = datetime(2025, 1, 1, 10, 0, 0)
+
+
+def _epoch(dt):
+    return (dt - datetime(1970, 1, 1)).total_seconds()
+
+
+def _write_log(path, n):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            ts = (T0 + timedelta(seconds=i)).isoformat()
+            f.write(f"[{ts}] seq={i} {'HardFault' if i % 500 == 0 else 'ok'}\n")
+
+
+def test_lazy_index_and_time_window(tmp_path):
+    path = str(tmp_path / "soak_20250101_100000_text.log")
+    _write_log(path, 40000)
+
+    start = _epoch(T0 + timedelta(seconds=1000))
+    res = read_range(path, start, start + 5)
+    assert os.path.exists(index_path_for(path))
+    assert [line.split()[1] for line in res["lines"]] == [f"seq={i}" for i in range(1000, 1005)]
+    # the index keeps the read to a small slice of the file
+    assert res["scanned_bytes"] < os.path.getsize(path) / 10
+
+
+def test_regex_within_window(tmp_path):
+    path = str(tmp_path / "soak_20250101_100000_text.log")
+    _write_log(path, 5000)
+    build_index(path, stride=1024)
+
+    res = read_range(path, _epoch(T0 + timedelta(seconds=900)),
+                     _epoch(T0 + timedelta(seconds=2100)), pattern=r"Hard\w+")
+    assert [line.split()[1] for line in res["lines"]] == ["seq=1000", "seq=1500", "seq=2000"]
+
+    res = read_range(path, pattern="HardFault", limit=2)
+    assert len(res["lines"]) == 2 and res["truncated"]
+
+
+def test_sink_writes_index_during_capture(tmp_path):
+    text = str(tmp_path / "j_20250101_100000_text.log")
+    sink = LogSink(text, str(tmp_path / "j_20250101_100000_vars.csv"), vars_store=False)
+    sink.index._stride = 256
+    for i in range(200):
+        sink.append((T0 + timedelta(seconds=i)).isoformat(), [f"line {i}"])
+        if i % 50 == 49:
+            sink.flush()
+    sink.close()
+
+    ts, offsets = load_index(text)
+    assert len(ts) > 10
+    with open(text, "rb") as f:
+        data = f.read()
+    for epoch, off in zip(ts, offsets):
+        assert data[off:off + 1] == b"["
+        assert off == 0 or data[off - 1:off] == b"\n"
+
+    res = read_range(text, _epoch(T0 + timedelta(seconds=150)), _epoch(T0 + timedelta(seconds=152)))
+    assert [line.split("] ")[1] for line in res["lines"]] == ["line 150", "line 151"]
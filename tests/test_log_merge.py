@@ -0,0 +1,215 @@
+"""
+Timestamp-ordered merge of several logs, finished and live (no hardware required).
+"""
+import asyncio
+import inspect
+import json
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import log_merge
+from app import main
+from app.line_stream import LineRing
+from app.log_merge import SessionSource, job_source, merge, session_source
+from app.log_writer import LogSink
+
+T0 = datetime(2025, 1, 1, 10, 0, 0)
+
+
+def _epoch(dt):
+    return (dt - datetime(1970, 1, 1)).total_seconds()
+
+
+def _write(log_dir, job_id, ticks, compress=False, rotate_bytes=0):
+    """One line per tick (seconds after T0) through the real LogSink."""
+    base = f"{log_dir}/{job_id}_20250101_100000"
+    sink = LogSink(base + "_text.log", base + "_vars.csv", vars_store=False,
+                   compress=compress, rotate_bytes=rotate_bytes)
+    if compress:
+        sink._text_file._frame_bytes = 512  # several gzip members
+    for t in ticks:
+        sink.append((T0 + timedelta(seconds=t)).isoformat(), [f"{job_id} tick={t}"])
+        sink.flush()
+        sink.maybe_rotate()
+    sink.close()
+
+
+def _ticks(records):
+    return [(r["source"], int(r["line"].split("=")[1])) for r in records]
+
+
+def test_merges_plain_gzip_and_rotated_logs_in_order(tmp_path):
+    _write(tmp_path, "a", range(0, 300, 3))
+    _write(tmp_path, "b", range(1, 300, 3), compress=True)
+    _write(tmp_path, "c", range(2, 300, 3), rotate_bytes=1024)
+    assert len(log_merge.find_text_logs(str(tmp_path), "c")) > 2
+
+    sources = [job_source(j, log_dir=str(tmp_path)) for j in "abc"]
+    got = _ticks(merge(sources))
+    assert [t for _, t in got] == list(range(300))
+    assert [s for s, _ in got[:6]] == ["a", "b", "c", "a", "b", "c"]
+
+    start, end = _epoch(T0 + timedelta(seconds=100)), _epoch(T0 + timedelta(seconds=160))
+    sources = [job_source(j, start, end, str(tmp_path)) for j in "abc"]
+    got = _ticks(merge(sources, pattern=r"tick=1\d5$", exclude="^b "))
+    assert got == [("a", 105), ("c", 125), ("a", 135), ("c", 155)]
+
+    got = list(merge([job_source(j, log_dir=str(tmp_path)) for j in "ab"],
+                     predicate=lambda source, line: source == "b" and line.endswith("=4")))
+    assert got == [{"ts": (T0 + timedelta(seconds=4)).isoformat(), "source": "b",
+                    "line": "b tick=4"}]
+
+    with pytest.raises(FileNotFoundError):
+        job_source("nope", log_dir=str(tmp_path))
+
+
+def test_memory_is_bounded_by_sources_not_log_size(tmp_path):
+    for k, job in enumerate("abcd"):
+        path = tmp_path / f"{job}_20250101_100000_text.log"
+        with open(path, "w") as f:
+            for i in range(k, 120000, 4):
+                f.write(f"[{(T0 + timedelta(milliseconds=i)).isoformat()}] {job} {'x' * 60}\n")
+    total = sum(p.stat().st_size for p in tmp_path.iterdir())
+
+    tracemalloc.start()
+    try:
+        n = sum(1 for _ in merge([job_source(j, log_dir=str(tmp_path)) for j in "abcd"]))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert n == 120000
+    assert total > 10_000_000 and peak < 1_000_000
+
+
+def test_live_session_continues_its_log_without_duplicates(tmp_path):
+    text = str(tmp_path / "live_20250101_100000_text.log")
+    sink = LogSink(text, str(tmp_path / "live_20250101_100000_vars.csv"), vars_store=False)
+    ring = LineRing()
+    now = datetime.utcnow()
+    # 3 lines flushed to the log, the 4th (same batch) and 5th only in the ring so far
+    batches = [(now - timedelta(seconds=3), ["boot", "ready"]),
+               (now - timedelta(seconds=2), ["rx 1", "rx 2"]),
+               (now - timedelta(seconds=1), ["rx 3"])]
+    for dt, lines in batches:
+        ring.publish(dt.isoformat(), lines)
+    sink.append(batches[0][0].isoformat(), batches[0][1])
+    sink.append(batches[1][0].isoformat(), batches[1][1][:1])
+    sink.flush()
+
+    class Logger:
+        def ring(self, session_id):
+            return ring if session_id == "live@tty0" else None
+
+        def status(self, session_id):
+            return {"job_id": "live", "text_path": text}
+
+    finished = tmp_path / "old_20250101_100000_text.log"
+    finished.write_text("".join(f"[{(now - timedelta(seconds=s)).isoformat()}] old {s}\n"
+                                for s in (3.5, 1.5, 0.5)))
+    session = session_source(Logger(), "live@tty0", lag=0.1)
+    with pytest.raises(KeyError):
+        session_source(Logger(), "gone@tty1")
+
+    out = []
+    merged = merge([job_source("old", log_dir=str(tmp_path)), session], lag=0.1)
+    reader = threading.Thread(target=lambda: out.extend(merged))
+    reader.start()
+    time.sleep(0.3)
+    # nothing newer than the idle session's lag is emitted yet: "old 0.5" is, the rest waits
+    assert [r["line"] for r in out] == ["old 3.5", "boot", "ready", "rx 1", "rx 2",
+                                        "old 1.5", "rx 3", "old 0.5"]
+    ring.publish(datetime.utcnow().isoformat(), ["rx 4"])
+    ring.close()
+    reader.join(5)
+    assert not reader.is_alive()
+    assert [r["line"] for r in out][-1] == "rx 4"
+    assert {r["source"] for r in out} == {"old", "live@tty0"}
+    sink.close()
+
+
+def test_idle_live_session_holds_back_newer_lines():
+    ring = LineRing()
+    ring.publish(datetime.utcnow().isoformat(), ["first"])
+    later = SessionSource("s2", LineRing(), lag=0.2)
+    later._ring.publish((datetime.utcnow() + timedelta(seconds=0.5)).isoformat(), ["future"])
+    later._ring.close()
+
+    merged = merge([SessionSource("s1", ring, lag=0.2), later], lag=0.2, idle=0.05)
+    assert next(merged)["line"] == "first"
+    # s1 is idle and "future" isn't 0.2 s in the past yet: heartbeats until it is
+    t0 = time.monotonic()
+    rec = next(merged)
+    assert rec is None
+    while rec is None:
+        rec = next(merged)
+    assert rec["line"] == "future" and time.monotonic() - t0 >= 0.5
+    ring.close()
+    assert list(merged) == []
+
+
+
+def test_async_merge_leaves_the_loop_free_while_waiting(tmp_path):
+    _write(tmp_path, "a", [0, 1])
+    ring = LineRing()
+    sources = [job_source("a", log_dir=str(tmp_path)), SessionSource("live", ring, lag=0.05)]
+
+    async def run():
+        out, ticks = [], 0
+
+        async def follow():
+            async for rec in log_merge.amerge(sources, lag=0.05, idle=0.05):
+                out.append(rec)
+
+        task = asyncio.create_task(follow())
+        # the loop keeps running while the merge waits on the idle session
+        while len(out) < 3:
+            ticks += 1
+            await asyncio.sleep(0.01)
+        ring.publish(datetime.utcnow().isoformat(), ["rx"])
+        ring.close()
+        await asyncio.wait_for(task, 5)
+        return out, ticks
+
+    out, ticks = asyncio.run(run())
+    assert [r["line"] for r in out if r is not None] == ["a tick=0", "a tick=1", "rx"]
+    assert None in out and ticks > 3
+    assert inspect.iscoroutinefunction(main.serial_log_merge)
+
+def test_merge_endpoint_streams_ndjson_and_text(tmp_path, monkeypatch):
+    _write(tmp_path, "a", range(0, 10, 2))
+    _write(tmp_path, "b", range(1, 10, 2), compress=True)
+    monkeypatch.setattr(main, "LOG_DIR", str(tmp_path))
+    client = TestClient(main.app)
+
+    r = client.get("/serial/log/merge", params={"jobs": "a,b", "start": "1735725602",
+                                                 "pattern": "tick=[2-6]"})
+    assert r.status_code == 200 and r.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert _ticks(rows) == [("a", 2), ("b", 3), ("a", 4), ("b", 5), ("a", 6)]
+
+    r = client.get("/serial/log/merge", params={"jobs": "b,a", "end": "2025-01-01T10:00:02",
+                                                 "format": "text"})
+    assert r.text.splitlines() == ["[2025-01-01T10:00:00] [a] a tick=0",
+                                   "[2025-01-01T10:00:01] [b] b tick=1"]
+
+    assert client.get("/serial/log/merge").status_code == 400
+    assert client.get("/serial/log/merge", params={"jobs": "a", "pattern": "("}).status_code == 400
+    assert client.get("/serial/log/merge", params={"jobs": "a,zz"}).status_code == 404
+    assert client.get("/serial/log/merge", params={"sessions": "x@y"}).status_code == 404
+
+
+def test_cli(tmp_path, capsys):
+    _write(tmp_path, "a", [0, 2])
+    _write(tmp_path, "b", [1])
+    assert log_merge.main(["a", "b", "--log-dir", str(tmp_path)]) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        "[2025-01-01T10:00:00] [a] a tick=0",
+        "[2025-01-01T10:00:01] [b] b tick=1",
+        "[2025-01-01T10:00:02] [a] a tick=2"]
+    assert log_merge.main(["a", "missing", "--log-dir", str(tmp_path)]) == 1
+    assert "missing" in capsys.readouterr().err
@@ -0,0 +1,147 @@
+"""
+Compressed output, segment rotation and disk budget tests (no hardware required).
+"""
+import gzip
+import os
+import time
+from datetime import datetime, timedelta
+
+from app.log_index import find_text_logs, load_index, read_range, read_segments
+from app.log_writer import LogSink, LogWriter, enforce_budget
+
+T0 = datetime(2025, 1, 1, 10, 0, 0)
+
+
+def _epoch(dt):
+    return (dt - datetime(1970, 1, 1)).total_seconds()
+
+
+def _fill(sink, n, per_flush=100):
+    for i in range(n):
+        sink.append((T0 + timedelta(milliseconds=10 * i)).isoformat(),
+                    [f"tick={i} vbat=3.{i % 100:02d} temp=41.{i % 7} state=RUN"])
+        if i % per_flush == per_flush - 1:
+            sink.flush()
+            sink.maybe_rotate()
+
+
+def _sink(tmp_path, run="soak_20250101_100000", **kw):
+    return LogSink(str(tmp_path / f"{run}_text.log"), str(tmp_path / f"{run}_vars.csv"),
+                   vars_store=False, **kw)
+
+
+def test_gzip_members_are_seekable_and_compact(tmp_path):
+    sink = _sink(tmp_path, compress=True)
+    sink._text_file._frame_bytes = 16 * 1024
+    _fill(sink, 20000)
+    raw = sink.raw_bytes
+    sink.close()
+
+    text = str(tmp_path / "soak_20250101_100000_text.log.gz")
+    with gzip.open(text, "rt") as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 20000 and lines[0].endswith("tick=0 vbat=3.00 temp=41.0 state=RUN")
+    with gzip.open(str(tmp_path / "soak_20250101_100000_vars.csv.gz"), "rt") as f:
+        assert f.readline() == "ts_utc,line\n"
+
+    disk = os.path.getsize(text) + os.path.getsize(str(tmp_path / "soak_20250101_100000_vars.csv.gz"))
+    assert raw / disk >= 5
+
+    # one index record per member; a window only inflates the members it overlaps
+    ts, offsets = load_index(text)
+    assert len(ts) > 5 and offsets[0] == 0
+    start = _epoch(T0 + timedelta(seconds=100))
+    res = read_range(text, start, start + 0.05, pattern=r"state=RUN")
+    assert [line.split()[1] for line in res["lines"]] == [f"tick={i}" for i in range(10000, 10005)]
+    assert res["scanned_bytes"] < os.path.getsize(text) / 3
+
+
+def test_unfinished_member_is_readable(tmp_path):
+    sink = _sink(tmp_path, compress=True)
+    _fill(sink, 250)  # flushed with a sync flush, member still open
+    text = sink.text_path
+    res = read_range(text)
+    assert len(res["lines"]) == 200
+    sink.close()
+
+
+def test_rotation_by_size_and_segment_reads(tmp_path):
+    sink = _sink(tmp_path, rotate_bytes=32 * 1024)
+    _fill(sink, 5000)
+    assert sink.rotations >= 5
+    sink.close()
+
+    paths = find_text_logs(str(tmp_path), "soak")
+    assert len(paths) == sink.rotations + 1
+    assert paths[0].endswith("_text.log") and paths[1].endswith("_text.001.log")
+    assert os.path.exists(str(tmp_path / "soak_20250101_100000_vars.001.csv"))
+
+    start = _epoch(T0 + timedelta(seconds=5))
+    res = read_segments(paths, start, start + 40)
+    ticks = [int(line.split()[1][5:]) for line in res["lines"]]
+    assert ticks == list(range(500, 4500))
+    assert len(res["files"]) > 1
+
+
+def test_budget_deletes_oldest_closed_segments(tmp_path):
+    old = _sink(tmp_path, run="old_20250101_090000", rotate_bytes=16 * 1024)
+    _fill(old, 2000)
+    old.close()
+    sink = _sink(tmp_path, rotate_bytes=16 * 1024)
+    _fill(sink, 2000)
+
+    deleted = enforce_budget(str(tmp_path), {sink.segment_key}, sink.run,
+                             job_budget=40 * 1024, dir_budget=0)
+    assert deleted and all(run == sink.run for run, _ in deleted)
+    assert sink.segment_key not in deleted
+    remaining = find_text_logs(str(tmp_path), "soak")
+    assert sink.text_path in remaining
+    assert not os.path.exists(str(tmp_path / "soak_20250101_100000_text.idx"))
+
+    # global budget: the other run's segments go first (oldest)
+    deleted = enforce_budget(str(tmp_path), {sink.segment_key}, None,
+                             job_budget=0, dir_budget=20 * 1024)
+    assert ("old_20250101_090000", 0) in deleted
+    assert os.path.exists(sink.text_path)
+    sink.close()
+
+
+def test_budget_counts_vars_stores_and_raw_captures(tmp_path):
+    old = LogSink(str(tmp_path / "old_20250101_090000_text.log"),
+                  str(tmp_path / "old_20250101_090000_vars.csv"), vars_store=True)
+    _fill(old, 2000)
+    old.close()
+    (tmp_path / "old_20250101_090000_raw.bin").write_bytes(b"\0" * 64 * 1024)
+    assert os.path.isdir(tmp_path / "old_20250101_090000_vars")
+    past = time.time() - 3600
+    for path in tmp_path.rglob("old_*"):
+        os.utime(path, (past, past))
+
+    writer = LogWriter()
+    sink = writer.open(str(tmp_path / "soak_20250101_100000_text.log"),
+                       str(tmp_path / "soak_20250101_100000_vars.csv"))
+    raw = writer.open_raw(str(tmp_path / "soak_20250101_100000_raw.bin"), "/dev/tty0", 1, 115200)
+    for i in range(2000):
+        writer.submit(sink, (T0 + timedelta(milliseconds=10 * i)).isoformat(),
+                      [f"tick={i} vbat=3.{i % 100:02d}"])
+        writer.submit(raw, time.monotonic_ns(), b"x" * 64)
+    writer.flush(sink)
+    writer.flush(raw)
+
+    # the closed run's store and capture are the bulk of the directory: evicted,
+    # while the live run's store and raw file count but stay
+    deleted = enforce_budget(str(tmp_path), {sink.segment_key, raw.segment_key}, None,
+                             job_budget=0, dir_budget=64 * 1024)
+    assert {("old_20250101_090000", "vars"), ("old_20250101_090000", "raw")} <= set(deleted)
+    assert not os.path.exists(tmp_path / "old_20250101_090000_vars")
+    assert not os.path.exists(tmp_path / "old_20250101_090000_raw.bin")
+    assert os.path.isdir(tmp_path / "soak_20250101_100000_vars")
+    assert os.path.exists(raw.path) and os.path.exists(sink.text_path)
+
+    # the writer counts its open raw sinks as active; once closed, everything goes
+    assert raw.segment_key in {s.segment_key for s in writer._sinks}
+    writer.close(sink)
+    writer.close(raw)
+    assert ("soak_20250101_100000", "raw") in enforce_budget(
+        str(tmp_path), set(), "soak_20250101_100000", job_budget=1, dir_budget=0)
+    assert not [p for p in os.listdir(tmp_path) if p.startswith("soak_")]
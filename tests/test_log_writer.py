@@ -0,0 +1,72 @@
+"""
+Group-commit writer tests (no hardware required).
+"""
+import time
+
+from app.log_writer import LogSink, LogWriter
+from app.vars_store import read_columns
+
+
+TS = "2025-01-01T00:00:00"
+
+
+def _paths(tmp_path):
+    return str(tmp_path / "j_text.log"), str(tmp_path / "j_vars.csv")
+
+
+def test_lines_are_held_until_interval_then_flushed(tmp_path):
+    writer = LogWriter(flush_bytes=1 << 20, flush_interval_ms=150)
+    text, vars_ = _paths(tmp_path)
+    sink = writer.open(text, vars_)
+
+    writer.submit(sink, "2025-01-01T00:00:00", ["a=1", "b=2"])
+    time.sleep(0.03)
+    assert open(text).read() == ""
+
+    time.sleep(0.4)
+    assert open(text).read().splitlines() == [
+        "[2025-01-01T00:00:00] a=1",
+        "[2025-01-01T00:00:00] b=2",
+    ]
+    assert writer.stats()["flushes"] == 1
+    writer.close(sink)
+
+
+def test_size_threshold_flushes_early(tmp_path):
+    writer = LogWriter(flush_bytes=256, flush_interval_ms=60_000)
+    text, vars_ = _paths(tmp_path)
+    sink = writer.open(text, vars_)
+
+    writer.submit(sink, TS, ["x" * 300])
+    deadline = time.monotonic() + 2
+    while sink.lines_written == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sink.lines_written == 1
+    writer.close(sink)
+
+
+def test_close_is_an_explicit_flush(tmp_path):
+    writer = LogWriter(flush_bytes=1 << 20, flush_interval_ms=60_000)
+    text, vars_ = _paths(tmp_path)
+    sink = writer.open(text, vars_)
+    for n in range(50):
+        writer.submit(sink, TS, [f"n={n}"])
+
+    assert writer.close(sink)
+    assert len(open(vars_).read().splitlines()) == 51  # header + 50
+    assert read_columns(sink.store.path)["n"] == [float(n) for n in range(50)]
+
+
+def test_full_queue_counts_backpressure_and_drops(tmp_path):
+    writer = LogWriter(queue_size=2, put_timeout_ms=1)
+    text, vars_ = _paths(tmp_path)
+    # writer thread not started yet, so nothing drains the queue
+    sink = LogSink(text, vars_)
+
+    results = [writer.submit(sink, TS, ["l1", "l2"]) for _ in range(4)]
+    assert results == [True, True, False, False]
+    stats = writer.stats()
+    assert stats["backpressure_events"] == 2
+    assert stats["dropped_batches"] == 2
+    assert stats["dropped_lines"] == 4
+    assert sink.lines_dropped == 4
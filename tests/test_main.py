@@ -21,4 +21,21 @@ def test_serial_echo_endpoint():
     assert r.status_code == 200
     resp = r.json()
     echoed = base64.b64decode(resp["echoed_b64"])
-    assert echoed == b"hi"
\ No newline at end of file
+    assert echoed == b"hi"
+
+def test_serial_vars_endpoints(tmp_path, monkeypatch):
+    from app import main
+    from app.vars_store import VarsStore
+    store = VarsStore(str(tmp_path / "soak_20250101_000000_vars"))
+    store.append(1000.0, ["temp=20 rssi=-70"])
+    store.append(1001.0, ["temp=21"])
+    store.close()
+    monkeypatch.setattr(main, "LOG_DIR", str(tmp_path))
+
+    r = client.get("/serial/vars/soak")
+    assert r.json()["columns"] == ["rssi", "temp"]
+    assert r.json()["rows"] == 2
+
+    r = client.get("/serial/vars/soak/data", params={"names": "temp", "start": "1000.5"})
+    assert r.json() == {"ts": [1001.0], "temp": [21.0]}
+    assert client.get("/serial/vars/missing").status_code == 404
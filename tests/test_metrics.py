@@ -0,0 +1,66 @@
+"""
+Prometheus exposition and hot-path instrumentation tests (no hardware required).
+"""
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+from app import main, metrics
+from app.serial_logger import SerialLogger
+
+
+def _wait_for(pred, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_counter_and_histogram_exposition():
+    c = metrics.counter("test_widgets_total", "Widgets made", ("kind",))
+    h = metrics.histogram("test_op_seconds", "Op time", buckets=(0.1, 1.0))
+    c.labels("round").inc()
+    c.labels("round").inc(2)
+    h.observe(0.05)
+    h.observe(0.5)
+    h.observe(5)
+
+    text = metrics.render()
+    assert "# TYPE test_widgets_total counter" in text
+    assert 'test_widgets_total{kind="round"} 3' in text
+    assert "# TYPE test_op_seconds histogram" in text
+    assert 'test_op_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_op_seconds_bucket{le="1"} 2' in text
+    assert 'test_op_seconds_bucket{le="+Inf"} 3' in text
+    assert "test_op_seconds_count 3" in text
+    assert "test_op_seconds_sum 5.55" in text
+
+
+def test_serial_counters_survive_stop(tmp_path):
+    logger = SerialLogger(log_dir=str(tmp_path))
+    master, slave = os.openpty()
+    port = os.ttyname(slave)
+    logger.start(job_id="m", port=port)
+    os.write(master, b"ok 1\n\xff\xfebad\nok 2\n")
+    assert _wait_for(lambda: logger.status()["sessions"][0]["lines"] == 3)
+    assert logger.status()["sessions"][0]["decode_errors"] == 1
+    logger.stop()
+
+    families = {f[0]: f[3] for f in logger.collect()}
+    assert families["serial_read_lines_total"] == [({"port": port}, 3)]
+    assert families["serial_decode_errors_total"] == [({"port": port}, 1)]
+    assert families["serial_read_bytes_total"][0][1] == 16
+    assert families["serial_reactor_errors_total"] == [({}, 0)]
+
+
+def test_metrics_endpoint():
+    client = TestClient(main.app)
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    for name in ("serial_read_bytes_total", "serial_log_flush_seconds",
+                 "serial_log_queue_depth", "pi_request_seconds", "flash_duration_seconds"):
+        assert f"# TYPE {name} " in r.text
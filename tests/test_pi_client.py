@@ -0,0 +1,79 @@
+"""
+Multi-Pi fan-out (through the /duts cache) against local stand-in Pi servers.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.duts_cache import DutsCache
+from app.pi_client import PiClient
+
+
+def _pi(duts, delay=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.server.peers.add(self.client_address)
+            time.sleep(delay)
+            body = json.dumps(duts).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.peers = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.fixture
+def pis():
+    servers = [
+        _pi([{"id": "a1"}, {"id": "a2"}], delay=0.3),
+        _pi([{"id": "b1"}], delay=0.3),
+        _pi([{"id": "c1"}], delay=5.0),  # too slow for the read timeout
+    ]
+    yield [url for _, url in servers], [server for server, _ in servers]
+    for server, _ in servers:
+        server.shutdown()
+
+
+def test_fan_out_is_concurrent_and_partial(pis):
+    pis, _ = pis
+    down = "http://127.0.0.1:9"  # nothing listens on discard
+    client = PiClient(hosts=pis + [down], connect_timeout=0.5, timeout=1.0)
+
+    t0 = time.monotonic()
+    _, result = DutsCache(client).get()
+    elapsed = time.monotonic() - t0
+
+    assert sorted((d["id"], d["pi"]) for d in result["duts"]) == [
+        ("a1", pis[0]), ("a2", pis[0]), ("b1", pis[1]),
+    ]
+    ok = {p["pi"]: p["ok"] for p in result["pis"]}
+    assert ok == {pis[0]: True, pis[1]: True, pis[2]: False, down: False}
+    # bounded by the slowest Pi's timeout, not the sum of all Pis
+    assert elapsed < 2.0
+
+
+def test_connections_are_reused(pis):
+    pis, servers = pis
+    # no TTL: after the first fetch every poll is stale and starts a refresh
+    cache = DutsCache(PiClient(hosts=pis[:1]), ttl=0.0, stale=60.0)
+    for _ in range(3):
+        assert cache.get()[1]["pis"][0]["ok"]
+        deadline = time.monotonic() + 5
+        while cache.status()["pis"][0]["refreshing"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert cache.fetches == 3
+    # three requests, one keep-alive connection
+    assert len(servers[0].peers) == 1
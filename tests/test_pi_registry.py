@@ -0,0 +1,179 @@
+"""
+Pi registry: heartbeats, the dut_id -> Pi index, and request routing.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+from app import main
+from app.pi_client import PiClient
+from app.pi_registry import ROUTED_HEADER, AmbiguousDut, PiRegistry
+
+
+def _pi(duts):
+    """Stand-in Pi: /duts with ETags, and POSTs echoed back with their headers."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, code, body=None, headers=()):
+            data = json.dumps(body).encode() if body is not None else b""
+            self.send_response(code)
+            for k, v in headers:
+                self.send_header(k, v)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self.server.gets += 1
+            if self.server.failing:
+                return self._send(503, {"detail": "usb stack wedged"})
+            etag = f'"{len(self.server.duts)}-{",".join(self.server.duts)}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.server.not_modified += 1
+                return self._send(304, headers=[("ETag", etag)])
+            self._send(200, [{"id": d} for d in self.server.duts], [("ETag", etag)])
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            self.server.posts.append((self.path, body, self.headers.get(ROUTED_HEADER)))
+            if body.get("dut_id") == "broken":
+                return self._send(400, {"detail": "bad step"})
+            self._send(200, {"served_by": "pi", "path": self.path})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.duts = list(duts)
+    server.gets = server.not_modified = 0
+    server.failing = False
+    server.posts = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.fixture
+def lab():
+    servers = [_pi(["a1", "a2"]), _pi(["b1"])]
+    client = PiClient(hosts=[url for _, url in servers], connect_timeout=0.5, timeout=1.0)
+    registry = PiRegistry(client, interval=0, timeout=1.0)
+    yield registry, servers
+    for server, _ in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_heartbeat_builds_index_and_uses_etags(lab):
+    registry, [(a, a_url), (b, b_url)] = lab
+    assert registry.route("a1") is None  # nothing routed before the first heartbeat
+
+    registry.heartbeat()
+    assert registry.route("a1") == registry.route("a2") == a_url
+    assert registry.route("b1") == b_url
+    assert registry.route("zz") is None
+
+    registry.heartbeat()
+    assert (a.not_modified, b.not_modified) == (1, 1)
+
+    a.duts = ["a2", "a3"]
+    registry.heartbeat()
+    assert registry.route("a1") is None
+    assert registry.route("a3") == a_url
+    assert registry.route("b1") == b_url
+    assert registry.status()["routes"] == 3
+
+
+def test_unhealthy_pi_is_dropped_and_comes_back(lab):
+    registry, [(a, a_url), (b, b_url)] = lab
+    registry.heartbeat()
+    a.failing = True
+    registry.heartbeat()
+    assert registry.route("a1") is None
+    assert registry.route("b1") == b_url
+    pis = {p["pi"]: p for p in registry.status()["pis"]}
+    assert pis[a_url]["healthy"] is False and pis[a_url]["last_error"]
+
+    a.failing = False
+    registry.heartbeat()
+    assert registry.route("a1") == a_url
+
+    # a failed connect while forwarding drops a Pi without waiting for a beat
+    down = "http://127.0.0.1:9"
+    registry.register(down)
+    registry.observe(down, ["d1"])
+    assert registry.route("d1") == down
+    with pytest.raises(requests.ConnectionError):
+        registry.forward(down, "POST", "/dut/serial/txrx", json={})
+    assert registry.route("d1") is None
+
+    server, url = _pi(["c1"])
+    try:
+        assert registry.register(url) and not registry.register(url + "/")
+        registry.heartbeat()
+        assert registry.route("c1") == url
+        assert registry.unregister(url)
+        assert registry.route("c1") is None
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_requests_are_routed_to_owning_pi(lab, monkeypatch):
+    registry, [(a, a_url), _] = lab
+    registry.heartbeat()
+    monkeypatch.setattr(main, "pi_registry", registry)
+    client = TestClient(main.app)
+
+    r = client.post("/dut/serial/txrx", json={"dut_id": "a1", "data": "ver"})
+    assert r.status_code == 200
+    assert r.json() == {"served_by": "pi", "path": "/dut/serial/txrx", "pi": a_url}
+    path, body, routed = a.posts[-1]
+    assert body["dut_id"] == "a1" and routed == "1"
+
+    r = client.post("/dut/serial/script", json={"dut_id": "a2", "steps": [{"send": "x"}]})
+    assert r.json()["pi"] == a_url
+
+    r = client.post("/dut/flash", json={"dut_id": "a1", "firmware_path": "fw.bin"})
+    assert r.json()["path"] == "/dut/flash"
+
+    # errors from the Pi keep their status
+    registry.observe(a_url, ["a1", "a2", "broken"])
+    r = client.post("/dut/serial/script", json={"dut_id": "broken", "steps": []})
+    assert r.status_code == 400 and r.json()["detail"] == "bad step"
+
+    # an already-forwarded request is served locally, never bounced on
+    posts = len(a.posts)
+    client.post("/dut/serial/txrx", json={"dut_id": "a1", "data": "ver"},
+                headers={ROUTED_HEADER: "1"})
+    assert len(a.posts) == posts
+
+
+def test_same_dut_id_on_two_pis_is_ambiguous_until_qualified(lab, monkeypatch):
+    registry, [(a, a_url), (b, b_url)] = lab
+    a.duts, b.duts = ["_dev_ttyACM0", "a1"], ["_dev_ttyACM0"]
+    registry.heartbeat()
+    with pytest.raises(AmbiguousDut):
+        registry.route("_dev_ttyACM0")
+    assert registry.route(f"_dev_ttyACM0@{b_url}") == b_url
+    assert registry.status()["ambiguous"] == {"_dev_ttyACM0": sorted([a_url, b_url])}
+
+    monkeypatch.setattr(main, "pi_registry", registry)
+    client = TestClient(main.app)
+    r = client.post("/dut/serial/txrx", json={"dut_id": "_dev_ttyACM0", "data": "ver"})
+    assert r.status_code == 409 and f"_dev_ttyACM0@{a_url}" in r.json()["detail"]
+    r = client.post("/dut/serial/txrx", json={"dut_id": f"_dev_ttyACM0@{b_url}", "data": "ver"})
+    assert r.json()["pi"] == b_url and b.posts[-1][1]["dut_id"] == "_dev_ttyACM0"
+
+    # one Pi going down leaves the id routed to the other, whose beats stay 304
+    a.failing = True
+    registry.heartbeat()
+    registry.heartbeat()
+    assert registry.route("_dev_ttyACM0") == b_url and b.not_modified >= 2
+    r = client.post("/dut/serial/txrx", json={"dut_id": f"_dev_ttyACM0@{a_url}", "data": "ver"})
+    assert r.status_code == 503
@@ -0,0 +1,130 @@
+"""
+Raw binary capture and mmap reader tests (no hardware required).
+"""
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.raw_capture import RECORD, RawCapture, RawSink
+from app.serial_logger import SerialLogger
+
+
+def _wait_for(pred, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _capture(path, chunks):
+    sink = RawSink(str(path), "/dev/ttyFAKE", 7, 3000000)
+    for ts, data in chunks:
+        sink.append(ts, data)
+    sink.close()
+    return sink
+
+
+def test_round_trip_and_time_slice(tmp_path):
+    path = tmp_path / "bin_20250101_100000_raw.bin"
+    chunks = [(1_000 + 10 * i, bytes([i % 256]) * (i % 5 + 1) + b"\x00\n\xff") for i in range(1000)]
+    _capture(path, chunks)
+
+    with RawCapture(str(path)) as cap:
+        assert cap.meta["port"] == "/dev/ttyFAKE" and cap.meta["port_id"] == 7
+        assert len(cap) == 1000
+        assert [(t, d) for t, _, d in cap] == chunks
+        window = list(cap.slice(1_000 + 10 * 500, 1_000 + 10 * 503))
+        assert [t for t, _, _ in window] == [6000, 6010, 6020]
+        assert all(pid == 7 for _, pid, _ in window)
+        data, n, truncated = cap.read(1_000 + 10 * 998)
+        assert data == chunks[998][1] + chunks[999][1] and n == 2 and not truncated
+        _, n, truncated = cap.read(limit=20)
+        assert truncated and n < 5
+
+
+def test_torn_final_record_is_ignored(tmp_path):
+    path = tmp_path / "bin_20250101_100000_raw.bin"
+    _capture(path, [(1, b"abc"), (2, b"defg")])
+    with open(path, "ab") as f:
+        f.write(RECORD.pack(3, 100, 7, 0) + b"short")
+    with RawCapture(str(path)) as cap:
+        assert [d for _, _, d in cap] == [b"abc", b"defg"]
+
+    (tmp_path / "junk.bin").write_bytes(b"not a capture")
+    with pytest.raises(ValueError):
+        RawCapture(str(tmp_path / "junk.bin"))
+
+
+def test_logger_raw_mode_keeps_bytes_verbatim(tmp_path):
+    logger = SerialLogger(log_dir=str(tmp_path))
+    master, slave = os.openpty()
+    port = os.ttyname(slave)
+    logger.start(job_id="bin", port=port, baudrate=3000000, mode="raw")
+    payload = bytes(range(256)) * 64  # every byte value, incl. NUL/CR/LF
+    for i in range(0, len(payload), 1000):
+        os.write(master, payload[i:i + 1000])
+    sid = logger.status()["sessions"][0]["session_id"]
+    assert _wait_for(lambda: logger.status(sid)["bytes"] == len(payload))
+    st = logger.status(sid)
+    assert st["mode"] == "raw" and st["lines"] == 0
+    path = st["raw_path"]
+    # raw chunks are accounted apart from decoded lines
+    writer = logger.status()["writer"]
+    assert writer["enqueued_lines"] == 0
+    assert writer["enqueued_raw_bytes"] == len(payload)
+    assert writer["enqueued_raw_chunks"] >= 1
+    logger.stop()
+
+    with RawCapture(path) as cap:
+        assert cap.read()[0] == payload
+        stamps = [t for t, _, _ in cap]
+        assert stamps == sorted(stamps)
+
+    with pytest.raises(ValueError):
+        logger.start(job_id="bin", port=port, mode="hex")
+
+
+
+def test_txrx_on_a_raw_captured_port_is_refused(tmp_path, monkeypatch):
+    from app import serial_io
+    from app.raw_capture import PortInRawCapture
+
+    logger = SerialLogger(log_dir=str(tmp_path))
+    master, slave = os.openpty()
+    port = os.ttyname(slave)
+    logger.start(job_id="bin", port=port, mode="raw")
+    try:
+        pool = serial_io.SerialPool(capture=logger)
+        with pytest.raises(PortInRawCapture):
+            pool.txrx(port, "x", timeout=5.0)
+        monkeypatch.setattr(serial_io, "serial_pool", pool)
+        client = TestClient(main.app)
+        r = client.post("/dut/serial/txrx", json={"dut_id": port, "data": "x", "timeout": 5})
+        assert r.status_code == 409 and "raw capture" in r.json()["detail"]
+        r = client.post("/dut/serial/script", json={"dut_id": port, "steps": [{"send": "x"}]})
+        assert r.status_code == 409
+    finally:
+        logger.stop()
+        os.close(master)
+        os.close(slave)
+
+def test_raw_endpoint_slices_by_wall_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "LOG_DIR", str(tmp_path))
+    sink = RawSink(str(tmp_path / "tele_20250101_100000_raw.bin"), "/dev/ttyFAKE", 1, 3000000)
+    now = time.monotonic_ns()
+    sink.append(now - 2_000_000_000, b"old")
+    sink.append(now, b"new")
+    sink.close()
+
+    client = TestClient(main.app)
+    r = client.get("/serial/raw/tele")
+    assert r.status_code == 200 and r.content == b"oldnew"
+    assert r.headers["x-raw-chunks"] == "2"
+    r = client.get("/serial/raw/tele", params={"start": str(time.time() - 1)})
+    assert r.content == b"new"
+    assert client.get("/serial/raw/nope").status_code == 404
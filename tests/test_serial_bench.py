@@ -0,0 +1,28 @@
+"""
+SerialLogger throughput regression against virtual DUTs (no hardware required).
+
+A short, modest profile so it stays quick in CI; run tests/virtual_dut.py
+directly for real numbers.
+"""
+from virtual_dut import Profile, format_line, parse_line, run
+
+
+def test_line_format_round_trip():
+    raw = format_line(3, 42, 123456789, "adc=17 state=RUN").decode().strip()
+    assert parse_line(f"[2025-01-01T00:00:00] {raw}") == {
+        "port": 3, "seq": 42, "t": 123456789, "ok": True,
+    }
+    assert parse_line(raw.replace("adc=17", "adc=71"))["ok"] is False
+    assert parse_line("boot banner") is None
+
+
+def test_two_ports_capture_every_line(tmp_path):
+    report = run(Profile(ports=2, rate=2000, line_len=60, burst=20, seconds=1.0),
+                 log_dir=str(tmp_path))
+    assert report.lines_sent == 4000
+    assert report.lost == 0
+    assert report.corrupted == 0
+    assert report.duplicates == 0
+    assert report.latency_ms["p50"] is not None
+    # generous: a loaded CI box still delivers well within this
+    assert report.latency_ms["p99"] < 500
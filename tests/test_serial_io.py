@@ -0,0 +1,203 @@
+"""
+Serial pool tests against pseudo-terminals (no hardware required).
+"""
+import os
+import threading
+
+import pytest
+
+from app.serial_io import SerialPool
+from app.serial_logger import SerialLogger
+
+
+def _echo_dut(master, stop, prefix=b"ok "):
+    """Answer every received line with `prefix + line` until `stop` is set."""
+    buf = b""
+    while not stop.is_set():
+        try:
+            data = os.read(master, 1024)
+        except OSError:
+            return
+        buf += data
+        while b"\n" in buf:
+            line, buf = buf.split(b"\n", 1)
+            os.write(master, prefix + line.strip() + b"\r\n")
+
+
+@pytest.fixture
+def dut():
+    master, slave = os.openpty()
+    stop = threading.Event()
+    t = threading.Thread(target=_echo_dut, args=(master, stop), daemon=True)
+    t.start()
+    yield os.ttyname(slave)
+    stop.set()
+    os.write(slave, b"\n")
+
+
+def test_pool_reuses_port_and_reads_to_terminator(dut):
+    pool = SerialPool()
+    for i in range(20):
+        r = pool.txrx(dut, f"cmd{i}", timeout=1.0)
+        assert r["received"] == f"ok cmd{i}"
+        assert r["via"] == "pool"
+        # far below the old fixed 200 ms sleep
+        assert r["elapsed_ms"] < 150
+    status = pool.status()["ports"]
+    assert len(status) == 1 and status[0]["commands"] == 20 and status[0]["open"]
+
+
+def test_concurrent_callers_on_one_port_do_not_interleave(dut):
+    pool = SerialPool()
+    results = {}
+
+    def worker(n):
+        results[n] = pool.txrx(dut, f"w{n}", timeout=2.0)["received"]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == {n: f"ok w{n}" for n in range(8)}
+
+
+def test_idle_ports_are_closed(dut):
+    pool = SerialPool(idle_s=0.0)
+    pool.txrx(dut, "x")
+    assert pool.close_idle() == 1
+    assert pool.status()["ports"][0]["open"] is False
+
+
+def test_active_capture_is_shared_not_reopened(dut, tmp_path):
+    logger = SerialLogger(log_dir=str(tmp_path))
+    pool = SerialPool(capture=logger)
+    pool.txrx(dut, "before")
+    logger.start(job_id="cap", port=dut)
+    try:
+        # starting the capture made the pool let go of its handle
+        assert pool.status()["ports"][0]["open"] is False
+        r = pool.txrx(dut, "during", timeout=1.0)
+        assert r["via"] == "capture"
+        assert r["received"] == "ok during"
+    finally:
+        logger.stop()
+
+
+
+def test_unknown_ids_fall_back_uncached_or_404(monkeypatch):
+    from types import SimpleNamespace
+
+    from fastapi.testclient import TestClient
+    from serial.tools import list_ports
+
+    from app import main, serial_io
+
+    ports = ["/dev/ttyACM0", "/dev/ttyACM1"]
+    monkeypatch.setattr(list_ports, "comports",
+                        lambda: [SimpleNamespace(device=p) for p in ports])
+    monkeypatch.setattr(serial_io, "_serial_candidates", lambda: list(ports))
+    pool = SerialPool()
+    assert pool.resolve("_dev_ttyACM1") == "/dev/ttyACM1"
+    # two ports: an unknown id is ambiguous
+    assert pool.resolve("bench-dut") is None
+    ports.pop()
+    # one port: single-DUT fallback, but not remembered once a second port appears
+    assert pool.resolve("bench-dut") == "/dev/ttyACM0"
+    ports.append("/dev/ttyUSB0")
+    assert pool.resolve("bench-dut") is None
+    assert pool.resolve("_dev_ttyACM1") == "/dev/ttyACM1"  # exact matches stay cached
+
+    monkeypatch.setattr(serial_io, "serial_pool", pool)
+    client = TestClient(main.app)
+    r = client.post("/dut/serial/txrx", json={"dut_id": "bench-dut", "data": "x"})
+    assert r.status_code == 404
+    r = client.post("/dut/serial/script", json={"dut_id": "bench-dut", "steps": [{"send": "x"}]})
+    assert r.status_code == 404
+
+def _script_dut(master, stop):
+    """`id?` -> `id=<hex>`, `count N` -> N lines then `done`, else echo."""
+    buf = b""
+    while not stop.is_set():
+        try:
+            data = os.read(master, 1024)
+        except OSError:
+            return
+        buf += data
+        while b"\n" in buf:
+            line, buf = buf.split(b"\n", 1)
+            cmd = line.strip().decode()
+            if cmd == "id?":
+                os.write(master, b"id=c0ffee\r\n")
+            elif cmd.startswith("count "):
+                n = int(cmd.split()[1])
+                os.write(master, b"".join(b"n=%d\r\n" % i for i in range(n)) + b"done\r\n")
+            else:
+                os.write(master, b"ok " + line.strip() + b"\r\n")
+
+
+@pytest.fixture
+def script_dut():
+    master, slave = os.openpty()
+    stop = threading.Event()
+    threading.Thread(target=_script_dut, args=(master, stop), daemon=True).start()
+    yield os.ttyname(slave)
+    stop.set()
+    os.write(slave, b"\n")
+
+
+def test_script_runs_steps_with_expect_and_captures(script_dut):
+    pool = SerialPool()
+    steps = [
+        {"send": "id?", "expect": r"id=(?P<dev>\w+)"},
+        {"send": "use ${dev}", "expect": "^ok use c0ffee$"},
+        {"send": "count 5", "expect": "done", "capture": "all"},
+        {"send": "noop", "read": False},
+        {"send": "ping", "expect": "never", "timeout": 0.2, "on_fail": "continue"},
+        {"send": "again"},
+    ] + [{"send": f"s{i}", "expect": f"ok s{i}"} for i in range(200)]
+    res = pool.run_script(script_dut, steps)
+
+    assert res["steps_run"] == len(steps) and not res["ok"]  # step 4 failed, by design
+    assert res["vars"] == {"dev": "c0ffee"}
+    r = res["steps"]
+    assert r[0]["groups"] == {"dev": "c0ffee"}
+    assert r[1]["sent"] == "use c0ffee" and r[1]["ok"]
+    assert r[2]["lines"] == [f"n={i}" for i in range(5)] + ["done"]
+    assert r[3] == {"ok": True, "sent": "noop", "elapsed_ms": r[3]["elapsed_ms"], "index": 3}
+    assert r[4]["ok"] is False and "timed out" in r[4]["error"]
+    # the late "ok noop"/"ok ping" replies are skipped while expecting
+    assert r[5]["ok"] and r[5]["received"].startswith("ok ")
+    assert all(s["ok"] for s in r[6:])
+    assert pool.status()["ports"][0]["commands"] == len(steps)
+
+
+def test_script_aborts_on_failure_and_validates(script_dut):
+    pool = SerialPool()
+    res = pool.run_script(script_dut, [
+        {"send": "a", "expect": "nope", "timeout": 0.1},
+        {"send": "b"},
+    ])
+    assert res["ok"] is False and res["steps_run"] == 1
+    with pytest.raises(ValueError):
+        pool.run_script(script_dut, [{"send": "x", "expect": "("}])
+    with pytest.raises(ValueError):
+        pool.run_script(script_dut, [{"send": "x", "capture": "everything"}])
+
+
+def test_script_endpoint(script_dut):
+    from fastapi.testclient import TestClient
+    from app import main
+
+    client = TestClient(main.app)
+    r = client.post("/dut/serial/script", json={"dut_id": script_dut, "steps": [
+        {"send": "id?", "expect": r"id=(?P<dev>\w+)"},
+        {"send": "count 2", "expect": "done", "capture": "all", "timeout": 2},
+    ]})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["ok"] and body["vars"] == {"dev": "c0ffee"}
+    assert body["steps"][1]["lines"] == ["n=0", "n=1", "done"]
+    r = client.post("/dut/serial/script", json={"dut_id": script_dut,
+                                                "steps": [{"send": "x", "expect": "("}]})
+    assert r.status_code == 400
@@ -0,0 +1,91 @@
+"""
+SerialLogger tests against pseudo-terminals (no hardware required).
+"""
+import os
+import time
+
+import pytest
+
+from app.serial_logger import SerialLogger
+
+
+def _pty():
+    master, slave = os.openpty()
+    return master, slave, os.ttyname(slave)
+
+
+def _wait_for(pred, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def logger(tmp_path):
+    lg = SerialLogger(log_dir=str(tmp_path))
+    yield lg
+    lg.stop()
+
+
+def test_concurrent_sessions_capture_independently(logger):
+    ptys = [_pty() for _ in range(3)]
+    for i, (_, _, name) in enumerate(ptys):
+        logger.start(job_id=f"job{i}", port=name, baudrate=921600)
+
+    status = logger.status()
+    assert status["running"] is True
+    assert len(status["sessions"]) == 3
+
+    for i, (master, _, _) in enumerate(ptys):
+        os.write(master, b"".join(f"job{i} line {n}\n".encode() for n in range(100)))
+
+    assert _wait_for(lambda: all(s["lines"] == 100 for s in logger.status()["sessions"]))
+
+    paths = {s["job_id"]: s["text_path"] for s in logger.status()["sessions"]}
+    logger.stop()
+    for i in range(3):
+        with open(paths[f"job{i}"], encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        assert len(lines) == 100
+        assert all(f"job{i} line" in line for line in lines)
+
+
+def test_partial_lines_are_reassembled(logger):
+    master, _, name = _pty()
+    logger.start(job_id="frag", port=name)
+    sid = logger.status()["sessions"][0]["session_id"]
+
+    os.write(master, b"temp=2")
+    time.sleep(0.05)
+    os.write(master, b"1.5\n")
+    assert _wait_for(lambda: logger.status(sid)["lines"] == 1)
+
+    path = logger.status(sid)["vars_path"]
+    logger.stop(session_id=sid)
+    with open(path, encoding="utf-8") as f:
+        rows = f.read().splitlines()
+    assert rows[0] == "ts_utc,line"
+    assert rows[1].endswith(",temp=21.5")
+
+
+def test_stop_by_session_leaves_others_running(logger):
+    (_, _, a), (_, _, b) = _pty(), _pty()
+    logger.start(job_id="a", port=a)
+    logger.start(job_id="b", port=b)
+
+    msg = logger.stop(job_id="a")
+    assert "a@" in msg
+    remaining = logger.status()["sessions"]
+    assert [s["job_id"] for s in remaining] == ["b"]
+    assert logger.stop(job_id="a") == "serial logger not running"
+
+
+def test_port_cannot_be_shared_between_jobs(logger):
+    _, _, name = _pty()
+    logger.start(job_id="first", port=name)
+    assert "already running" in logger.start(job_id="first", port=name)
+    with pytest.raises(RuntimeError):
+        logger.start(job_id="second", port=name)
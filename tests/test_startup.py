@@ -0,0 +1,38 @@
+"""
+Cold-start budget: importing the app and serving the first /ping.
+
+Budgets can be loosened on slow machines with STARTUP_IMPORT_BUDGET_S /
+STARTUP_FIRST_200_BUDGET_S.
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from startup_bench import ROOT, measure_first_200, measure_import
+
+IMPORT_BUDGET_S = float(os.getenv("STARTUP_IMPORT_BUDGET_S", "1.5"))
+FIRST_200_BUDGET_S = float(os.getenv("STARTUP_FIRST_200_BUDGET_S", "3.0"))
+
+
+def test_import_is_fast_and_lazy():
+    result = min((measure_import() for _ in range(3)), key=lambda r: r["import_s"])
+    assert result["heavy"] == []
+    assert result["import_s"] < IMPORT_BUDGET_S
+
+
+@pytest.mark.skipif(shutil.which("uvicorn") is None, reason="uvicorn not installed")
+def test_time_to_first_ping():
+    assert min(measure_first_200() for _ in range(2)) < FIRST_200_BUDGET_S
+
+
+def test_settings_are_loaded_once_and_lazily():
+    code = (
+        "from app.core import config\n"
+        "assert config.get_settings.cache_info().currsize == 0\n"
+        "assert config.settings is config.settings is config.get_settings()\n"
+        "assert config.get_settings.cache_info().misses == 1\n"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, timeout=60)
@@ -0,0 +1,163 @@
+"""
+Trigger engine and wait-for tests, on pseudo-terminals (no hardware required).
+"""
+import os
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.serial_logger import SerialLogger
+from app.triggers import TriggerEngine
+
+
+def _wait_for(pred, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_combined_matcher_reports_every_trigger():
+    engine = TriggerEngine()
+    boot = engine.add("BOOT OK", literal=True)
+    fault = engine.add(r"HardFault|Assert\(\w+\)")
+    dotted = engine.add("v1.2*", literal=True)
+    for i in range(200):
+        engine.add(f"never-{i}", literal=True)
+
+    assert engine.scan("t0", ["noise", "v1.2* BOOT OK", "v102 nothing", "Assert(x)"]) == 3
+    hits = engine._hits
+    assert [h["trigger_id"] for h in hits] == [boot.id, dotted.id, fault.id]
+    assert engine.lines_scanned == 4
+    assert engine.wait([fault.id], after=0, timeout=0)["line"] == "Assert(x)"
+    assert engine.wait([boot.id], after=hits[-1]["seq"], timeout=0.05) is None
+
+    with pytest.raises(ValueError):
+        engine.add("(unclosed")
+    with pytest.raises(ValueError):
+        engine.add("x", action="explode")
+
+
+def test_patterns_that_cannot_be_combined_still_match():
+    engine = TriggerEngine()
+    engine.add("(?i)boot ok")  # global flag: not valid mid-alternation
+    engine.add("panic")
+    assert engine._matcher[0] is None
+    assert engine.scan("t0", ["Boot OK", "kernel panic"]) == 2
+
+
+
+def test_backreferences_fire_alongside_other_triggers():
+    engine = TriggerEngine()
+    ab = engine.add("(a)b")
+    cc = engine.add(r"(c)\1")
+    named = engine.add(r"(?P<d>d)(?P=d)")
+    # only (a)b goes into the combined alternation, which would renumber \1
+    assert engine._matcher[2] == (True, False, False)
+    assert engine.scan("t0", ["cc", "ab", "dd", "cd"]) == 3
+    assert (ab.hits, cc.hits, named.hits) == (1, 1, 1)
+    engine.add(r"\\1")  # escaped backslash, then a literal 1: poolable
+    assert engine._matcher[2][-1] is True
+
+@pytest.fixture
+def capture(tmp_path):
+    logger = SerialLogger(log_dir=str(tmp_path))
+    master, slave = os.openpty()
+    logger.start(job_id="trg", port=os.ttyname(slave))
+    sid = logger.status()["sessions"][0]["session_id"]
+    yield logger, master, sid
+    logger.stop()
+
+
+def test_wait_for_wakes_on_live_line(capture):
+    logger, master, sid = capture
+    trigger = logger.add_trigger(sid, "BOOT OK", literal=True)
+    result = {}
+
+    def waiter():
+        t0 = time.monotonic()
+        result["hit"] = logger.triggers(sid).wait([trigger.id], timeout=5)
+        result["elapsed"] = time.monotonic() - t0
+
+    t = threading.Thread(target=waiter)
+    t.start()
+    time.sleep(0.1)
+    os.write(master, b"booting\nBOOT OK v2\n")
+    t.join(5)
+    assert result["hit"]["line"] == "BOOT OK v2"
+    assert result["elapsed"] < 1.0
+
+
+def test_since_matches_lines_captured_before_registration(capture):
+    logger, master, sid = capture
+    os.write(master, b"early BOOT OK\n")
+    assert _wait_for(lambda: logger.status(sid)["lines"] == 1)
+    late = logger.add_trigger(sid, "BOOT OK", literal=True)
+    backfilled = logger.add_trigger(sid, "BOOT OK", literal=True, since=0)
+    assert late.hits == 0 and backfilled.hits == 1
+    assert backfilled.last_hit["line_seq"] == 1
+
+
+def test_actions_fail_job_and_stop_capture(capture):
+    logger, master, sid = capture
+    logger.add_trigger(sid, "HardFault", action="fail_job")
+    logger.add_trigger(sid, "END OF TEST", literal=True, action="stop_capture")
+    os.write(master, b"HardFault at 0x0800\n")
+    assert _wait_for(lambda: logger.status(sid).get("job_failed"))
+    assert "HardFault at 0x0800" in logger.status(sid)["job_failed"]
+
+    engine = logger.triggers(sid)
+    os.write(master, b"END OF TEST\n")
+    assert _wait_for(lambda: logger.status(sid)["running"] is False)
+    assert engine.closed
+    # a waiter on a stopped capture returns right away
+    assert engine.wait(after=engine.seq, timeout=5) is None
+
+
+def test_wait_endpoint_long_polls(capture, monkeypatch):
+    logger, master, sid = capture
+    monkeypatch.setattr(main, "serial_logger", logger)
+    client = TestClient(main.app)
+
+    r = client.post("/serial/triggers", json={"session_id": sid, "pattern": r"temp=(\d+)"})
+    assert r.status_code == 200
+    tid = r.json()["trigger_id"]
+    assert client.post("/serial/triggers", json={"session_id": sid, "pattern": "("}).status_code == 400
+
+    threading.Timer(0.2, lambda: os.write(master, b"temp=42\n")).start()
+    r = client.post("/serial/triggers/wait", json={"session_id": sid, "timeout": 5})
+    body = r.json()
+    assert body["matched"] and body["hit"]["trigger_id"] == tid and body["seq"] == 1
+
+    r = client.post("/serial/triggers/wait",
+                    json={"session_id": sid, "after": body["seq"], "timeout": 0.1})
+    assert r.json()["matched"] is False
+
+    assert client.get("/serial/triggers", params={"session_id": sid}).json()["triggers"][0]["hits"] == 1
+    assert client.delete(f"/serial/triggers/{tid}", params={"session_id": sid}).status_code == 200
+    assert client.post("/serial/triggers/wait",
+                       json={"session_id": "nope", "timeout": 0}).status_code == 404
+
+
+def test_wait_after_stop_capture_still_gets_the_hit(capture, monkeypatch):
+    logger, master, sid = capture
+    monkeypatch.setattr(main, "serial_logger", logger)
+    client = TestClient(main.app)
+    trigger = logger.add_trigger(sid, "END OF TEST", literal=True, action="stop_capture")
+    os.write(master, b"END OF TEST\n")
+    assert _wait_for(lambda: logger.status(sid)["running"] is False)
+
+    # the waiter arrives after the session is gone
+    r = client.post("/serial/triggers/wait", json={"session_id": sid, "timeout": 5})
+    body = r.json()
+    assert r.status_code == 200 and body["matched"] and body["closed"]
+    assert body["hit"]["trigger_id"] == trigger.id and body["hit"]["line"] == "END OF TEST"
+
+    monkeypatch.setattr("app.serial_logger.TRIGGER_RETAIN_S", 0)
+    assert client.post("/serial/triggers/wait",
+                       json={"session_id": sid, "timeout": 0}).status_code == 404
@@ -0,0 +1,69 @@
+"""
+DUT inventory cache tests with a fake /dev directory (no hardware required).
+"""
+import os
+import time
+
+from app.models.dut import DutModel
+from app.services.usb import DutInventory
+
+
+def _dut(device):
+    return DutModel(id=device.replace("/", "_"), bus="usb", device=device,
+                    vid="0451", pid="bef3", description="XDS110")
+
+
+def _wait_for(pred, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_built_once_then_updated_from_dev_events(tmp_path):
+    dev = str(tmp_path)
+    open(os.path.join(dev, "ttyACM0"), "w").close()
+    scans = []
+
+    def scan():
+        scans.append(1)
+        return [_dut(os.path.join(dev, n)) for n in sorted(os.listdir(dev))]
+
+    def probe(device):
+        return _dut(device) if os.path.exists(device) else None
+
+    inv = DutInventory(dev_dir=dev, scan=scan, probe=probe)
+    etag, duts = inv.snapshot()
+    assert [d.device for d in duts] == [os.path.join(dev, "ttyACM0")]
+    for _ in range(5):
+        assert inv.snapshot()[0] == etag
+    assert len(scans) == 1
+
+    # hotplug: a new node shows up, then the first one goes away
+    open(os.path.join(dev, "ttyACM1"), "w").close()
+    assert _wait_for(lambda: len(inv.snapshot()[1]) == 2)
+    os.remove(os.path.join(dev, "ttyACM0"))
+    assert _wait_for(lambda: [d.device for d in inv.snapshot()[1]] == [os.path.join(dev, "ttyACM1")])
+
+    # unrelated nodes are ignored
+    gen = inv.generation
+    open(os.path.join(dev, "null0"), "w").close()
+    time.sleep(0.1)
+    assert inv.generation == gen
+    assert inv.snapshot()[0] != etag
+    assert len(scans) == 1
+
+
+def test_falls_back_to_polling_without_watch(tmp_path, monkeypatch):
+    from app.services import usb
+    monkeypatch.setattr(usb.settings, "DUT_INVENTORY_POLL_S", 0.0)
+    found = [[_dut("/dev/ttyUSB0")]]
+    inv = DutInventory(scan=lambda: found[0], watch=False)
+
+    etag, _ = inv.snapshot()
+    assert inv.snapshot()[0] == etag  # same content -> same generation
+    found[0] = []
+    assert inv.snapshot()[1] == []
+    assert inv.snapshot()[0] != etag
@@ -40,11 +40,67 @@ def test_list_duts_with_mock_provider():
     assert [d.vid for d in devices] == ["1d6b", "0451"]
     assert devices[1].description.endswith("CC1352R1 Launchpad")
 
-def test_default_provider_handles_missing_lsusb(monkeypatch):
+def test_default_provider_handles_missing_lsusb(monkeypatch, tmp_path):
     import app.usbip as usbip
+    calls = []
     def boom(*a, **k):
+        calls.append(a)
         raise FileNotFoundError("lsusb not found")
     monkeypatch.setattr(usbip.subprocess, "check_output", boom)
-    # Should not raise; should return empty list
-    devices = usbip.list_duts()
+    # No sysfs under this root, so the lsusb fallback runs; should not raise
+    devices = usbip.list_duts(root=str(tmp_path / "no-sysfs"))
     assert devices == []
+    assert calls
+
+def _fake_sysfs(root):
+    """A /sys/bus/usb/devices tree with a root hub, a hub, an XDS110
+    (cdc_acm, two ttys) and an FTDI adapter (usb-serial)."""
+    base = root / "bus" / "usb" / "devices"
+
+    def node(name, **attrs):
+        d = base / name
+        d.mkdir(parents=True)
+        for k, v in attrs.items():
+            (d / k).write_text(v + "\n")
+        return d
+
+    node("usb1", idVendor="1d6b", idProduct="0002", bDeviceClass="09", busnum="1", devnum="1")
+    node("1-1", idVendor="2109", idProduct="3431", bDeviceClass="09", busnum="1", devnum="2")
+    node("1-1.2", idVendor="0451", idProduct="BEF3", bDeviceClass="ef", busnum="1",
+         devnum="5", serial="L1100WEU", manufacturer="Texas Instruments",
+         product="XDS110 (03.00.00.25) Embed with CMSIS-DAP")
+    (node("1-1.2:1.0") / "tty" / "ttyACM0").mkdir(parents=True)
+    (node("1-1.2:1.3") / "tty" / "ttyACM1").mkdir(parents=True)
+    node("1-1.3", idVendor="0403", idProduct="6001", bDeviceClass="00", busnum="1",
+         devnum="7", product="FT232R USB UART")
+    (node("1-1.3:1.0") / "ttyUSB0").mkdir()
+
+def test_sysfs_enumerator_joins_tty_and_serial(tmp_path):
+    import app.usbip as usbip
+    _fake_sysfs(tmp_path)
+    duts = usbip.list_duts_internal(root=str(tmp_path))
+    assert [d.port for d in duts] == ["1-1.2", "1-1.3"]
+
+    xds, ftdi = duts
+    assert xds.id == "0451:bef3:L1100WEU"
+    assert (xds.vendor_id, xds.product_id, xds.serial) == ("0451", "bef3", "L1100WEU")
+    assert (xds.bus, xds.device, xds.tty) == ("001", "005", "/dev/ttyACM0")
+    assert xds.description.startswith("Texas Instruments XDS110")
+
+    assert ftdi.serial is None and ftdi.id == "0403:6001@1-1.3"
+    assert ftdi.tty == "/dev/ttyUSB0"
+
+def test_list_duts_reads_sysfs_without_lsusb(tmp_path, monkeypatch):
+    import app.usbip as usbip
+    calls = []
+    def no_lsusb(*a, **k):
+        calls.append(a)
+        raise FileNotFoundError("lsusb not found")
+    monkeypatch.setattr(usbip.subprocess, "check_output", no_lsusb)
+    _fake_sysfs(tmp_path)
+    devices = usbip.list_duts(root=str(tmp_path))
+    assert [(d.vid, d.pid) for d in devices] == [("0451", "bef3"), ("0403", "6001")]
+    # the provider swallows exceptions, so check the call itself
+    assert calls == []
+    assert usbip.list_duts(root=str(tmp_path / "missing")) == []
+    assert len(calls) == 1  # no sysfs: lsusb is the fallback
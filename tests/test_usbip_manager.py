@@ -0,0 +1,183 @@
+"""
+USB/IP manager tests against a fake `usbip` script (no hardware, no root).
+
+The fake keeps its state in a directory: exportable devices in `devices`,
+bound ones as `sys/bus/usb/drivers/usbip-host/<busid>` (where the real
+driver shows them) and attachments as `ports/<n>`. Every bind/attach/
+detach sleeps for DELAY so concurrency shows in the timings.
+"""
+import asyncio
+import os
+import shutil
+import sys
+import textwrap
+import time
+
+from app.usbip_manager import UsbipManager, parse_list, parse_port
+
+DELAY = 0.5
+
+_FAKE = textwrap.dedent("""\
+    import os, shutil, sys, time
+    state, delay = {state!r}, {delay!r}
+    drv = os.path.join(state, "sys", "bus", "usb", "drivers", "usbip-host")
+    ports = os.path.join(state, "ports")
+    args = sys.argv[1:]
+    cmd, opt = args[0], dict(zip(args[1::2], args[2::2]))
+    if cmd == "list":
+        for line in open(os.path.join(state, "devices")).read().split():
+            busid, usb_id = line.split("=")
+            print(f" - busid {{busid}} ({{usb_id}})")
+            print(f"   Texas Instruments : unknown product ({{usb_id}})")
+            print()
+    elif cmd == "port":
+        print("Imported USB devices")
+        print("====================")
+        for n in sorted(os.listdir(ports), key=int):
+            target = open(os.path.join(ports, n, "target")).read()
+            host, busid = target.split("/")
+            print(f"Port {{int(n):02d}}: <Port in Use> at Full Speed(12Mbps)")
+            print("       Texas Instruments : unknown product (0451:bef3)")
+            print(f"       3-1 -> usbip://{{host}}:3240/{{busid}}")
+            print("           -> remote bus/dev 001/004")
+    elif cmd in ("bind", "unbind"):
+        time.sleep(delay)
+        path = os.path.join(drv, opt["-b"])
+        if cmd == "bind" and os.path.isdir(path):
+            sys.exit(f"usbip: error: device on busid {{opt['-b']}} is already bound to usbip-host")
+        if cmd == "bind":
+            os.makedirs(path)
+        elif os.path.isdir(path):
+            os.rmdir(path)
+        else:
+            sys.exit(f"usbip: error: device is not bound to usbip-host driver")
+    elif cmd == "attach":
+        time.sleep(delay)
+        if opt["-b"] in open(os.path.join(state, "fail")).read().split():
+            sys.exit("usbip: error: import device")
+        n = 0
+        while True:
+            try:
+                os.mkdir(os.path.join(ports, str(n)))
+                break
+            except FileExistsError:
+                n += 1
+        with open(os.path.join(ports, str(n), "target"), "w") as f:
+            f.write(opt["-r"] + "/" + opt["-b"])
+    elif cmd == "detach":
+        time.sleep(delay)
+        path = os.path.join(ports, opt["-p"])
+        if not os.path.isdir(path):
+            sys.exit(f"usbip: error: Port {{opt['-p']}} is not in use")
+        shutil.rmtree(path)
+    """)
+
+
+def _fake_usbip(tmp_path, devices=(), fail=()):
+    state = tmp_path / "usbip"
+    (state / "ports").mkdir(parents=True)
+    (state / "sys" / "bus" / "usb" / "drivers" / "usbip-host").mkdir(parents=True)
+    (state / "devices").write_text("\n".join(devices))
+    (state / "fail").write_text("\n".join(fail))
+    script = tmp_path / "usbip.py"
+    script.write_text(f"#!{sys.executable}\n" + _FAKE.format(state=str(state), delay=DELAY))
+    script.chmod(0o755)
+    return str(script), str(state)
+
+
+def _manager(tmp_path, **kw):
+    script, state = _fake_usbip(tmp_path, **kw)
+    return UsbipManager(bin=script, reconcile_s=0, sysfs_root=os.path.join(state, "sys")), state
+
+
+def test_parse_usbip_output():
+    listed = parse_list(" - busid 1-1.2 (0451:BEF3)\n   TI : XDS110 (0451:bef3)\n\n"
+                        " - busid 1-1.3 (1cbe:00fd)\n")
+    assert listed == {"1-1.2": ("0451", "bef3"), "1-1.3": ("1cbe", "00fd")}
+    ports = parse_port("Imported USB devices\n====================\n"
+                       "Port 00: <Port in Use> at Full Speed(12Mbps)\n"
+                       "       unknown vendor : unknown product (0451:bef3)\n"
+                       "       3-1 -> usbip://192.168.1.78:3240/1-1.2\n"
+                       "           -> remote bus/dev 001/004\n"
+                       "Port 08: <Port in Use> at High Speed(480Mbps)\n"
+                       "       5-1 -> usbip://[fe80::1]:3240/1-1.3\n")
+    assert ports == {("192.168.1.78", "1-1.2"): 0, ("fe80::1", "1-1.3"): 8}
+
+
+def test_attach_eight_in_one_round_and_reattach_after_reboot(tmp_path):
+    mgr, state = _manager(tmp_path)
+    busids = [f"1-1.{i}" for i in range(1, 9)]
+
+    async def run():
+        t0 = time.monotonic()
+        attached = await mgr.attach("http://10.0.0.5:8001", busids)
+        attach_s = time.monotonic() - t0
+
+        # the Pi reboots: every attachment drops, unnoticed until reattach looks
+        shutil.rmtree(os.path.join(state, "ports"))
+        os.mkdir(os.path.join(state, "ports"))
+        cached = [mgr.get(f"10.0.0.5/{b}").state for b in busids]
+
+        t0 = time.monotonic()
+        again = await mgr.reattach("10.0.0.5")
+        reattach_s = time.monotonic() - t0
+        unchanged = await mgr.attach("10.0.0.5", busids[:2])
+        return attached, attach_s, cached, again, reattach_s, unchanged
+
+    attached, attach_s, cached, again, reattach_s, unchanged = asyncio.run(run())
+    assert all(r["ok"] and r["state"] == "attached" for r in attached)
+    assert sorted(r["port"] for r in attached) == list(range(8))
+    assert [r["device"] for r in attached] == [f"10.0.0.5/{b}" for b in busids]
+    assert attach_s < 3 * DELAY  # eight in sequence: 8 * DELAY
+    assert cached == ["attached"] * 8
+    assert len(again) == 8 and all(r["ok"] and r["changed"] for r in again)
+    assert reattach_s < 3 * DELAY  # eight in sequence: 8 * DELAY
+    assert all(r["ok"] and not r["changed"] for r in unchanged)
+
+
+def test_bind_unbind_detach_and_reconcile(tmp_path):
+    mgr, state = _manager(tmp_path, devices=["1-1.2=0451:bef3", "1-1.3=1cbe:00fd"],
+                          fail=["1-1.9"])
+    drv = os.path.join(state, "sys", "bus", "usb", "drivers", "usbip-host")
+
+    async def run():
+        await mgr.reconcile()
+        before = {d.key: d.state for d in mgr.devices()}
+        os.mkdir(os.path.join(drv, "1-1.3"))  # bound behind the manager's back
+        bound = await mgr.bind(["1-1.2", "1-1.3"])
+        unbound = await mgr.unbind(["1-1.2"])
+
+        attached = await mgr.attach("10.0.0.5", ["1-1.2", "1-1.9"])
+        detached = await mgr.detach(["10.0.0.5/1-1.2", "10.0.0.5/nope"])
+        await mgr.reconcile()
+        return before, bound, unbound, attached, detached
+
+    before, bound, unbound, attached, detached = asyncio.run(run())
+    assert before == {"1-1.2": "unbound", "1-1.3": "unbound"}
+    # "already bound" counts as success
+    assert [(r["ok"], r["state"]) for r in bound] == [(True, "bound")] * 2
+    assert unbound[0]["ok"] and unbound[0]["state"] == "unbound"
+    assert mgr.get("1-1.3").status()["usb_id"] == "1cbe:00fd"
+
+    ok, failed = attached
+    assert ok["ok"] and ok["port"] == 0
+    assert not failed["ok"] and failed["state"] == "detached"
+    assert failed["error"] == "usbip: error: import device" and failed["returncode"] == 1
+
+    assert detached[0]["ok"] and detached[0]["state"] == "detached"
+    assert not detached[1]["ok"] and "no imported device" in detached[1]["error"]
+    assert mgr.get("10.0.0.5/1-1.2").want is False
+    assert mgr.get("1-1.3").state == "bound" and mgr.get("1-1.2").state == "unbound"
+    assert mgr.reconcile_error is None and mgr.reconciles == 2
+
+
+def test_missing_binary_is_reported_not_raised(tmp_path):
+    mgr = UsbipManager(bin=str(tmp_path / "no-usbip"), reconcile_s=0, sysfs_root=str(tmp_path))
+
+    async def run():
+        status = await mgr.reconcile()
+        return status, await mgr.bind(["1-1.2"])
+
+    status, (bound,) = asyncio.run(run())
+    assert "usbip list" in status["reconcile_error"] and "usbip port" in status["reconcile_error"]
+    assert not bound["ok"] and bound["state"] == "unbound" and bound["returncode"] is None
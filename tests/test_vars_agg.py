@@ -0,0 +1,132 @@
+"""
+Downsampling of vars store columns: bucket aggregates, cache and LTTB.
+"""
+import math
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main, vars_agg
+from app.vars_agg import AggregateCache, aggregate, lttb
+from app.vars_store import VarsStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    """1000 rows at 0.1 s: x is a ramp with one spike, y only on every 3rd row."""
+    path = str(tmp_path / "soak_20250101_000000_vars")
+    s = VarsStore(path)
+    for i in range(1000):
+        line = f"x={500 if i == 437 else i % 50}"
+        if i % 3 == 0:
+            line += f" y={i}"
+        s.append(1000.0 + i * 0.1, [line])
+    s.close()
+    return path
+
+
+def _brute(path, name, width):
+    from app.vars_store import read_columns
+
+    cols = read_columns(path, [name])
+    out = {}
+    for t, v in zip(cols["ts"], cols[name]):
+        if v is not None:
+            out.setdefault(math.floor(t / width), []).append(v)
+    return out
+
+
+def test_buckets_match_brute_force(store, monkeypatch):
+    monkeypatch.setattr(vars_agg, "VARS_AGG_CHUNK_ROWS", 37)  # buckets straddle chunks
+    for name in ("x", "y"):
+        res = aggregate(store, name, points=60, cache=AggregateCache())
+        width = res["resolution_s"]
+        assert width == 2.0  # 100 s / 60 points -> next power of two
+        expected = _brute(store, name, width)
+        assert [t / width for t in res["t"]] == sorted(expected)
+        for i, b in enumerate(sorted(expected)):
+            vals = expected[b]
+            assert res["count"][i] == len(vals)
+            assert res["min"][i] == min(vals) and res["max"][i] == max(vals)
+            assert res["mean"][i] == pytest.approx(sum(vals) / len(vals))
+            assert res["last"][i] == vals[-1]
+    assert max(aggregate(store, "x", points=60)["max"]) == 500
+
+
+def test_pan_and_zoom_reuse_cached_buckets(store):
+    cache = AggregateCache()
+    before = vars_agg._COMPUTED.value
+    first = aggregate(store, "x", 1000.0, 1040.0, points=20, cache=cache)
+    assert first["resolution_s"] == 2.0
+    computed = vars_agg._COMPUTED.value - before
+    assert computed == 20
+
+    # same view again: nothing recomputed
+    assert aggregate(store, "x", 1000.0, 1040.0, points=20, cache=cache) == first
+    assert vars_agg._COMPUTED.value - before == computed
+
+    # pan right by 10 s: only the 5 new buckets are computed
+    panned = aggregate(store, "x", 1010.0, 1050.0, points=20, cache=cache)
+    assert vars_agg._COMPUTED.value - before == computed + 5
+    assert panned["t"][:15] == first["t"][5:]
+    assert panned == aggregate(store, "x", 1010.0, 1050.0, points=20, cache=AggregateCache())
+    assert cache.status()["hits"] == 1
+
+
+def test_newest_bucket_is_not_cached(tmp_path):
+    path = str(tmp_path / "live_20250101_000000_vars")
+    s = VarsStore(path)
+    s.append(0.5, ["v=1"])
+    s.flush()
+    cache = AggregateCache()
+    assert aggregate(path, "v", 0.0, 4.0, points=4, cache=cache)["count"] == [1]
+    s.append(0.7, ["v=3"])
+    s.close()
+    res = aggregate(path, "v", 0.0, 4.0, points=4, cache=cache)
+    assert res["count"] == [2] and res["last"] == [3.0]
+
+
+def test_lttb_keeps_shape(store):
+    res = lttb(store, "x", points=50)
+    assert len(res["t"]) == 50
+    assert res["t"][0] == 1000.0 and res["t"][-1] == pytest.approx(1099.9)
+    assert res["t"] == sorted(res["t"])
+    assert 500.0 in res["v"]  # the spike survives
+    # fewer rows than points: everything comes back
+    assert len(lttb(store, "x", 1000.0, 1001.0, points=50)["t"]) == 10
+
+
+def test_two_points_means_first_and_last(store, tmp_path, monkeypatch):
+    res = lttb(store, "x", points=2)
+    assert res["t"] == [1000.0, pytest.approx(1099.9)] and res["v"] == [0.0, 49.0]
+    for points in (2, 3, 7):
+        for start, end in ((None, None), (1000.05, 1063.3), (1001.0, 1017.0)):
+            res = aggregate(store, "x", start, end, points=points, cache=AggregateCache())
+            assert 0 < len(res["t"]) <= points
+
+    monkeypatch.setattr(main, "LOG_DIR", str(tmp_path))
+    r = TestClient(main.app).get("/serial/vars/soak/downsample",
+                                 params={"name": "x", "points": 2, "mode": "lttb"})
+    assert r.status_code == 200 and r.json()["points"] == 2
+
+
+def test_downsample_endpoint(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "LOG_DIR", str(tmp_path))
+    client = TestClient(main.app)
+
+    r = client.get("/serial/vars/soak/downsample", params={"name": "x", "points": 100})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["mode"] == "agg" and 0 < body["points"] <= 100
+    assert sum(body["count"]) == 1000
+
+    r = client.get("/serial/vars/soak/downsample",
+                   params={"name": "y", "points": 20, "mode": "lttb", "start": "1050"})
+    assert r.status_code == 200 and r.json()["points"] == 20
+    assert r.json()["t"][0] >= 1050
+
+    assert client.get("/serial/vars/soak/downsample", params={"name": "nope"}).status_code == 404
+    assert client.get("/serial/vars/soak/downsample",
+                      params={"name": "x", "mode": "median"}).status_code == 400
+    assert client.get("/serial/vars/soak/downsample",
+                      params={"name": "x", "points": 1}).status_code == 400
@@ -0,0 +1,47 @@
+"""
+Columnar vars store tests (no hardware required).
+"""
+import math
+
+from app.vars_store import VarsStore, find_store, parse_vars, read_columns
+
+
+def test_parse_vars_numeric_only():
+    assert parse_vars("temp=21.5 rssi=-73 state=IDLE vbat = 3.3e0") == [
+        ("temp", 21.5), ("rssi", -73.0), ("vbat", 3.3),
+    ]
+    assert parse_vars("fw=1.2.3 boot ok") == []
+
+
+def test_columns_align_on_shared_timestamps(tmp_path):
+    store = VarsStore(str(tmp_path / "job_20250101_000000_vars"))
+    store.append(100.0, ["temp=20 rssi=-70", "no vars here"])
+    store.append(101.0, ["rssi=-71"])
+    store.append(102.0, ["temp=22 vbat=3.3"])
+    store.close()
+
+    path = find_store(str(tmp_path), "job")
+    cols = read_columns(path)
+    assert cols["ts"] == [100.0, 101.0, 102.0]
+    assert cols["temp"] == [20.0, None, 22.0]
+    assert cols["rssi"] == [-70.0, -71.0, None]
+    assert cols["vbat"] == [None, None, 3.3]
+
+
+def test_time_range_and_reopen(tmp_path):
+    path = str(tmp_path / "job_20250101_000000_vars")
+    store = VarsStore(path)
+    for i in range(10):
+        store.append(float(i), [f"x={i}"])
+    store.close()
+
+    # a second writer on the same store keeps appending
+    store = VarsStore(path)
+    store.append(10.0, ["x=10 y=1"])
+    store.close()
+
+    cols = read_columns(path, ["x", "y"], start=3, end=11)
+    assert cols["ts"] == [float(i) for i in range(3, 11)]
+    assert cols["x"] == [float(i) for i in range(3, 11)]
+    assert cols["y"][:-1] == [None] * 7 and cols["y"][-1] == 1.0
+    assert not any(isinstance(v, float) and math.isnan(v) for v in cols["y"] if v is not None)
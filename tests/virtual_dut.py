@@ -0,0 +1,277 @@
+"""
+Virtual DUTs on pseudo-terminals, and a throughput benchmark for SerialLogger.
+
+Each VirtualDut owns a pty pair and, in a child process, writes lines of
+the form
+
+    VDUT <port> seq=<n> t=<monotonic ns> <payload> crc=<crc32>
+
+at a fixed average rate, in bursts of `burst` lines. The sequence number
+exposes lost/duplicated lines, the CRC corrupted ones, and the embedded
+CLOCK_MONOTONIC timestamp gives end-to-end latency when the line comes
+back out of the capture's line ring. Payloads come from a seeded RNG, so
+a profile produces the same bytes on every run.
+
+    python tests/virtual_dut.py --ports 4 --rate 5000 --seconds 10 --line-len 120
+
+prints a JSON report: lines/s, bytes/s, latency percentiles, CPU of the
+logger threads per port, and lost/corrupted/duplicate counts.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import string
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from app import log_index  # noqa: E402
+from app.serial_logger import SerialLogger  # noqa: E402
+
+
+@dataclass
+class Profile:
+    ports: int = 2
+    rate: float = 2000.0  # lines/s per port
+    line_len: int = 80  # payload characters per line
+    burst: int = 10  # lines written back to back
+    seconds: float = 2.0
+    baudrate: int = 921600
+    seed: int = 1
+
+
+def _payloads(seed: int, line_len: int, n: int = 256) -> List[str]:
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + " =.:-"
+    return ["".join(rng.choice(alphabet) for _ in range(line_len)).strip() or "x"
+            for _ in range(n)]
+
+
+def format_line(port: int, seq: int, t_ns: int, payload: str) -> bytes:
+    body = f"p{port} seq={seq} t={t_ns} {payload}"
+    return f"VDUT {body} crc={zlib.crc32(body.encode()):08x}\n".encode()
+
+
+def parse_line(line: str) -> Optional[dict]:
+    """{"port", "seq", "t", "ok"} for a VDUT line, None for anything else."""
+    i = line.find("VDUT ")
+    if i < 0:
+        return None
+    body, sep, crc = line[i + 5:].rpartition(" crc=")
+    try:
+        port, seq, t = body.split(" ", 3)[:3]
+        return {
+            "port": int(port[1:]),
+            "seq": int(seq[4:]),
+            "t": int(t[2:]),
+            "ok": bool(sep) and f"{zlib.crc32(body.encode()):08x}" == crc.strip(),
+        }
+    except (ValueError, IndexError):
+        return {"port": -1, "seq": -1, "t": 0, "ok": False}
+
+
+def _emit(master: int, port: int, profile: Profile) -> None:
+    """Child process body: write the profile's lines, then exit."""
+    payloads = _payloads(profile.seed + port, profile.line_len)
+    total = int(profile.rate * profile.seconds)
+    period = profile.burst / profile.rate
+    next_at = time.monotonic()
+    seq = 0
+    while seq < total:
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        t_ns = time.monotonic_ns()
+        n = min(profile.burst, total - seq)
+        os.write(master, b"".join(
+            format_line(port, s, t_ns, payloads[s % len(payloads)])
+            for s in range(seq, seq + n)
+        ))
+        seq += n
+        next_at += period
+
+
+class VirtualDut:
+    def __init__(self, port: int, profile: Profile) -> None:
+        self.port = port
+        self.profile = profile
+        self.master, self._slave = os.openpty()
+        self.device = os.ttyname(self._slave)
+        self.total = int(profile.rate * profile.seconds)
+        self._proc: Optional[multiprocessing.Process] = None
+
+    def start(self) -> None:
+        ctx = multiprocessing.get_context("fork")
+        self._proc = ctx.Process(target=_emit, args=(self.master, self.port, self.profile),
+                                 daemon=True)
+        self._proc.start()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self._proc is not None:
+            self._proc.join(timeout)
+
+    def close(self) -> None:
+        if self._proc is not None and self._proc.is_alive():
+            self._proc.terminate()
+        for fd in (self.master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def _thread_cpu_s(thread: Optional[threading.Thread]) -> float:
+    """user+system CPU seconds of one thread (Linux), 0 if unknown."""
+    if thread is None or thread.native_id is None:
+        return 0.0
+    try:
+        with open(f"/proc/self/task/{thread.native_id}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def _percentile(sorted_vals: List[float], p: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    k = min(len(sorted_vals) - 1, int(round(p / 100 * (len(sorted_vals) - 1))))
+    return round(sorted_vals[k], 3)
+
+
+def _read_log(paths: List[str]) -> List[str]:
+    lines: List[str] = []
+    for path in paths:
+        opener = gzip.open if log_index.is_compressed(path) else open
+        with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+            lines += f.read().splitlines()
+    return lines
+
+
+@dataclass
+class Report:
+    profile: Dict
+    lines_sent: int = 0
+    lines_captured: int = 0
+    lines_per_s: float = 0.0
+    bytes_per_s: float = 0.0
+    latency_ms: Dict[str, Optional[float]] = field(default_factory=dict)
+    cpu_per_port_pct: float = 0.0
+    lost: int = 0
+    corrupted: int = 0
+    duplicates: int = 0
+    writer_dropped_lines: int = 0
+
+
+def run(profile: Profile, log_dir: Optional[str] = None,
+        logger: Optional[SerialLogger] = None, drain_timeout: float = 10.0) -> Report:
+    """Capture `profile` with a SerialLogger and check every line on disk."""
+    log_dir = log_dir or tempfile.mkdtemp(prefix="vdut_")
+    logger = logger or SerialLogger(log_dir=log_dir)
+    duts = [VirtualDut(i, profile) for i in range(profile.ports)]
+    latencies: List[float] = []
+    stop = threading.Event()
+
+    def follow(ring) -> None:
+        # latency sample: time from the DUT's write to the line reaching the ring
+        cursor = ring.head
+        while not stop.is_set():
+            for _, _, line in ring.wait_after(cursor, 0.2, limit=4096):
+                now = time.monotonic_ns()
+                cursor += 1
+                parsed = parse_line(line)
+                if parsed and parsed["ok"]:
+                    latencies.append((now - parsed["t"]) / 1e6)
+            cursor = max(cursor, ring.oldest)
+
+    followers = []
+    job = f"vdut{os.getpid()}"
+    try:
+        for dut in duts:
+            logger.start(job_id=f"{job}p{dut.port}", port=dut.device, baudrate=profile.baudrate)
+            sid = logger.status()["sessions"][-1]["session_id"]
+            t = threading.Thread(target=follow, args=(logger.ring(sid),), daemon=True)
+            t.start()
+            followers.append(t)
+
+        threads = [logger._thread, logger._writer._thread]
+        cpu0 = sum(_thread_cpu_s(t) for t in threads)
+        t0 = time.monotonic()
+        for dut in duts:
+            dut.start()
+        for dut in duts:
+            dut.join(profile.seconds * 4 + 10)
+
+        expected = sum(d.total for d in duts)
+        deadline = time.monotonic() + drain_timeout
+        while time.monotonic() < deadline:
+            if sum(s["lines"] for s in logger.status()["sessions"]) >= expected:
+                break
+            time.sleep(0.01)
+        elapsed = time.monotonic() - t0
+        cpu = sum(_thread_cpu_s(t) for t in threads) - cpu0
+        status = logger.status()
+        stop.set()
+        for t in followers:
+            t.join(1.0)
+        for dut in duts:
+            logger.stop(job_id=f"{job}p{dut.port}")
+    finally:
+        stop.set()
+        for dut in duts:
+            dut.close()
+
+    report = Report(profile=asdict(profile), lines_sent=expected)
+    report.lines_captured = sum(s["lines"] for s in status["sessions"])
+    report.lines_per_s = round(report.lines_captured / elapsed, 1)
+    report.bytes_per_s = round(sum(s["bytes"] for s in status["sessions"]) / elapsed, 1)
+    report.cpu_per_port_pct = round(100 * cpu / elapsed / profile.ports, 2)
+    report.writer_dropped_lines = status["writer"]["dropped_lines"]
+    latencies.sort()
+    report.latency_ms = {f"p{p}": _percentile(latencies, p) for p in (50, 90, 99, 99.9)}
+    report.latency_ms["max"] = round(latencies[-1], 3) if latencies else None
+
+    for dut in duts:
+        seen = set()
+        for line in _read_log(log_index.find_text_logs(log_dir, f"{job}p{dut.port}")):
+            parsed = parse_line(line)
+            if parsed is None:
+                continue
+            if not parsed["ok"] or parsed["port"] != dut.port:
+                report.corrupted += 1
+            elif parsed["seq"] in seen:
+                report.duplicates += 1
+            else:
+                seen.add(parsed["seq"])
+        report.lost += dut.total - len(seen)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    defaults = Profile()
+    for name, value in asdict(defaults).items():
+        ap.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    ap.add_argument("--log-dir", default=None)
+    args = vars(ap.parse_args(argv))
+    log_dir = args.pop("log_dir")
+    report = run(Profile(**args), log_dir=log_dir)
+    print(json.dumps(asdict(report), indent=2))
+    return 0 if report.lost == report.corrupted == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())